@@ -13,7 +13,8 @@ from collections import defaultdict
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
 from benchmark_histogram_creation import ExperimentConfig
-from util.util import format_number, number_formatter, colors, markers
+from util.plotting import colors, markers, number_formatter
+from util.util import format_number
 
 
 def parse_args():
@@ -14,6 +14,8 @@ from time import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
 from rule_generation.create_histograms import create_histograms
+from rule_generation.mining_daemon import request_mining
+from util.util import load_json
 
 
 def parse_args():
@@ -42,7 +44,17 @@ def parse_args():
         help="Store a file for each experiment. Only effective if output file is provided",
         action="store_true",
     )
-    return vars(ap.parse_args())
+    ap.add_argument(
+        "--daemon",
+        "-d",
+        type=str,
+        help="Address of a running mining_daemon.py to send the runs to (ignores thread counts). Default None",
+        default=None,
+    )
+    args = vars(ap.parse_args())
+    if args["daemon"] and not os.environ.get("MINING_AUTHKEY"):
+        ap.error("set MINING_AUTHKEY to the authkey of the mining daemon")
+    return args
 
 
 @contextmanager
@@ -96,7 +108,7 @@ class BenchmarkResult:
 
 
 class Benchmark:
-    def __init__(self, num_runs, output_path, log_path, keep_logs, dates_file, store_all):
+    def __init__(self, num_runs, output_path, log_path, keep_logs, dates_file, store_all, daemon=None):
         self.num_runs = num_runs
         self.benchmarks = list()
         self.output_path = output_path
@@ -106,6 +118,7 @@ class Benchmark:
         self.dates_file = dates_file
         self.experiments_to_run = list()
         self.store_all = store_all
+        self.daemon = daemon
 
     def add_experiment(self, variable, variable_values, fixed_values):
         self.benchmarks.append((variable, variable_values, fixed_values))
@@ -179,20 +192,18 @@ class Benchmark:
             item_start = time()
             for run in range(1, self.num_runs + 1):
                 item_run_start = time()
-                p = mp.Process(target=create_histograms, args=[config])
                 log_name_value = value if variable_key != "change_file" else value.split(os.sep)[-1]
                 log_file = f"log_{time_stamp}_{variable_key}_{log_name_value}_run-{run}.txt"
                 log_path = os.path.join(self.log_path, log_file)
                 item_run_start = time()
                 with capture_log(log_path):
-                    p.start()
-                    p.join()
+                    exitcode = self.__run_item(config)
                     item_run_end = time()
                 runtime = item_run_end - item_run_start
                 num_rules = None
                 input_size = None
 
-                if p.exitcode == 0:
+                if exitcode == 0:
                     try:
                         with open(config["output"]) as f:
                             num_rules = len(f.readlines())
@@ -228,6 +239,19 @@ class Benchmark:
             print(summary)
         return results
 
+    def __run_item(self, config):
+        if self.daemon:
+            try:
+                request_mining(self.daemon, os.environ.get("MINING_AUTHKEY"), config)
+                return 0
+            except Exception as e:
+                print(f"{type(e).__name__}: {e}")
+                return 1
+        p = mp.Process(target=create_histograms, args=[config])
+        p.start()
+        p.join()
+        return p.exitcode
+
     def __indent(self, level):
         return " " * 4 * level
 
@@ -271,8 +295,8 @@ def save_reduced_days(change_occurrences, days, num_steps, path):
     return file_names
 
 
-def main(change_file, dates_file, runs, output, log_path, keep_logs, experiments, store_all):
-    benchmark = Benchmark(runs, output, log_path, keep_logs, dates_file, store_all)
+def main(change_file, dates_file, runs, output, log_path, keep_logs, experiments, store_all, daemon):
+    benchmark = Benchmark(runs, output, log_path, keep_logs, dates_file, store_all, daemon)
 
     if not os.path.isdir(log_path):
         os.makedirs(log_path)
@@ -290,14 +314,12 @@ def main(change_file, dates_file, runs, output, log_path, keep_logs, experiments
     print(f"- Logs will{' not ' if keep_logs else ' '}be deleted after benchmarking")
     random.seed(42)
 
-    with open(change_file) as f:
-        all_change_occurrences = json.load(f)
+    all_change_occurrences = load_json(change_file)
     all_changes = list(all_change_occurrences.keys())
     print(f"- Done reading base dataset {change_file} with {len(all_changes)} changes")
     random.shuffle(all_changes)
 
-    with open(dates_file) as f:
-        days = json.load(f)
+    days = load_json(dates_file)
 
     partition_sizes = [100, 500, 1000, 1750, 2500, 3750, 5000, 10000, 20000, 50000]
     input_sizes = [1000, 2500, 5000, 7500, 10000, 15000, 20000, 30000, 50000, 100000, 200000]
@@ -402,4 +424,5 @@ if __name__ == "__main__":
         args["keep_logs"],
         args["experiments"],
         args["store_separate"],
+        args["daemon"],
     )
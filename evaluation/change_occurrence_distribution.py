@@ -1,7 +1,6 @@
 #!/usr/bin/python3
 
 import argparse
-import json
 import matplotlib.pyplot as plt
 import numpy as np
 import os
@@ -11,7 +10,8 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
 from benchmark_histogram_creation import ExperimentConfig
-from util.util import format_number, number_formatter, colors, markers, date_range
+from util.plotting import colors, markers, number_formatter
+from util.util import format_number, date_range, load_json
 
 
 def parse_args():
@@ -40,8 +40,7 @@ def parse_args():
 
 
 def main(dataset, input_file, output_path, file_extensions, num_bins, log_scale, show_title):
-    with open(input_file) as f:
-        changes = json.load(f)
+    changes = load_json(input_file)
     print(f"{len(changes)} changes loaded")
 
     change_counts = [len(occurrences) for occurrences in changes.values()]
@@ -8,7 +8,10 @@ from collections import defaultdict
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
-from util.util import read_rule
+from rule_generation.rule_store import RuleStore
+from util.change_dictionary import ChangeDictionary
+from util.change_index import load_change_index
+from util.util import Entity, load_json, read_rule
 
 
 def parse_args():
@@ -26,108 +29,126 @@ def parse_args():
         help="File containing all changes. If present, change occurrences are printed. Only effective if -l.",
         default=None,
     )
+    ap.add_argument(
+        "--rule_db",
+        type=str,
+        help="Rule database of rule_store.py. If present, rules and page mappings are read from it",
+        default=None,
+    )
     return vars(ap.parse_args())
 
 
-def main(dependency_dir, category, start, end, list_external, change_file, print_clusters):
-    w = 24
-    period = f"{start}-{end}"
-    files = [f for f in os.listdir(dependency_dir) if all(c in f for c in [f"{w}_bins", period, category])]
+# yields (antecedent, page id, page name, consequent, page id, page name, support, confidence, histogram)
+def rules_from_files(files):
+    key_to_page = load_json("data/wiki/hourly/page_ids.k_to_p.json")
+    page_to_name = load_json("data/wiki/hourly/page_ids.p_to_name.json")
 
-    with open("data/wiki/hourly/page_ids.k_to_p.json", encoding="utf-8") as f:
-        key_to_page = json.load(f)
+    # ids are <infobox>_<property>_<key>_<type> or <infobox>_<key>_<type>
+    dictionary = ChangeDictionary(Entity.Row)
+    key_from_id = lambda change: dictionary.row(dictionary.intern(change))
+    for file_name in files:
+        with open(file_name, encoding="utf-8") as f:
+            for l in f:
+                a, c, rule = read_rule(l)
+                support, confidence, _, hist = rule[:4]
+                a_page_id = str(key_to_page[key_from_id(a)])
+                c_page_id = str(key_to_page[key_from_id(c)])
+                a_page_name = page_to_name[a_page_id]
+                c_page_name = page_to_name[c_page_id]
+                yield a, a_page_id, a_page_name, c, c_page_id, c_page_name, support, confidence, hist
 
-    with open("data/wiki/hourly/page_ids.p_to_name.json", encoding="utf-8") as f:
-        page_to_name = json.load(f)
+
+# page mappings have to be ingested with rule_store.py, changes need to be ingested with the row or field level
+def rules_from_store(store, sources):
+    for rule in store.rules_with_pages(sources):
+        yield rule[:-1] + (json.loads(rule[-1]),)
+
+
+def main(dependency_dir, category, start, end, list_external, change_file, print_clusters, rule_db):
+    w = 24
+    period = f"{start}-{end}"
+    is_selected = lambda f: all(c in f for c in [f"{w}_bins", period, category])
+    if rule_db:
+        store = RuleStore(rule_db, read_only=True)
+        sources = [source for source in store.sources() if is_selected(os.path.basename(source))]
+        rules = rules_from_store(store, sources)
+    else:
+        files = [os.path.join(dependency_dir, f) for f in os.listdir(dependency_dir) if is_selected(f)]
+        rules = rules_from_files(files)
 
     show_changes = list_external and not change_file is None
     if show_changes:
-        with open(change_file, encoding="utf-8") as f:
-            all_changes = json.load(f)
+        all_changes = load_change_index(change_file)
 
-    key_from_id = lambda key: key.split("_")[-2]
     out_file_name = os.path.join(dependency_dir, f"{category}_{period}_merged.csv")
     overall_rules = 0
     external_rules = 0
     clusters = dict()
     current_cluster_id = 0
+    change_pages = dict()
+    page_names = dict()
 
     with open(out_file_name, "w") as o:
         o.write(
             f"antecedent;antecedent_page_id;antecedent_page_name;consequent;consequent_page_id;consequent_page_name;support;confidence;histogram\n"
         )
 
-        for f in files:
-            file_name = os.path.join(dependency_dir, f)
-            # print("\n", file_name, sep="")
-            with open(file_name, encoding="utf-8") as f:
-                mylines = list()
-                for l in f:
-                    rule = read_rule(l)
-                    overall_rules += 1
-                    # print(rule)
-                    a = rule[0]
-                    c = rule[1]
-                    a_page_id = str(key_to_page[key_from_id(a)])
-                    c_page_id = str(key_to_page[key_from_id(c)])
-                    hist = rule[2][3]
-                    # print(a_page_id, c_page_id)
-                    h_str = str(hist)
-                    a_page_name = page_to_name[a_page_id]
-                    c_page_name = page_to_name[c_page_id]
-                    # print(a_page_name, c_page_name)
-                    conts = [
-                        a,
-                        a_page_id,
-                        a_page_name,
-                        c,
-                        c_page_id,
-                        c_page_name,
-                        str(rule[2][0]),
-                        str(rule[2][1]),
-                        h_str,
-                    ]
-                    conts_str = ";".join(conts)
-                    o.write(f"{conts_str}\n")
-                    # if sum(hist[1:]) / sum(hist) > 0.5:
-                    if a_page_id != c_page_id:
-                        external_rules += 1
-                        # print(a_page_id, c_page_id)
-                        if list_external:  # and sum(hist[1:]) / sum(hist) > 0.7:
-                            a_link = f"http://en.wikipedia.org/?curid={a_page_id}"
-                            c_link = f"http://en.wikipedia.org/?curid={c_page_id}"
-                            print("\n", a_page_name, "\t-->\t", c_page_name, "\n", a_link, "\t", c_link, sep="")
-                            print(
-                                a, c, str(rule[2][0]), str(rule[2][1]), hist, sum(hist[1:]) / sum(hist), sep="\t"
-                            )  # )
-                            if show_changes:
-                                print("antecedent:", sorted(list({occ[:-3] for occ in all_changes[a]})))
-                                print("consequent:", sorted(list({occ[:-3] for occ in all_changes[c]})))
-                        # if not print_clusters:
-                        #    continue
-                        hit_ids = list()
-                        # kw = ["pcupdate", "club-update"]
-                        # if any([any([k in x for k in kw]) for x in [a, c]]):
-                        #     continue
-                        for cluster_id, cluster in clusters.items():
-                            if a in cluster or c in cluster:
-                                cluster.add(a)
-                                cluster.add(c)
-                                hit_ids.append(cluster_id)
-                        if len(hit_ids) == 0:
-                            clusters[current_cluster_id] = {a, c}
-                            current_cluster_id += 1
-                        elif len(hit_ids) > 1:
-                            # print(f"merge due {a_page_name}\t-->\t{c_page_name}")
-                            # print(a, c, sep="\t")
-                            new_set = set()
-                            for hit_id in hit_ids:
-                                # print(f"\t{sorted({page_to_name[str(key_to_page[key_from_id(change)])] for change in clusters[hit_id]})}")
-                                new_set = new_set | clusters[hit_id]
-                            clusters[hit_ids[0]] = new_set
-                            for hit_id in hit_ids[1:]:
-                                del clusters[hit_id]
-                o.writelines(f.readlines())
+        for a, a_page_id, a_page_name, c, c_page_id, c_page_name, support, confidence, hist in rules:
+            overall_rules += 1
+            change_pages[a] = a_page_id
+            change_pages[c] = c_page_id
+            page_names[a_page_id] = a_page_name
+            page_names[c_page_id] = c_page_name
+            h_str = str(hist)
+            conts = [
+                a,
+                a_page_id,
+                a_page_name,
+                c,
+                c_page_id,
+                c_page_name,
+                str(support),
+                str(confidence),
+                h_str,
+            ]
+            conts_str = ";".join(conts)
+            o.write(f"{conts_str}\n")
+            # if sum(hist[1:]) / sum(hist) > 0.5:
+            if a_page_id != c_page_id:
+                external_rules += 1
+                # print(a_page_id, c_page_id)
+                if list_external:  # and sum(hist[1:]) / sum(hist) > 0.7:
+                    a_link = f"http://en.wikipedia.org/?curid={a_page_id}"
+                    c_link = f"http://en.wikipedia.org/?curid={c_page_id}"
+                    print("\n", a_page_name, "\t-->\t", c_page_name, "\n", a_link, "\t", c_link, sep="")
+                    print(a, c, str(support), str(confidence), hist, sum(hist[1:]) / sum(hist), sep="\t")  # )
+                    if show_changes:
+                        print("antecedent:", sorted(list({occ[:-3] for occ in all_changes[a]})))
+                        print("consequent:", sorted(list({occ[:-3] for occ in all_changes[c]})))
+                # if not print_clusters:
+                #    continue
+                hit_ids = list()
+                # kw = ["pcupdate", "club-update"]
+                # if any([any([k in x for k in kw]) for x in [a, c]]):
+                #     continue
+                for cluster_id, cluster in clusters.items():
+                    if a in cluster or c in cluster:
+                        cluster.add(a)
+                        cluster.add(c)
+                        hit_ids.append(cluster_id)
+                if len(hit_ids) == 0:
+                    clusters[current_cluster_id] = {a, c}
+                    current_cluster_id += 1
+                elif len(hit_ids) > 1:
+                    # print(f"merge due {a_page_name}\t-->\t{c_page_name}")
+                    # print(a, c, sep="\t")
+                    new_set = set()
+                    for hit_id in hit_ids:
+                        # print(f"\t{sorted({page_to_name[str(key_to_page[key_from_id(change)])] for change in clusters[hit_id]})}")
+                        new_set = new_set | clusters[hit_id]
+                    clusters[hit_ids[0]] = new_set
+                    for hit_id in hit_ids[1:]:
+                        del clusters[hit_id]
     print(
         f"\n{external_rules} / {overall_rules} external ({0 if overall_rules == 0 else round(external_rules / overall_rules * 100, 2)} %)"
     )
@@ -139,7 +160,7 @@ def main(dependency_dir, category, start, end, list_external, change_file, print
     large_clusters = list()
     cluster_sizes = defaultdict(int)
     for cluster in clusters.values():
-        cluster_pages = {str(key_to_page[key_from_id(change)]) for change in cluster}
+        cluster_pages = {change_pages[change] for change in cluster}
         cluster_sizes[len(cluster_pages)] += 1
         # if len(cluster_pages) == 2:
         #    small_clusters += 1
@@ -154,7 +175,7 @@ def main(dependency_dir, category, start, end, list_external, change_file, print
         for size, cluster in sorted(large_clusters, key=lambda x: x[0], reverse=True):
             print(f"\nCluster size {size}:")
             for page_id in cluster:
-                print(f"    {page_to_name[page_id]}    http://en.wikipedia.org/?curid={page_id}")
+                print(f"    {page_names[page_id]}    http://en.wikipedia.org/?curid={page_id}")
         # print(f"\n{small_clusters} clusters with size 2")
     print("\n - Cluster sizes:")
     len_max_size = len(str(max(cluster_sizes.keys())))
@@ -175,6 +196,7 @@ if __name__ == "__main__":
         args["list"],
         args["all_changes"],
         args["clusters"],
+        args["rule_db"],
     )
 
     end = datetime.now()
@@ -39,7 +39,7 @@ def get_added_deleted_fields(keyword, path, date):
     with open(file_name, "r") as f:
         for line in f:
             line_split = line.strip().split(";")
-            item = Field(line_split[0], line_split[1], line_split[2])
+            item = Field.interned(line_split[0], line_split[1], line_split[2])
             result.add(item)
     return result
 
@@ -56,7 +56,11 @@ def get_added_deleted_rows_columns(entity, path, date):
             keyword = line_split[0]
             table_id = line_split[1]
             item_id = line_split[2]
-            item = Field(table_id, item_id, None) if entity == Entity.Column else Field(table_id, None, item_id)
+            item = (
+                Field.interned(table_id, item_id, None)
+                if entity == Entity.Column
+                else Field.interned(table_id, None, item_id)
+            )
             if keyword == "add":
                 adds.add(item)
             else:
@@ -102,7 +106,7 @@ def main():
             with open(os.path.join(args["change_dir"], file_name), "r", encoding="utf-8") as f:
                 for line in f:
                     field_id = line.strip().split(";")
-                    field = Field.get_with_level(entity, field_id[0], field_id[1], field_id[2])
+                    field = Field.get_with_level(entity, field_id[0], field_id[1], field_id[2], interned=True)
                     if not (field in new_entities or field in deleted_entities):
                         daily_updates.add(field)
         all_daily_changes = [daily_updates, new_entities, deleted_entities]
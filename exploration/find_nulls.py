@@ -8,7 +8,8 @@ import queue
 import sys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
-from util.util import date_range, file_extension
+from util.snapshot_source import SnapshotSource
+from util.util import date_range
 
 
 def find_nulls(path, start, end, threads):
@@ -41,6 +42,7 @@ def find_nulls(path, start, end, threads):
 def find_daily_nulls(job_queue, path, null_values, null_values_lock, n):
     print(f"[Start Worker {n}]")
     candidates = ["-", "/", "", "–", "—", "%"]
+    source = SnapshotSource(path)
     while True:
         date = None
         try:
@@ -52,17 +54,14 @@ def find_daily_nulls(job_queue, path, null_values, null_values_lock, n):
             print(f"[Exit Worker {n}]")
             return
 
-        current_dir = os.path.join(path, date)
-        if not os.path.isdir(current_dir):
+        if source.mtime(date) is None:
             continue
         print(f"{date} [Worker {n}]")
 
-        files = [f for f in os.listdir(current_dir) if f.endswith(file_extension())]
         my_null_values = dict()
 
-        for file_name in files:
-            with open(os.path.join(current_dir, file_name), "r", encoding="utf-8") as f:
-                data = json.loads(f.read())
+        for _, f in source.iter_tables(date):
+            data = json.loads(f.read().decode("utf-8"))
 
             for row in data["rows"]:
                 for value in row["fields"]:
@@ -87,7 +86,9 @@ def find_daily_nulls(job_queue, path, null_values, null_values_lock, n):
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Finds null values")
-    ap.add_argument("directory", type=str, help="Directory of the change files.")
+    ap.add_argument(
+        "directory", type=str, help="Directory of the change files, per date a directory or a zip/tar archive."
+    )
     ap.add_argument("--threads", type=int, help="Number of threads. Default 2", default=2)
     ap.add_argument("--start", type=str, help="Start date. Default 2019-11-01", default="2019-11-01")
     ap.add_argument("--end", type=str, help="End date. Default 2019-11-08", default="2019-11-08")
@@ -10,12 +10,14 @@ from time import time
 from collections import defaultdict
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
-from util.util import file_extension
+from util.snapshot_source import SnapshotSource
 
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Gets table information")
-    ap.add_argument("directory", type=str, help="Directory of the change files.")
+    ap.add_argument(
+        "directory", type=str, help="Directory of the change files, per date a directory or a zip/tar archive."
+    )
     ap.add_argument("--threads", "-t", type=int, help="Number of threads. Default 2", default=2)
     return vars(ap.parse_args())
 
@@ -27,7 +29,7 @@ class TableInfo:
 
 
 def main(change_dir, threads):
-    subdirs = sorted(os.listdir(change_dir))  # [1:11]
+    subdirs = SnapshotSource(change_dir).dates()  # [1:11]
 
     with mp.Manager() as manager:
         job_queue = manager.Queue()
@@ -78,6 +80,7 @@ def daily_statistics(jobs, path, tables, table_lock, my_id):
     last_c = 0
     last_r = 0
     last_p = 0
+    source = SnapshotSource(path)
     while True:
         start = time()
         date = None
@@ -87,34 +90,32 @@ def daily_statistics(jobs, path, tables, table_lock, my_id):
             print(f"[Exit Worker {my_id}]")
             return
 
-        current_dir = os.path.join(path, date)
-        if not os.path.isdir(current_dir):
+        if source.mtime(date) is None:
             continue
         l = time()
-        files = [f for f in os.listdir(current_dir) if f.endswith(file_extension())]
         print(
-            f"{date} [Worker {my_id}] ({len(files)}) {last_t}, {last_c}, {last_r} w:{shares['work']}, p:{last_p}, m:{shares['merge']}"
+            f"{date} [Worker {my_id}] {last_t}, {last_c}, {last_r} w:{shares['work']}, p:{last_p}, m:{shares['merge']}"
         )
-        last_t = len(files)
+        last_t = 0
 
         my_tables = defaultdict(TableInfo)
         w = time()
         last_c = 0
         last_r = 0
         last_p = 0
-        for file_name in files:
+        for _, f in source.iter_tables(date):
             p_s = time()
-            with open(os.path.join(current_dir, file_name), "r", encoding="utf-8") as f:
-                table = json.load(f)
-                p_e = time()
-                last_p += p_e - p_s
-                table_info = my_tables[table["id"]]
-                columns = len(table["attributes"])
-                rows = len(table["rows"])
-                last_c += columns
-                last_r += rows
-                table_info.columns = max(table_info.columns, columns)
-                table_info.rows = max(table_info.rows, rows)
+            last_t += 1
+            table = json.loads(f.read().decode("utf-8"))
+            p_e = time()
+            last_p += p_e - p_s
+            table_info = my_tables[table["id"]]
+            columns = len(table["attributes"])
+            rows = len(table["rows"])
+            last_c += columns
+            last_r += rows
+            table_info.columns = max(table_info.columns, columns)
+            table_info.rows = max(table_info.rows, rows)
         m = time()
         combine_results(tables, my_tables, table_lock)
         e = time()
@@ -1,10 +1,8 @@
 #!/usr/bin/python3
 
-from operator import itemgetter
 import argparse
 import json
 import random
-from scipy.special import logsumexp
 import numpy as np
 import os
 import sys
@@ -21,14 +19,14 @@ def parse_args():
     ap.add_argument("--conf", type=float, help="Confidence", default=0.9)
     ap.add_argument("--min_sup", type=float, help="Minimum support", default=0.05)
     ap.add_argument("--max_sup", type=float, help="Confidence", default=0.1)
+    ap.add_argument("--chunk_size", type=int, help="Rules read at once. Default 1000000", default=1000000)
     return ap.parse_args()
 
 
 ######## Kullback Leiber Divergence ########
 def kl_divergence(p, q):
-    return sum(
-        p[i] * logsumexp(p[i] / max(0.000000001, q[i])) for i in range(len(p))
-    )  # edited because of 0 division error to logsumexp
+    # logsumexp of a single value is the value itself, edited because of 0 division error
+    return np.sum(p * (p / np.maximum(0.000000001, q)), axis=-1)
 
 
 ######## Jenson Shannon Divergence ########
@@ -38,65 +36,60 @@ def js_divergence(p, q):
 
 
 ######## Calculates probability distribution and interestingness scores ########
-def hist2pdf(data_path, output_dir, days_t=365.0, conf_t=0.9, min_sup_t=0.05, max_sup_t=0.1):
-
-    data = util.read_rules(data_path)  # use `json.loads` to do the reverse
-    high_scores = []
-    # Sample one rule within thresholds from each ancedent and sample
-    general_sample = [
-        random.sample(
-            {
-                k: v
-                for (k, v) in entities_j.items()
-                if v[1] > conf_t and (v[0] / days_t) > min_sup_t and (v[0] / days_t) < max_sup_t
-            }.items(),
-            1,
-        )[0][1][3]
-        for entity_i, entities_j in data.items()
-        if len(
-            {
-                k: v
-                for (k, v) in entities_j.items()
-                if v[1] > conf_t and (v[0] / days_t) > min_sup_t and (v[0] / days_t) < max_sup_t
-            }
+def hist2pdf(data_path, output_dir, days_t=365.0, conf_t=0.9, min_sup_t=0.05, max_sup_t=0.1, chunk_size=1000000):
+
+    # Sample one rule within thresholds from each ancedent (reservoir sampling over chunks)
+    # ancedent -> (number of rules within thresholds, sampled histogram)
+    general_sample = dict()
+    for rules in util.iter_rule_columns(data_path, chunk_size):
+        relative_support = rules.support / days_t
+        candidates = np.flatnonzero(
+            (rules.confidence > conf_t) & (relative_support > min_sup_t) & (relative_support < max_sup_t)
         )
-        > 0
-    ]
-    days = len(general_sample[0])
-    general_pdf_absolute_support_days = [0] * days
-    for day in range(days):
-        for sample in general_sample:
-            general_pdf_absolute_support_days[day] = general_pdf_absolute_support_days[day] + sample[day]
-    general_pdf_absolute_support_sum = sum(general_pdf_absolute_support_days)
-    general_pdf = [day_support / general_pdf_absolute_support_sum for day_support in general_pdf_absolute_support_days]
+        shuffled = np.random.permutation(candidates)
+        antecedents, first_rows, counts = np.unique(
+            rules.antecedents[shuffled].astype(str), return_index=True, return_counts=True
+        )
+        for antecedent, row, count in zip(antecedents.tolist(), shuffled[first_rows].tolist(), counts.tolist()):
+            seen, histogram = general_sample.get(antecedent, (0, None))
+            if random.random() < count / (seen + count):
+                histogram = rules.histograms[row]
+            general_sample[antecedent] = (seen + count, histogram)
+    if not general_sample:
+        raise ValueError(f"No rule of {data_path} within thresholds.")
+    general_pdf_absolute_support_days = np.sum([histogram for _, histogram in general_sample.values()], axis=0)
+    general_pdf = general_pdf_absolute_support_days / general_pdf_absolute_support_days.sum()
 
     # PDF Generation and interestingness score
-    for entity_i, entities_j in data.items():
+    rule_names = list()
+    rule_pdfs = list()
+    scores = list()
+    for rules in util.iter_rule_columns(data_path, chunk_size):
         # Sup/Conf Thresholds
-        for entity_j, histogram in entities_j.items():
-            if (
-                ((histogram[0] / days_t) < min_sup_t)
-                or ((histogram[0] / days_t) > max_sup_t)
-                or (histogram[1] < conf_t)
-            ):
-                continue
-            # domain_rule = histogram[4]
-            histogram = histogram[3]
-            rule_absolute_support = sum(histogram)
-            days_relative_support = []
-            for day_support in histogram:
-                days_relative_support.append(day_support / rule_absolute_support)
-            score = js_divergence(np.array(general_pdf), np.array(days_relative_support))
-            high_scores.append((str(entity_i + " => " + entity_j), days_relative_support, score))
-
-    high_scores = sorted(high_scores, key=itemgetter(2), reverse=True)
+        relative_support = rules.support / days_t
+        selected = np.flatnonzero(
+            (relative_support >= min_sup_t) & (relative_support <= max_sup_t) & (rules.confidence >= conf_t)
+        )
+        histograms = rules.histograms[selected]
+        days_relative_support = histograms / histograms.sum(axis=1, keepdims=True)
+        rule_names.append(rules.antecedents[selected] + " => " + rules.consequents[selected])
+        rule_pdfs.append(days_relative_support)
+        scores.append(js_divergence(general_pdf, days_relative_support))
+
+    rule_names = np.concatenate(rule_names)
+    rule_pdfs = np.concatenate(rule_pdfs)
+    scores = np.concatenate(scores)
+    order = np.argsort(-scores, kind="stable")
+    high_scores = list(zip(rule_names[order].tolist(), rule_pdfs[order].tolist(), scores[order].tolist()))
 
     with open(os.path.join(output_dir, "highscores.txt"), "w+") as file:
         file.write(json.dumps(high_scores))  # use `json.loads` to do the reverse
     with open(os.path.join(output_dir, "general_pdf.txt"), "w+") as file:
-        file.write(json.dumps(general_pdf))  # use `json.loads` to do the reverse
+        file.write(json.dumps(general_pdf.tolist()))  # use `json.loads` to do the reverse
 
 
 if __name__ == "__main__":
     args = parse_args()
-    hist2pdf(args.data_path, args.output_dir, args.num_timepoints, args.conf, args.min_sup, args.max_sup)
+    hist2pdf(
+        args.data_path, args.output_dir, args.num_timepoints, args.conf, args.min_sup, args.max_sup, args.chunk_size
+    )
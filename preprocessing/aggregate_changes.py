@@ -14,17 +14,24 @@ def parse_args():
     ap = argparse.ArgumentParser(description="Counts entity changes")
     ap.add_argument("change_dir", type=str, help="Directory of the change files.")
     ap.add_argument(
-        "entity", type=str, help="Entity to aggregate.", choices=[e.to_str() for e in Entity if e != Entity.Field]
+        "entity",
+        type=str,
+        nargs="+",
+        help="Entities to aggregate, all of them in one pass over the changes.",
+        choices=[e.to_str() for e in Entity if e != Entity.Field],
     )
     ap.add_argument("--start", type=str, help="Start date. Default 2019-11-02", default="2020-03-01")
     ap.add_argument("--end", type=str, help="End date. Default 2020-11-01", default="2020-11-01")
     ap.add_argument("--threads", type=int, help="Number of threads. Default 2", default=2)
+    ap.add_argument(
+        "--incremental", action="store_true", help="Skip dates whose aggregated changes are newer than their changes."
+    )
     return vars(ap.parse_args())
 
 
 def main():
     args = parse_args()
-    entity = [entity for entity in list(Entity) if entity.to_str() == args["entity"]][0]
+    entities = [entity for entity in list(Entity) if entity.to_str() in args["entity"]]
 
     with mp.Manager() as manager:
         job_queue = manager.Queue()
@@ -33,7 +40,10 @@ def main():
             job_queue.put(date)
 
         workers = [
-            mp.Process(target=aggregate_daily_changes, args=(job_queue, args["change_dir"], entity, f"{n}".rjust(2)))
+            mp.Process(
+                target=aggregate_daily_changes,
+                args=(job_queue, args["change_dir"], entities, args["incremental"], f"{n}".rjust(2)),
+            )
             for n in range(args["threads"])
         ]
 
@@ -43,7 +53,27 @@ def main():
             worker.join()
 
 
-def aggregate_daily_changes(date_queue, path, entity, n):
+def is_up_to_date(output_file, input_files):
+    if not os.path.isfile(output_file):
+        return False
+    output_mtime = os.stat(output_file).st_mtime_ns
+    return all(
+        os.stat(input_file).st_mtime_ns <= output_mtime for input_file in input_files if os.path.isfile(input_file)
+    )
+
+
+# positions of the [table, column, row] parts that identify a change of the entity level, in CSV order
+def key_positions(entity):
+    if entity == Entity.Table:
+        return [0]
+    if entity == Entity.Column:
+        return [0, 1]
+    if entity == Entity.Row:
+        return [0, 2]
+    return [0, 1, 2]
+
+
+def aggregate_daily_changes(date_queue, path, entities, incremental, n):
     print(f"[Start Worker {n}]")
     while True:
         date = None
@@ -53,25 +83,38 @@ def aggregate_daily_changes(date_queue, path, entity, n):
             print(f"[Exit Worker {n}]")
             return
 
-        daily_changes = {"update": set(), "delete": set(), "insert": set()}
+        change_types = ["update", "delete", "insert"]
+        input_files = [os.path.join(path, f"{date}_{change_type}.csv") for change_type in change_types]
+        output_files = {
+            entity: os.path.join(path, f"{date}_{entity.to_str()}_changes_aggregated.csv") for entity in entities
+        }
+        if incremental:
+            levels = [entity for entity in entities if not is_up_to_date(output_files[entity], input_files)]
+        else:
+            levels = entities
+        if not levels:
+            continue
         print(f"{date} [Worker {n}]")
-        for change_type in daily_changes:
-            file_name = os.path.join(path, f"{date}_{change_type}.csv")
+        # entity -> change type -> {(table, column/row, ...)}, each line is split once for all levels
+        daily_changes = {entity: {change_type: set() for change_type in change_types} for entity in levels}
+        positions = [(key_positions(entity), daily_changes[entity]) for entity in levels]
+        for change_type, file_name in zip(change_types, input_files):
             if not os.path.isfile(file_name):
                 continue
 
+            level_changes = [(entity_positions, changes[change_type]) for entity_positions, changes in positions]
             with open(file_name, "r", encoding="utf-8") as f:
                 for line in f:
                     field_id = line.strip().split(";")
-                    field = Field.get_with_level(entity, field_id[0], field_id[1], field_id[2])
-                    if not field in daily_changes[change_type]:
-                        daily_changes[change_type].add(field)
-
-        with open(os.path.join(path, f"{date}_{entity.to_str()}_changes_aggregated.csv"), "w") as f:
-            f.write(f"change_type;{Field.get_csv_header(entity)}\n")
-            for change_type in daily_changes:
-                for change in daily_changes[change_type]:
-                    f.write(f"{change_type};{change.get_csv(entity)}\n")
+                    for entity_positions, changes in level_changes:
+                        changes.add(tuple([field_id[position] for position in entity_positions]))
+
+        for entity in levels:
+            with open(output_files[entity], "w") as f:
+                f.write(f"change_type;{Field.get_csv_header(entity)}\n")
+                for change_type, changes in daily_changes[entity].items():
+                    for change in changes:
+                        f.write(f"{change_type};{';'.join(change)}\n")
 
 
 if __name__ == "__main__":
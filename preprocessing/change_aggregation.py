@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+import math
+import pickle
+from collections import defaultdict
+
+from util.util import Field
+
+AGGREGATED_CHANGE_TYPES = ["update", "delete", "insert"]
+
+
+# occurrences of changes aggregated to entity levels, change id -> dates as in filter_support.py
+# changes of a table and date are aggregated at once or in consecutive batches, s.t. no field changes need to be kept
+class OccurrenceAccumulator:
+    def __init__(self, entities):
+        self.entities = entities
+        self.occurrences = defaultdict(list)
+
+    # field changes as change type -> [table, column, row] of one table (or a batch of its rows) at one date
+    def add(self, date, field_changes):
+        for change_type in AGGREGATED_CHANGE_TYPES:
+            changes = field_changes.get(change_type)
+            if not changes:
+                continue
+            for entity in self.entities:
+                change_ids = {Field.get_with_level(entity, *change).get_id(entity) for change in changes}
+                for change_id in change_ids:
+                    dates = self.occurrences[f"{change_id}_{change_type[0]}"]
+                    # batches of the same table and date count once
+                    if not dates or not dates[-1] == date:
+                        dates.append(date)
+
+    def save(self, file_name):
+        with open(file_name, "wb") as f:
+            pickle.dump(dict(self.occurrences), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def merge_occurrences(file_names):
+    occurrences = defaultdict(list)
+    for file_name in file_names:
+        with open(file_name, "rb") as f:
+            for change, dates in pickle.load(f).items():
+                occurrences[change].extend(dates)
+    for dates in occurrences.values():
+        dates.sort()
+    return occurrences
+
+
+# removes changes that occur on less than min_sup or more than max_sup of the days
+def filter_by_support(occurrences, num_days, min_sup, max_sup):
+    min_days = math.ceil(min_sup * num_days)
+    max_days = math.floor(max_sup * num_days)
+    skipped_changes = [
+        change for change, dates in occurrences.items() if len(dates) > max_days or len(dates) < min_days
+    ]
+    for change in skipped_changes:
+        del occurrences[change]
+    return occurrences
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+from itertools import repeat
+
+
+# listings (table file -> [size, modification time]) of all dates seen and whether the changes of a date are processed
+# a date has to be processed again if its listing changed or if the previous version of one of its tables changed
+# table files are stat'ed on every run, rewriting a snapshot in place does not change the mtime of its directory
+class DateLedger:
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self._dates = dict()
+        # stamps of the current run, recorded for the processed dates
+        self._stamps = dict()
+
+    def load(self, ledger_file):
+        if os.path.isfile(ledger_file):
+            with open(ledger_file) as f:
+                stored = json.load(f)
+            if stored["path"] == os.path.abspath(self.path) and stored["settings"] == self.settings:
+                self._dates = stored["dates"]
+
+    def save(self, ledger_file):
+        tmp_file = f"{ledger_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"path": os.path.abspath(self.path), "settings": self.settings, "dates": self._dates}, f)
+        os.replace(tmp_file, ledger_file)
+
+    # dates in the given order that are not processed yet, changed or whose tables have a changed previous version
+    def changed_dates(self, dates, version_index):
+        changed = set()
+        for date in version_index.subdirs:
+            stamps = file_stamps(version_index, date)
+            self._stamps[date] = stamps
+            listing = dict() if stamps is None else stamps
+            seen = self._dates.get(date)
+            # ledgers of older versions have no stamps, their dates are processed again
+            seen = dict() if seen is None else dict(zip(seen["files"], seen.get("stamps", repeat(None))))
+            changed_files = [
+                file_name for file_name in set(listing) | set(seen) if not listing.get(file_name) == seen.get(file_name)
+            ]
+            if changed_files:
+                changed.add(date)
+            for file_name in changed_files:
+                next_date = version_index.next_version(file_name, date)
+                if not next_date is None:
+                    changed.add(next_date)
+        for date in changed:
+            if date in self._dates:
+                del self._dates[date]
+        return [date for date in dates if not self._dates.get(date, dict()).get("processed")]
+
+    # stores the listings of all dates, dates that were processed before and are unchanged stay processed
+    def record(self, processed_dates, version_index):
+        processed_dates = set(processed_dates)
+        for date in version_index.subdirs:
+            stamps = self._stamps[date] if date in self._stamps else file_stamps(version_index, date)
+            if stamps is None:
+                if date in self._dates:
+                    del self._dates[date]
+                continue
+            is_processed = date in processed_dates or self._dates.get(date, dict()).get("processed", False)
+            self._dates[date] = {"files": list(stamps), "stamps": list(stamps.values()), "processed": is_processed}
+
+
+# table file -> [size, modification time] of a date, None if there is no date
+# files of an archive have the modification time of the archive
+def file_stamps(version_index, date):
+    files = version_index.files(date)
+    if files is None:
+        return None
+    source = version_index.source
+    if source.is_archived(date):
+        mtime = source.mtime(date)
+        return {file_name: [size, mtime] for file_name, size in zip(files, version_index.sizes(date))}
+    stamps = dict()
+    for file_name in files:
+        try:
+            stat = os.stat(os.path.join(source.path, date, file_name))
+        except FileNotFoundError:
+            continue
+        stamps[file_name] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def settings_key(distinguish_null, num_tables, included_tables, excluded_tables):
+    tables = json.dumps([sorted(included_tables), sorted(excluded_tables)])
+    return {
+        "distinguish_null": distinguish_null,
+        "num_tables": num_tables,
+        "tables": hashlib.sha1(tables.encode()).hexdigest(),
+    }
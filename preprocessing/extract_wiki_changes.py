@@ -94,11 +94,12 @@ def extract_changes(dir, file_queue, my_id, entity, start, end, granularity, whi
                 if current_page_id is None:
                     current_page_id = page_id
                 elif current_page_id != page_id:
-                    for change in current_changes:
-                        change.table = latest_infobox_names[change.row]
-                        change_id = f"{change.get_id(entity)}_{change.type}"
+                    # the infobox of a change is the latest infobox name of its key on the page
+                    for column, change_key, change_date, change_type in current_changes:
+                        change = Field(latest_infobox_names[change_key], column, change_key)
+                        change_id = f"{change.get_id(entity)}_{change_type}"
                         if (not whitelist) or (whitelist and change.table in whitelist):
-                            changes[change_id].add(change.date)
+                            changes[change_id].add(change_date)
                     # print(i, latest_infobox_name, key, current_infobox_key)
                     for infobox_key, alias in latest_infobox_names.items():
                         template_aliases[infobox_key][0] = alias
@@ -143,10 +144,7 @@ def extract_changes(dir, file_queue, my_id, entity, start, end, granularity, whi
                             change_type = "i"
                         elif old_value is not None and new_value is None:
                             change_type = "d"
-                        change_obj = Field(infobox, column, key)
-                        change_obj.date = ts
-                        change_obj.type = change_type
-                        current_changes.append(change_obj)
+                        current_changes.append((sys.intern(column), key, ts, change_type))
 
 
 def main(change_dir, out, entity, threads, start, end, granularity, whitelist):
@@ -5,10 +5,12 @@ import json
 import math
 import multiprocessing as mp
 import os
+import pickle
 import sys
 from collections import defaultdict
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_index import write_change_index
 from util.util import Entity
 
 
@@ -49,6 +51,12 @@ def parse_args():
         default=["table"],
     )
     ap.add_argument("--pp", action="store_true", help=f"Pretty print output JSON. Default false")
+    ap.add_argument("--csr", action="store_true", help=f"Additionally store output as binary change index")
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep all occurrences in <output>.occurrences.pickle and only read new or changed days next time",
+    )
 
     return vars(ap.parse_args())
 
@@ -91,12 +99,73 @@ def aggregate_occurences(change_dir, days, my_id, entities):
     return my_dict
 
 
-def main(change_dir, threads, min_sup, max_sup, pretty_print, entities):
+# occurrences of all changes (not filtered by support) of the days read so far
+# per day, the modification times of its aggregated change files are stored to find changed days
+class OccurrenceStore:
+    def __init__(self, entities):
+        self.entities = entities
+        self.days = dict()
+        self.occurrences = defaultdict(list)
+
+    def load(self, store_file):
+        if os.path.isfile(store_file):
+            with open(store_file, "rb") as f:
+                entities, days, occurrences = pickle.load(f)
+            if entities == self.entities:
+                self.days = days
+                self.occurrences = occurrences
+
+    def save(self, store_file):
+        tmp_file = f"{store_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump((self.entities, self.days, self.occurrences), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, store_file)
+
+    def modification_times(self, change_dir, date):
+        return [
+            os.stat(os.path.join(change_dir, f"{date}_{entity}_changes_aggregated.csv")).st_mtime_ns
+            for entity in self.entities
+        ]
+
+    # days that are not stored or changed, stored occurrences of changed or removed days are dropped
+    def changed_days(self, change_dir, days):
+        changed_days = [date for date in days if not self.days.get(date) == self.modification_times(change_dir, date)]
+        dropped_days = set(self.days) - (set(days) - set(changed_days))
+        if dropped_days:
+            for change in list(self.occurrences):
+                occurences = [date for date in self.occurrences[change] if not date in dropped_days]
+                if occurences:
+                    self.occurrences[change] = occurences
+                else:
+                    del self.occurrences[change]
+            for date in dropped_days:
+                del self.days[date]
+        return changed_days
+
+    def add(self, change_dir, days, partial_results):
+        last_day = max(self.days) if self.days else None
+        for partial_result in partial_results:
+            for change, occurences in partial_result.items():
+                self.occurrences[change].extend(occurences)
+                if not last_day is None and occurences[0] < last_day:
+                    self.occurrences[change].sort()
+        for date in days:
+            self.days[date] = self.modification_times(change_dir, date)
+
+
+def main(change_dir, threads, min_sup, max_sup, pretty_print, entities, csr, incremental=False):
     actual_days = {file_name[:10] for file_name in os.listdir(change_dir) if file_name.startswith("20")}
     num_days = len(actual_days)
     days_list = list(actual_days)
     days_list.sort()
-    days_per_thread = distribute_days(num_days, threads)
+    output = "_".join(entities) + "_changes_aggregated"
+    if incremental:
+        store = OccurrenceStore(entities)
+        store.load(f"{output}.occurrences.pickle")
+        days_list = store.changed_days(change_dir, days_list)
+        print(f"{len(days_list)} of {num_days} days are new or changed")
+    new_days = days_list
+    days_per_thread = distribute_days(len(days_list), threads)
     tasks = list()
 
     for thread in range(threads):
@@ -113,14 +182,19 @@ def main(change_dir, threads, min_sup, max_sup, pretty_print, entities):
     min_days = math.ceil(min_sup * num_days)
     max_days = math.floor(max_sup * num_days)
 
-    result = defaultdict(list)
-    for partial_result, t_id in zip(results, range(1, len(results) + 1)):
-        print(f"Merging result {t_id}/{threads}")
-        if partial_result is None:
-            print(f"Warning: No results from worker {t_id}!")
-            continue
-        for change, occurences in partial_result.items():
-            result[change].extend(occurences)
+    if incremental:
+        store.add(change_dir, new_days, [partial_result for partial_result in results if not partial_result is None])
+        store.save(f"{output}.occurrences.pickle")
+        result = store.occurrences
+    else:
+        result = defaultdict(list)
+        for partial_result, t_id in zip(results, range(1, len(results) + 1)):
+            print(f"Merging result {t_id}/{threads}")
+            if partial_result is None:
+                print(f"Warning: No results from worker {t_id}!")
+                continue
+            for change, occurences in partial_result.items():
+                result[change].extend(occurences)
 
     skipped_changes = set()
     for change, occurences in result.items():
@@ -134,10 +208,21 @@ def main(change_dir, threads, min_sup, max_sup, pretty_print, entities):
     print(f"{len(result)} changes remaining with min sup {min_sup} and max sup {max_sup}")
     indent = 4 if pretty_print else None
 
-    with open("_".join(entities) + "_changes_aggregated.json", "w") as f:
+    with open(f"{output}.json", "w") as f:
         json.dump(result, f, indent=indent)
+    if csr:
+        write_change_index(result, f"{output}.csr")
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args["change_dir"], args["threads"], args["min_sup"], args["max_sup"], args["pp"], args["entity"])
+    main(
+        args["change_dir"],
+        args["threads"],
+        args["min_sup"],
+        args["max_sup"],
+        args["pp"],
+        args["entity"],
+        args["csr"],
+        args["incremental"],
+    )
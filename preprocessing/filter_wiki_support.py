@@ -9,6 +9,7 @@ from collections import defaultdict
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_index import load_change_index, write_change_index
 from util.util import date_range
 
 
@@ -18,12 +19,12 @@ def parse_args():
     ap.add_argument("out", type=str, help="Output file.")
     ap.add_argument("--min_sup", type=float, help="Minimum support. Default 0.05", default=0.05)
     ap.add_argument("--max_sup", type=float, help="maximum support. Default 0.1", default=0.1)
+    ap.add_argument("--csr", action="store_true", help="Additionally store output as binary change index")
     return vars(ap.parse_args())
 
 
-def main(change_file, out, min_sup, max_sup):
-    with open(change_file, encoding="utf-8") as f:
-        all_changes = json.load(f)
+def main(change_file, out, min_sup, max_sup, csr):
+    all_changes = load_change_index(change_file)
 
     # all_changes_dates = dict()
     print(f"input: {len(all_changes)} changes")
@@ -45,21 +46,21 @@ def main(change_file, out, min_sup, max_sup):
     max_sup_threshold = math.floor(len(all_dates) * max_sup)
 
     print(min_sup_threshold, max_sup_threshold)
-    skip_changes = list()
-    for change, occurrences in all_changes.items():
-        if len(occurrences) > max_sup_threshold or len(occurrences) < min_sup_threshold:
-            skip_changes.append(change)
-
-    for change in skip_changes:
-        del all_changes[change]
+    all_changes = {
+        change: occurrences
+        for change, occurrences in all_changes.items()
+        if len(occurrences) <= max_sup_threshold and len(occurrences) >= min_sup_threshold
+    }
 
     print(f"{len(all_changes)} changes remaining with min sup {min_sup} and max sup {max_sup}")
     with open(out, "w", encoding="utf-8") as f:
         json.dump(all_changes, f)
+    if csr:
+        write_change_index(all_changes, f"{os.path.splitext(out)[0]}.csr")
     with open(f"{out}.dates.json", "w", encoding="utf-8") as f:
         json.dump(all_dates, f)
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args["change_file"], args["out"], args["min_sup"], args["max_sup"])
+    main(args["change_file"], args["out"], args["min_sup"], args["max_sup"], args["csr"])
@@ -5,15 +5,32 @@ import json
 import multiprocessing as mp
 import os
 import queue
+import shutil
 import sys
+import tempfile
+import time
+from collections import OrderedDict
+from functools import partial
+from itertools import chain
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
-from util.util import date_range, file_extension
+from preprocessing.change_aggregation import OccurrenceAccumulator, filter_by_support, merge_occurrences
+from preprocessing.date_ledger import DateLedger, settings_key
+from preprocessing.fingerprint_manifest import FingerprintManifest
+from preprocessing.row_hashes import RowHashes, read_rows, scan_table
+from preprocessing.snapshot_prefetch import SnapshotReader
+from preprocessing.table_stream import RowIndex, batches, iter_table, read_header, row_key
+from preprocessing.table_version_index import TableVersionIndex
+from util.change_index import write_change_index
+from util.snapshot_source import SnapshotSource
+from util.util import Entity, date_range, file_extension
 
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Extracts change transactions")
-    ap.add_argument("directory", type=str, help="Directory of the change files.")
+    ap.add_argument(
+        "directory", type=str, help="Directory of the change files, per date a directory or a zip/tar archive."
+    )
     ap.add_argument("--start", type=str, help="Start date. Default 2020-05-01", default="2020-05-01")
     ap.add_argument("--end", type=str, help="End date. Default 2020-11-01", default="2020-11-01")
     ap.add_argument("--base_date", type=str, help="Date of whole data start. Default 2019-11-01", default="2019-11-01")
@@ -25,14 +42,97 @@ def parse_args():
         "--included_tables", type=str, default="", help="File with tables to include. If not specified, use all."
     )
     ap.add_argument("--excluded_tables", type=str, default="", help="File with tables to exclude.")
-    return vars(ap.parse_args())
+    ap.add_argument(
+        "--fingerprints",
+        type=str,
+        default=None,
+        help="Directory to store size, mtime and hash per snapshot. If present, unchanged tables are not parsed.",
+    )
+    ap.add_argument(
+        "--row_hashes",
+        type=str,
+        default=None,
+        help="Directory to store row hashes per snapshot. If present, only changed rows of older snapshots are read.",
+    )
+    ap.add_argument(
+        "--engine",
+        type=str,
+        choices=["python", "numpy"],
+        default="python",
+        help="Diff fields row by row (python) or as column arrays (numpy). Default python",
+    )
+    ap.add_argument(
+        "--stream_above",
+        type=float,
+        default=None,
+        help="Stream snapshots larger than this size in MiB instead of loading them. Default: never",
+    )
+    ap.add_argument(
+        "--batch_mib",
+        type=float,
+        default=64,
+        help="Size of the snapshots that are diffed as one work unit in MiB. Default 64",
+    )
+    ap.add_argument(
+        "--affinity",
+        action="store_true",
+        help="Diff all snapshots of a table in one worker, keeping the previous snapshot in memory.",
+    )
+    ap.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Number of snapshot files each worker reads ahead in background threads. Default 0",
+    )
+    ap.add_argument(
+        "--prefetch_mib",
+        type=float,
+        default=256,
+        help="Maximum size of the snapshot files read ahead per worker in MiB. Default 256",
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process dates that are new or changed since the last run with this output directory.",
+    )
+    ap.add_argument(
+        "--aggregate",
+        type=str,
+        nargs="*",
+        choices=[e.to_str() for e in Entity if e != Entity.Field],
+        default=[],
+        help="Entities to aggregate the changes to. If present, the support-filtered change index is written.",
+    )
+    ap.add_argument("--min_sup", type=float, help="Minimal support of aggregated changes. Default 0.05", default=0.05)
+    ap.add_argument("--max_sup", type=float, help="Maximal support of aggregated changes. Default 0.5", default=0.5)
+    ap.add_argument("--csr", action="store_true", help="Additionally store the change index as binary change index")
+    ap.add_argument(
+        "--no_field_changes", action="store_true", help="Do not write the field changes if changes are aggregated."
+    )
+    ap.add_argument(
+        "--version_index",
+        type=str,
+        default=None,
+        help="File to store the snapshot dates per table. Default <output>/table_versions.json",
+    )
+    args = vars(ap.parse_args())
+    if args["incremental"] and args["aggregate"]:
+        ap.error("--aggregate needs the changes of all dates and cannot be combined with --incremental")
+    if args["fingerprints"] or args["row_hashes"]:
+        source = SnapshotSource(args["directory"])
+        archived = [date for date in date_range(args["base_date"], args["end"]) if source.is_archived(date)]
+        if archived:
+            ap.error(f"--fingerprints and --row_hashes need extracted snapshot directories, {archived[0]} is archived")
+    return args
 
 
-def find_row_match(rows, row_id):
+# index row id -> row, the first row wins if ids are not unique
+def index_rows(rows):
+    row_index = dict()
     for row in rows:
-        if row_id == row["id"]:
-            return row
-    return None
+        if not row["id"] in row_index:
+            row_index[row["id"]] = row
+    return row_index
 
 
 def is_null(value):
@@ -46,44 +146,58 @@ def is_null(value):
     return False
 
 
-def find_field_changes(table_id, new_dir, old_dir, distinguish_null):
-    with open(f"{new_dir}{os.sep}{table_id}{file_extension()}", encoding="utf-8") as f:
-        n = json.loads(f.read())
+def load_table(file_name, reader=None):
+    if reader:
+        return json.loads(reader.read(file_name).decode("utf-8"))
+    with open(file_name, encoding="utf-8") as f:
+        return json.loads(f.read())
 
-    n_rows = n["rows"]
-    n_attributes = n["attributes"]
-    n_attr_map = {}
-    n_attr_map_inv = {}
-    for attr_index in range(len(n_attributes)):
-        attr = n_attributes[attr_index]
-        n_attr_map[attr_index] = attr["id"]
-        n_attr_map_inv[attr["id"]] = attr_index
-    update_fields = list()
-    delete_fields = list()
+
+# with a level, the inserts are aggregated to it as in diff_rows_aggregated
+def new_table_changes(table_id, n_attr_ids, n_rows, level=None):
+    if not level is None:
+        insert_fields = list()
+        if n_attr_ids and n_rows:
+            if level == Entity.Column:
+                insert_fields = [[table_id, str(attr), ""] for attr in dict.fromkeys(n_attr_ids)]
+            elif level == Entity.Row:
+                insert_fields = [
+                    [table_id, "", row_id] for row_id in dict.fromkeys(str(n_row["id"]) for n_row in n_rows)
+                ]
+            else:
+                insert_fields = [[table_id, "", ""]]
+        return list(), list(), insert_fields, table_id, list(), list()
+    n_attr_map_inv = {attr: attr_index for attr_index, attr in enumerate(n_attr_ids)}
     insert_fields = list()
     column_add_delete = list()
     row_add_delete = list()
-
-    if old_dir is None:
-        for n_row in n_rows:
-            for attr in n_attr_map_inv:
-                insert_fields.append([table_id, str(attr), str(n_row["id"])])
-            row_add_delete.append(["insert", table_id, str(n_row["id"])])
+    for n_row in n_rows:
         for attr in n_attr_map_inv:
-            column_add_delete.append(["insert", table_id, str(attr)])
-        return update_fields, delete_fields, insert_fields, table_id, column_add_delete, row_add_delete
+            insert_fields.append([table_id, str(attr), str(n_row["id"])])
+        row_add_delete.append(["insert", table_id, str(n_row["id"])])
+    for attr in n_attr_map_inv:
+        column_add_delete.append(["insert", table_id, str(attr)])
+    return list(), list(), insert_fields, table_id, column_add_delete, row_add_delete
 
-    with open(f"{old_dir}{os.sep}{table_id}{file_extension()}", encoding="utf-8") as f:
-        o = json.loads(f.read())
 
-    o_rows = o["rows"]
-    o_attributes = o["attributes"]
+# o_matches[i] is the old row with the id of n_rows[i] or None, the first old row wins if ids are not unique
+# o_row_states are (id, number of fields, whether the id is still present) of all old rows
+def diff_rows(table_id, n_attr_ids, n_rows, o_attr_ids, o_matches, o_row_states, distinguish_null):
+    n_attr_map = {}
+    n_attr_map_inv = {}
+    for attr_index, attr in enumerate(n_attr_ids):
+        n_attr_map[attr_index] = attr
+        n_attr_map_inv[attr] = attr_index
     o_attr_map = {}
     o_attr_map_inv = {}
-    for attr_index in range(len(o_attributes)):
-        attr = o_attributes[attr_index]
-        o_attr_map[attr["id"]] = attr_index
-        o_attr_map_inv[attr_index] = attr["id"]
+    for attr_index, attr in enumerate(o_attr_ids):
+        o_attr_map[attr] = attr_index
+        o_attr_map_inv[attr_index] = attr
+    update_fields = list()
+    delete_fields = list()
+    insert_fields = list()
+    column_add_delete = list()
+    row_add_delete = list()
 
     for attr in n_attr_map_inv:
         if not attr in o_attr_map:
@@ -92,8 +206,7 @@ def find_field_changes(table_id, new_dir, old_dir, distinguish_null):
         if not attr in n_attr_map_inv:
             column_add_delete.append(["delete", table_id, str(attr)])
 
-    for n_row in n_rows:
-        o_row = find_row_match(o_rows, n_row["id"])
+    for n_row, o_row in zip(n_rows, o_matches):
         n_fields = n_row["fields"]
         if not o_row is None:
             if not n_row == o_row:
@@ -123,52 +236,443 @@ def find_field_changes(table_id, new_dir, old_dir, distinguish_null):
                 attr = n_attr_map[field_index]
                 insert_fields.append([table_id, str(attr), str(n_row["id"])])
             row_add_delete.append(["insert", table_id, str(n_row["id"])])
-    for o_row in o_rows:
-        n_row = find_row_match(n_rows, o_row["id"])
-        o_fields = o_row["fields"]
-        if not n_row is None:
-            n_fields = n_row["fields"]
-            for field_index in range(len(o_fields)):
+    for o_row_id, o_num_fields, o_row_kept in o_row_states:
+        if o_row_kept:
+            for field_index in range(o_num_fields):
                 attr = o_attr_map_inv[field_index]
                 if not attr in n_attr_map_inv:
-                    delete_fields.append([table_id, str(attr), str(o_row["id"])])
+                    delete_fields.append([table_id, str(attr), str(o_row_id)])
         else:
-            for field_index in range(len(o_fields)):
+            for field_index in range(o_num_fields):
                 attr = o_attr_map_inv[field_index]
-                delete_fields.append([table_id, str(attr), str(o_row["id"])])
-            row_add_delete.append(["delete", table_id, str(o_row["id"])])
+                delete_fields.append([table_id, str(attr), str(o_row_id)])
+            row_add_delete.append(["delete", table_id, str(o_row_id)])
+    return update_fields, delete_fields, insert_fields, None, column_add_delete, row_add_delete
+
+
+# same output as diff_rows, but fields are compared as column arrays aligned on row id and attribute id
+def diff_rows_vectorized(table_id, n_attr_ids, n_rows, o_attr_ids, o_matches, o_row_states, distinguish_null):
+    import numpy as np
+
+    o_row_states = list(o_row_states)
+    n_width = len(n_attr_ids)
+    o_width = len(o_attr_ids)
+    # ragged rows or duplicate attributes are left to diff_rows
+    if (
+        any(not len(n_row["fields"]) == n_width for n_row in n_rows)
+        or any(not o_num_fields == o_width for _, o_num_fields, _ in o_row_states)
+        or any(not len(o_row["fields"]) == o_width for o_row in o_matches if not o_row is None)
+        or not len(set(n_attr_ids)) == n_width
+        or not len(set(o_attr_ids)) == o_width
+    ):
+        return diff_rows(table_id, n_attr_ids, n_rows, o_attr_ids, o_matches, o_row_states, distinguish_null)
+
+    o_attr_map = {attr: attr_index for attr_index, attr in enumerate(o_attr_ids)}
+    n_attr_set = set(n_attr_ids)
+    column_add_delete = list()
+    for attr in n_attr_ids:
+        if not attr in o_attr_map:
+            column_add_delete.append(["insert", table_id, str(attr)])
+    for attr in o_attr_ids:
+        if not attr in n_attr_set:
+            column_add_delete.append(["delete", table_id, str(attr)])
+
+    n_attr_names = [str(attr) for attr in n_attr_ids]
+    o_attr_names = [str(attr) for attr in o_attr_ids]
+    n_row_names = [str(n_row["id"]) for n_row in n_rows]
+    o_row_names = [str(o_row_id) for o_row_id, _, _ in o_row_states]
+
+    # new rows: inserted rows, and rows that differ from their old version
+    is_inserted = np.fromiter((o_row is None for o_row in o_matches), dtype=bool, count=len(n_rows))
+    differs = np.fromiter(
+        (not o_row is None and not n_row == o_row for n_row, o_row in zip(n_rows, o_matches)),
+        dtype=bool,
+        count=len(n_rows),
+    )
+    insert_mask = np.zeros((len(n_rows), n_width), dtype=bool)
+    delete_mask = np.zeros((len(n_rows), n_width), dtype=bool)
+    update_mask = np.zeros((len(n_rows), n_width), dtype=bool)
+    insert_mask[is_inserted] = True
+
+    differing_rows = np.flatnonzero(differs)
+    if len(differing_rows) > 0:
+        o_columns = np.array([o_attr_map.get(attr, -1) for attr in n_attr_ids], dtype=np.int64)
+        is_new_column = o_columns == -1
+        insert_mask[np.ix_(differing_rows, np.flatnonzero(is_new_column))] = True
+
+        common_columns = np.flatnonzero(~is_new_column)
+        n_values = np.fromiter(
+            chain.from_iterable(n_rows[row_index]["fields"] for row_index in differing_rows),
+            dtype=object,
+            count=len(differing_rows) * n_width,
+        ).reshape(len(differing_rows), n_width)[:, common_columns]
+        o_values = np.fromiter(
+            chain.from_iterable(o_matches[row_index]["fields"] for row_index in differing_rows),
+            dtype=object,
+            count=len(differing_rows) * o_width,
+        ).reshape(len(differing_rows), o_width)[:, o_columns[common_columns]]
+        changed = ~(n_values == o_values).astype(bool)
+
+        changed_updates = changed
+        if distinguish_null:
+            # null masks of the changed fields only
+            n_is_null = np.zeros(changed.shape, dtype=bool)
+            o_is_null = np.zeros(changed.shape, dtype=bool)
+            n_is_null[changed] = [is_null(value) for value in n_values[changed]]
+            o_is_null[changed] = [is_null(value) for value in o_values[changed]]
+            changed_updates = changed & ~n_is_null & ~o_is_null
+            changed_deletes = changed & n_is_null & ~o_is_null
+            changed_inserts = changed & o_is_null & ~n_is_null
+            delete_mask[np.ix_(differing_rows, common_columns)] = changed_deletes
+            insert_mask[np.ix_(differing_rows, common_columns)] = changed_inserts
+        update_mask[np.ix_(differing_rows, common_columns)] = changed_updates
+
+    def fields(mask, attr_names, row_names):
+        return [
+            [table_id, attr_names[attr_index], row_names[row_index]] for row_index, attr_index in zip(*np.nonzero(mask))
+        ]
+
+    update_fields = fields(update_mask, n_attr_names, n_row_names)
+    insert_fields = fields(insert_mask, n_attr_names, n_row_names)
+    delete_fields = fields(delete_mask, n_attr_names, n_row_names)
+    row_add_delete = [["insert", table_id, n_row_names[row_index]] for row_index in np.flatnonzero(is_inserted)]
+
+    # old rows: deleted rows, and deleted columns of kept rows
+    is_deleted = np.fromiter((not o_row_kept for _, _, o_row_kept in o_row_states), dtype=bool, count=len(o_row_states))
+    is_deleted_column = np.fromiter((not attr in n_attr_set for attr in o_attr_ids), dtype=bool, count=o_width)
+    o_delete_mask = is_deleted[:, np.newaxis] | is_deleted_column[np.newaxis, :]
+    delete_fields += fields(o_delete_mask, o_attr_names, o_row_names)
+    row_add_delete += [["delete", table_id, o_row_names[row_index]] for row_index in np.flatnonzero(is_deleted)]
     return update_fields, delete_fields, insert_fields, None, column_add_delete, row_add_delete
 
 
-def find_older_subdir(file_name, path, subdirs):
-    subdirs_rev = subdirs[::-1]
-    for subdir in subdirs_rev:
-        subdir_path = os.path.join(path, subdir)
-        if not os.path.isdir(subdir_path):
+# like diff_rows, but field changes are aggregated to level while diffing (table, column or row)
+# returns update, delete and insert as [table, column, row] with "" for the aggregated parts, no column or row changes
+# inserted and deleted rows and columns are found without comparing fields, a table-level diff stops comparing fields
+# as soon as all change types are found
+def diff_rows_aggregated(
+    table_id, n_attr_ids, n_rows, o_attr_ids, o_matches, o_row_states, distinguish_null, level=Entity.Table
+):
+    changes = {"update": set(), "delete": set(), "insert": set()}
+
+    def key(attr, row_id):
+        if level == Entity.Column:
+            return (table_id, str(attr), "")
+        if level == Entity.Row:
+            return (table_id, "", str(row_id))
+        return (table_id, "", "")
+
+    n_attr_map = dict(enumerate(n_attr_ids))
+    n_attr_set = set(n_attr_ids)
+    o_attr_map = {attr: attr_index for attr_index, attr in enumerate(o_attr_ids)}
+    o_attr_map_inv = dict(enumerate(o_attr_ids))
+    deleted_positions = [attr_index for attr_index, attr in enumerate(o_attr_ids) if not attr in n_attr_set]
+    new_positions = [attr_index for attr_index, attr in enumerate(n_attr_ids) if not attr in o_attr_map]
+
+    # all fields of inserted rows, and new columns of changed rows
+    for n_row, o_row in zip(n_rows, o_matches):
+        num_fields = len(n_row["fields"])
+        if o_row is None:
+            positions = range(num_fields) if level == Entity.Column else range(min(num_fields, 1))
+        elif new_positions and not n_row == o_row:
+            positions = [attr_index for attr_index in new_positions if attr_index < num_fields]
+            if not level == Entity.Column:
+                positions = positions[:1]
+        else:
             continue
-        subdir_files = os.listdir(subdir_path)
-        if file_name in subdir_files:
-            return subdir_path
-    return None
+        for field_index in positions:
+            changes["insert"].add(key(n_attr_map[field_index], n_row["id"]))
+    # all fields of deleted rows, and deleted columns of kept rows
+    for o_row_id, o_num_fields, o_row_kept in o_row_states:
+        if o_row_kept:
+            positions = [attr_index for attr_index in deleted_positions if attr_index < o_num_fields]
+        else:
+            positions = range(o_num_fields)
+        if not level == Entity.Column:
+            positions = positions[:1]
+        for field_index in positions:
+            changes["delete"].add(key(o_attr_map_inv[field_index], o_row_id))
+
+    for n_row, o_row in zip(n_rows, o_matches):
+        if level == Entity.Table and changes["update"] and changes["delete"] and changes["insert"]:
+            break
+        if o_row is None or n_row == o_row:
+            continue
+        n_fields = n_row["fields"]
+        o_fields = o_row["fields"]
+        for field_index in range(len(n_fields)):
+            attr = n_attr_map[field_index]
+            if not attr in o_attr_map:
+                continue
+            o_field = o_fields[o_attr_map[attr]]
+            n_field = n_fields[field_index]
+            if not n_field == o_field:
+                change_type = "update"
+                if distinguish_null:
+                    n_is_null = is_null(n_field)
+                    o_is_null = is_null(o_field)
+                    if n_is_null and o_is_null:
+                        continue
+                    if n_is_null:
+                        change_type = "delete"
+                    elif o_is_null:
+                        change_type = "insert"
+                changes[change_type].add(key(attr, n_row["id"]))
+    update_fields, delete_fields, insert_fields = [
+        [list(change) for change in changes[change_type]] for change_type in ["update", "delete", "insert"]
+    ]
+    return update_fields, delete_fields, insert_fields, None, list(), list()
 
 
-def save_changes(changes, file_name):
-    with open(file_name, "w", encoding="utf-8") as f:
-        for change in changes:
-            if not type(change) == list:
-                f.write(change)
-            else:
-                f.write(";".join(change))
-            f.write("\n")
+DIFF_ENGINES = {"python": diff_rows, "numpy": diff_rows_vectorized}
+
+
+# finest entity level the changes can be aggregated to while diffing, None if field changes are needed
+def aggregation_level(entities, write_field_changes):
+    if not entities or write_field_changes or (Entity.Column in entities and Entity.Row in entities):
+        return None
+    for level in [Entity.Column, Entity.Row]:
+        if level in entities:
+            return level
+    return Entity.Table
+
+
+def diff_engine(settings):
+    if settings.aggregation_level is None:
+        return DIFF_ENGINES[settings.engine]
+    return partial(diff_rows_aggregated, level=settings.aggregation_level)
+
+
+def diff_tables(table_id, n, o, distinguish_null, diff=diff_rows):
+    o_row_index = index_rows(o["rows"])
+    n_row_ids = set(n_row["id"] for n_row in n["rows"])
+    return diff(
+        table_id,
+        [attr["id"] for attr in n["attributes"]],
+        n["rows"],
+        [attr["id"] for attr in o["attributes"]],
+        [o_row_index.get(n_row["id"]) for n_row in n["rows"]],
+        [(o_row["id"], len(o_row["fields"]), o_row["id"] in n_row_ids) for o_row in o["rows"]],
+        distinguish_null,
+    )
+
+
+def find_field_changes(table_id, new_dir, old_dir, distinguish_null, diff=diff_rows, reader=None, level=None):
+    n = load_table(f"{new_dir}{os.sep}{table_id}{file_extension()}", reader)
+    if old_dir is None:
+        return new_table_changes(table_id, [attr["id"] for attr in n["attributes"]], n["rows"], level)
+    o = load_table(f"{old_dir}{os.sep}{table_id}{file_extension()}", reader)
+    return diff_tables(table_id, n, o, distinguish_null, diff)
+
+
+# like find_field_changes, but only rows whose hash differs from the previous snapshot's sidecar are read from it
+def find_localized_field_changes(
+    table_id, new_dir, old_dir, distinguish_null, row_hashes, diff=diff_rows, reader=None, level=None
+):
+    file_name = f"{table_id}{file_extension()}"
+    new_file = os.path.join(new_dir, file_name)
+    scan = scan_table(new_file, reader.read(new_file) if reader else None)
+    row_hashes.save(new_dir, file_name, scan)
+    n_attr_ids = [attr["id"] for attr in scan.table["attributes"]]
+    if old_dir is None:
+        return new_table_changes(table_id, n_attr_ids, scan.rows, level)
+
+    sidecar = row_hashes.load(old_dir, file_name)
+    if sidecar is None:
+        o = load_table(os.path.join(old_dir, file_name), reader)
+        return diff_tables(table_id, scan.table, o, distinguish_null, diff)
+
+    o_hashes = sidecar["hashes"]
+    o_positions = dict()
+    for o_position, o_row_id in enumerate(sidecar["ids"]):
+        if not o_row_id in o_positions:
+            o_positions[o_row_id] = o_position
+    # same raw row text, hash 0 is unknown
+    o_matches = [o_positions.get(n_row_id) for n_row_id in scan.ids]
+    for n_position, n_hash in enumerate(scan.hashes):
+        o_position = o_matches[n_position]
+        if not o_position is None and not o_hashes[o_position] == 0 and o_hashes[o_position] == n_hash:
+            o_matches[n_position] = scan.rows[n_position]
+    changed_positions = set(o_match for o_match in o_matches if type(o_match) == int)
+    changed_rows = read_rows(os.path.join(old_dir, file_name), sidecar, changed_positions)
+    for n_position, o_match in enumerate(o_matches):
+        if type(o_match) == int:
+            o_matches[n_position] = changed_rows[scan.ids[n_position]]
+
+    n_row_ids = set(scan.ids)
+    o_row_states = [
+        (o_row_id, o_num_fields, o_row_id in n_row_ids)
+        for o_row_id, o_num_fields in zip(sidecar["ids"], sidecar["num_fields"])
+    ]
+    return diff(table_id, n_attr_ids, scan.rows, sidecar["attributes"], o_matches, o_row_states, distinguish_null)
+
+
+# like find_field_changes, but with memory independent of the table size:
+# rows are streamed in batches, the old rows are kept in an on-disk index
+# with emit, the field and row changes of each batch are passed to emit(changes) instead of being returned
+def find_streamed_field_changes(
+    table_id, new_dir, old_dir, distinguish_null, diff=diff_rows, batch_size=10000, source=None, level=None, emit=None
+):
+    update_fields = list()
+    delete_fields = list()
+    insert_fields = list()
+    row_add_delete = list()
 
+    def add_batch(t_updates, t_deletes, t_inserts, t_rows):
+        if emit:
+            emit((t_updates, t_deletes, t_inserts, None, list(), t_rows))
+            return
+        update_fields.extend(t_updates)
+        delete_fields.extend(t_deletes)
+        insert_fields.extend(t_inserts)
+        row_add_delete.extend(t_rows)
+
+    file_name = f"{table_id}{file_extension()}"
+    new_file = os.path.join(new_dir, file_name)
+    n_header = dict()
+
+    # attributes are usually stored before the rows, otherwise they are read in a separate pass
+    def n_attributes():
+        if not "attributes" in n_header:
+            n_header.update(read_header(new_file, source))
+        return [attr["id"] for attr in n_header["attributes"]]
+
+    if old_dir is None:
+        n_attr_ids = None
+        for batch in batches(iter_table(new_file, n_header, source=source), batch_size):
+            if n_attr_ids is None:
+                n_attr_ids = n_attributes()
+            _, _, t_inserts, _, _, t_rows = new_table_changes(
+                table_id, n_attr_ids, [n_row for n_row, _ in batch], level
+            )
+            add_batch(list(), list(), t_inserts, t_rows)
+        column_add_delete = new_table_changes(table_id, n_attributes(), list(), level)[4]
+        return list(), list(), insert_fields, table_id, column_add_delete, row_add_delete
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        row_index = RowIndex(os.path.join(tmp_dir, "rows.db"))
+        o_header = dict()
+        for batch in batches(iter_table(os.path.join(old_dir, file_name), o_header, source=source), batch_size):
+            row_index.add_old_rows(batch)
+        o_attr_ids = [attr["id"] for attr in o_header["attributes"]]
+
+        n_attr_ids = None
+        for batch in batches(iter_table(new_file, n_header, source=source), batch_size):
+            if n_attr_ids is None:
+                n_attr_ids = n_attributes()
+            row_index.add_new_rows(batch)
+            o_raw_rows = row_index.old_rows(row_key(n_row["id"]) for n_row, _ in batch)
+            o_matches = list()
+            for n_row, n_raw in batch:
+                o_raw = o_raw_rows.get(row_key(n_row["id"]))
+                if o_raw is None:
+                    o_matches.append(None)
+                elif o_raw == n_raw and not "NaN" in n_raw:
+                    # same raw row text
+                    o_matches.append(n_row)
+                else:
+                    o_matches.append(json.loads(o_raw))
+            t_updates, t_deletes, t_inserts, _, _, t_rows = diff(
+                table_id, n_attr_ids, [n_row for n_row, _ in batch], o_attr_ids, o_matches, list(), distinguish_null
+            )
+            add_batch(t_updates, t_deletes, t_inserts, t_rows)
+        n_attr_ids = n_attributes()
+
+        for o_row_states in batches(row_index.old_row_states(), batch_size):
+            _, t_deletes, _, _, _, t_rows = diff(
+                table_id, n_attr_ids, list(), o_attr_ids, list(), o_row_states, distinguish_null
+            )
+            add_batch(list(), t_deletes, list(), t_rows)
+        row_index.close()
+    column_add_delete = diff(table_id, n_attr_ids, list(), o_attr_ids, list(), list(), distinguish_null)[4]
+    return update_fields, delete_fields, insert_fields, None, column_add_delete, row_add_delete
+
+
+def change_lines(changes):
+    return "".join((change if not type(change) == list else ";".join(change)) + "\n" for change in changes)
+
+
+CHANGE_TYPES = ["update", "insert", "delete", "column_insert_delete", "row_insert_delete", "table_insert"]
+
+
+# writes changes to the part files of a work unit as they are found and aggregates their occurrences,
+# s.t. only the changes of one table (or one batch of a streamed table) are kept in memory
+class ChangeWriter:
+    def __init__(self, part_files, accumulator):
+        self.part_files = part_files
+        self.accumulator = accumulator
+        self.part_sizes = {change_type: 0 for change_type in CHANGE_TYPES}
+        self.date = None
+
+    def write(self, changes):
+        t_updates, t_deletes, t_inserts, t_table, t_columns, t_rows = changes
+        if self.accumulator:
+            self.accumulator.add(self.date, {"update": t_updates, "delete": t_deletes, "insert": t_inserts})
+        if not self.part_files:
+            return
+        t_changes = [t_updates, t_inserts, t_deletes, t_columns, t_rows, [] if t_table is None else [t_table]]
+        for change_type, type_changes in zip(CHANGE_TYPES, t_changes):
+            if not type_changes:
+                continue
+            data = change_lines(type_changes).encode("utf-8")
+            self.part_files[change_type].write(data)
+            self.part_sizes[change_type] += len(data)
+
+
+class DiffSettings:
+    def __init__(
+        self,
+        path,
+        source,
+        output,
+        distinguish_null,
+        fingerprint_dir,
+        row_hash_dir,
+        engine,
+        stream_above,
+        prefetch,
+        prefetch_mib,
+        entities,
+        write_field_changes,
+    ):
+        self.path = path
+        self.source = source
+        self.output = output
+        self.distinguish_null = distinguish_null
+        self.fingerprint_dir = fingerprint_dir
+        self.row_hash_dir = row_hash_dir
+        self.engine = engine
+        self.stream_above = stream_above
+        self.prefetch = prefetch
+        self.prefetch_mib = prefetch_mib
+        self.entities = entities
+        self.write_field_changes = write_field_changes
+        self.aggregation_level = aggregation_level(entities, write_field_changes)
+
+
+# consecutive tables of a date, the changes of a date are merged in batch order
+class WorkUnit:
+    date: str
+    batch: int
+    file_names: list
+    size: int
+
+    def __init__(self, date, batch, file_names, size):
+        self.date = date
+        self.batch = batch
+        self.file_names = file_names
+        self.size = size
 
-class DateJob:
-    subdir: str
-    subdir_index: int
 
-    def __init__(self, subdir, subdir_index):
-        self.subdir = subdir
-        self.subdir_index = subdir_index
+class TableUnit:
+    batch: int
+    tables: list
+    size: int
+
+    def __init__(self, batch, tables, size):
+        self.batch = batch
+        self.tables = tables
+        self.size = size
 
 
 class NewTables:
@@ -181,49 +685,312 @@ class NewTables:
 
 
 def find_changes(
-    subdirs, path, output, num_tables, threads, distinguish_null, offset, included_tables, excluded_tables
+    subdirs,
+    path,
+    output,
+    num_tables,
+    threads,
+    distinguish_null,
+    offset,
+    included_tables,
+    excluded_tables,
+    fingerprint_dir=None,
+    version_index_file=None,
+    row_hash_dir=None,
+    engine="python",
+    stream_above=None,
+    batch_mib=64,
+    affinity=False,
+    prefetch=0,
+    prefetch_mib=256,
+    incremental=False,
+    entities=None,
+    min_sup=0.05,
+    max_sup=0.5,
+    write_field_changes=True,
+    csr=False,
 ):
+    if incremental and entities:
+        raise ValueError("Aggregated changes need all dates, they cannot be found incrementally")
+    # list every date directory once instead of scanning all older dates per table
+    source = SnapshotSource(path)
+    if (fingerprint_dir or row_hash_dir) and any(source.is_archived(date) for date in subdirs):
+        raise ValueError("Fingerprints and row hashes need extracted snapshot directories")
+    version_index = TableVersionIndex(source, subdirs)
+    if version_index_file is None:
+        version_index_file = os.path.join(output, "table_versions.json")
+    version_index.load(version_index_file)
+    num_listed = version_index.update()
+    version_index.save(version_index_file)
+    print(f"Table version index: {num_listed} of {len(subdirs)} dates listed")
+
+    dates = [subdirs[subdir_index] for subdir_index in range(max(offset, 1), len(subdirs))]
+    # support is relative to all days of the period, as if the changes of all dates were aggregated
+    num_days = len(dates)
+    dates = [date for date in dates if not version_index.files(date) is None]
+    if incremental:
+        ledger = DateLedger(path, settings_key(distinguish_null, num_tables, included_tables, excluded_tables))
+        ledger_file = os.path.join(output, "processed_dates.json")
+        ledger.load(ledger_file)
+        num_dates = len(dates)
+        dates = ledger.changed_dates(dates, version_index)
+        print(f"{len(dates)} of {num_dates} dates are new or changed")
+    date_tables = {
+        date: tables_of_date(date, version_index, num_tables, included_tables, excluded_tables) for date in dates
+    }
+    if affinity:
+        units = plan_table_units(date_tables, version_index, batch_mib)
+    else:
+        units = plan_work_units(date_tables, version_index, batch_mib)
+        num_batches = {date: 0 for date in dates}
+        for unit in units:
+            num_batches[unit.date] += 1
+    # largest units first, s.t. workers finish at the same time
+    units.sort(key=lambda unit: unit.size, reverse=True)
+    print(f"{len(units)} work units for {len(dates)} dates")
+
+    settings = DiffSettings(
+        path,
+        source,
+        output,
+        distinguish_null,
+        fingerprint_dir,
+        row_hash_dir,
+        engine,
+        stream_above,
+        prefetch,
+        prefetch_mib,
+        entities,
+        write_field_changes,
+    )
+    os.makedirs(os.path.join(output, "parts"), exist_ok=True)
+    num_new_tables = {date: 0 for date in dates}
     with mp.Manager() as manager:
         job_queue = manager.Queue()
         new_table_queue = manager.Queue()
         workers = [
             mp.Process(
-                target=find_daily_changes,
-                args=(
-                    job_queue,
-                    path,
-                    num_tables,
-                    output,
-                    subdirs,
-                    new_table_queue,
-                    distinguish_null,
-                    included_tables,
-                    excluded_tables,
-                    f"{n}".rjust(2),
-                ),
+                target=find_table_unit_changes if affinity else find_unit_changes,
+                args=(job_queue, version_index, settings, new_table_queue, f"{n}".rjust(2)),
             )
             for n in range(threads)
         ]
 
-        for subdir_index in range(offset, len(subdirs)):
-            if subdir_index == 0:
-                continue
-
-            job_queue.put(DateJob(subdirs[subdir_index], subdir_index))
+        for unit in units:
+            job_queue.put(unit)
 
         for worker in workers:
             worker.start()
         for worker in workers:
             worker.join()
 
-        with open(os.path.join(output, "new_tables.csv"), "w") as f:
-            f.write("date;num_new_tables\n")
-            while True:
-                try:
-                    new_tables = new_table_queue.get_nowait()
-                    f.write(f"{new_tables.date};{new_tables.num}\n")
-                except queue.Empty:
-                    return
+        while True:
+            try:
+                new_tables = new_table_queue.get_nowait()
+                num_new_tables[new_tables.date] += new_tables.num
+            except queue.Empty:
+                break
+
+    if write_field_changes and affinity:
+        merge_table_parts(output, date_tables, len(units))
+    elif write_field_changes:
+        for date in dates:
+            merge_parts(output, date, num_batches[date])
+    if entities:
+        save_aggregated_changes(output, threads, entities, num_days, min_sup, max_sup, csr)
+    os.rmdir(os.path.join(output, "parts"))
+    if incremental:
+        num_new_tables = {**read_new_tables(os.path.join(output, "new_tables.csv")), **num_new_tables}
+        ledger.record(dates, version_index)
+        ledger.save(ledger_file)
+    with open(os.path.join(output, "new_tables.csv"), "w") as f:
+        f.write("date;num_new_tables\n")
+        for date in sorted(num_new_tables):
+            f.write(f"{date};{num_new_tables[date]}\n")
+
+
+def occurrence_file(output, worker):
+    return os.path.join(output, "parts", f"occurrences_{int(worker)}.pickle")
+
+
+# merges the occurrences of all workers and writes the change index like filter_support.py
+def save_aggregated_changes(output, threads, entities, num_days, min_sup, max_sup, csr):
+    occurrence_files = [occurrence_file(output, n) for n in range(threads)]
+    occurrences = filter_by_support(merge_occurrences(occurrence_files), num_days, min_sup, max_sup)
+    for file_name in occurrence_files:
+        os.remove(file_name)
+    print(f"{len(occurrences)} changes remaining with min sup {min_sup} and max sup {max_sup}")
+    index_file = os.path.join(output, "_".join([entity.to_str() for entity in entities]) + "_changes_aggregated")
+    with open(f"{index_file}.json", "w") as f:
+        json.dump(occurrences, f)
+    if csr:
+        write_change_index(occurrences, f"{index_file}.csr")
+
+
+def read_new_tables(file_name):
+    num_new_tables = dict()
+    if os.path.isfile(file_name):
+        with open(file_name) as f:
+            for line in f:
+                date, num = line.strip().split(";")
+                if not date == "date":
+                    num_new_tables[date] = int(num)
+    return num_new_tables
+
+
+# table files of a date in directory order, limited to num_tables and filtered by included/excluded tables
+def tables_of_date(date, version_index, num_tables, included_tables, excluded_tables):
+    table_files = version_index.files(date)
+    print(f"{date} [{len(table_files)} tables]")
+    if not num_tables == -1:
+        table_files = table_files[0:num_tables]
+    tables = list()
+    for file_name in table_files:
+        file_id = file_name[: -len(file_extension())]
+        if (len(included_tables) > 0 and not file_id in included_tables) or file_id in excluded_tables:
+            continue
+        tables.append(file_name)
+    return tables
+
+
+# file sizes at listing time, file name -> size per date is only built when needed
+class SnapshotSizes:
+    def __init__(self, version_index):
+        self.version_index = version_index
+        self.sizes_by_date = dict()
+
+    def size(self, date, file_name):
+        if not date in self.sizes_by_date:
+            self.sizes_by_date[date] = dict(zip(self.version_index.files(date), self.version_index.sizes(date)))
+        return self.sizes_by_date[date][file_name]
+
+
+# splits the tables of each date into batches of about batch_mib (snapshot and previous snapshot)
+def plan_work_units(date_tables, version_index, batch_mib):
+    units = list()
+    sizes = SnapshotSizes(version_index)
+    for date, table_files in date_tables.items():
+        num_units = len(units)
+        batch = list()
+        batch_size = 0
+        for file_name in table_files:
+            batch.append(file_name)
+            batch_size += sizes.size(date, file_name)
+            old_date = version_index.previous_version(file_name, date)
+            if not old_date is None:
+                batch_size += sizes.size(old_date, file_name)
+            if batch_size >= batch_mib * 1048576:
+                units.append(WorkUnit(date, len(units) - num_units, batch, batch_size))
+                batch = list()
+                batch_size = 0
+        if batch:
+            units.append(WorkUnit(date, len(units) - num_units, batch, batch_size))
+    return units
+
+
+# groups the tables into batches of about batch_mib (all snapshots of a table in the period and the one before)
+def plan_table_units(date_tables, version_index, batch_mib):
+    table_dates = dict()
+    for date, table_files in date_tables.items():
+        for file_name in table_files:
+            table_dates.setdefault(file_name, list()).append(date)
+    units = list()
+    sizes = SnapshotSizes(version_index)
+    batch = list()
+    batch_size = 0
+    for file_name, dates in table_dates.items():
+        batch.append((file_name, dates))
+        batch_size += sum(sizes.size(date, file_name) for date in dates)
+        old_date = version_index.previous_version(file_name, dates[0])
+        if not old_date is None:
+            batch_size += sizes.size(old_date, file_name)
+        if batch_size >= batch_mib * 1048576:
+            units.append(TableUnit(len(units), batch, batch_size))
+            batch = list()
+            batch_size = 0
+    if batch:
+        units.append(TableUnit(len(units), batch, batch_size))
+    return units
+
+
+def part_file(output, date, batch, change_type):
+    return os.path.join(output, "parts", f"{date}_{batch}_{change_type}.csv")
+
+
+def merge_parts(output, date, num_batches):
+    for change_type in CHANGE_TYPES:
+        with open(os.path.join(output, f"{date}_{change_type}.csv"), "wb") as f:
+            for batch in range(num_batches):
+                with open(part_file(output, date, batch, change_type), "rb") as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(part_file(output, date, batch, change_type))
+
+
+# part files of a table unit span all dates, segments index the changes of each table and date in them
+def table_part_file(output, batch, change_type):
+    return os.path.join(output, "parts", f"tables_{batch}_{change_type}.csv")
+
+
+def segment_file(output, batch):
+    return os.path.join(output, "parts", f"tables_{batch}_segments.json")
+
+
+# keeps the most recently used part files open
+class PartReader:
+    def __init__(self, output, max_open=128):
+        self.output = output
+        self.max_open = max_open
+        self.files = OrderedDict()
+
+    def read(self, batch, change_type, offset, length):
+        key = (batch, change_type)
+        if key in self.files:
+            self.files.move_to_end(key)
+        else:
+            if len(self.files) >= self.max_open:
+                _, f = self.files.popitem(last=False)
+                f.close()
+            self.files[key] = open(table_part_file(self.output, batch, change_type), "rb")
+        f = self.files[key]
+        f.seek(offset)
+        return f.read(length)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def merge_table_parts(output, date_tables, num_units):
+    segments = {date: dict() for date in date_tables}
+    for batch in range(num_units):
+        with open(segment_file(output, batch)) as f:
+            for date, table_segments in json.load(f).items():
+                for file_name, segment in table_segments.items():
+                    segments[date][file_name] = (batch, segment)
+    reader = PartReader(output)
+    for date, table_files in date_tables.items():
+        for type_index, change_type in enumerate(CHANGE_TYPES):
+            with open(os.path.join(output, f"{date}_{change_type}.csv"), "wb") as f:
+                for file_name in table_files:
+                    # skipped as unchanged
+                    if not file_name in segments[date]:
+                        continue
+                    batch, segment = segments[date][file_name]
+                    offset, length = segment[type_index]
+                    if length > 0:
+                        f.write(reader.read(batch, change_type, offset, length))
+    reader.close()
+    for batch in range(num_units):
+        for change_type in CHANGE_TYPES:
+            os.remove(table_part_file(output, batch, change_type))
+        os.remove(segment_file(output, batch))
+
+
+def is_larger(size_mib, new_dir, old_dir, file_name, source):
+    if source.size(os.path.join(new_dir, file_name)) > size_mib * 1048576:
+        return True
+    return not old_dir is None and source.size(os.path.join(old_dir, file_name)) > size_mib * 1048576
 
 
 def get_tables_from_file(file_name):
@@ -239,60 +1006,265 @@ def get_tables_from_file(file_name):
     return tables
 
 
-def find_daily_changes(
-    jobs, path, num_tables, output, subdirs, new_table_queue, distinguish_null, included_tables, excluded_tables, n
+# fingerprint of a snapshot with the same content as its previous snapshot, otherwise None
+def same_content_fingerprint(manifest, current_subdir_path, old_subdir_path, file_name):
+    if not manifest or old_subdir_path is None:
+        return None
+    fingerprint = manifest.fingerprint(current_subdir_path, file_name)
+    if not fingerprint == manifest.fingerprint(old_subdir_path, file_name):
+        return None
+    return fingerprint
+
+
+def has_changes(changes):
+    t_updates, t_deletes, t_inserts, _, t_columns, t_rows = changes
+    return bool(t_updates or t_deletes or t_inserts or t_columns or t_rows)
+
+
+def record_self_diff(manifest, fingerprint, distinguish_null, changes, emitted=False):
+    is_empty = not (emitted or has_changes(changes))
+    manifest.record_self_diff(fingerprint, distinguish_null, is_empty)
+
+
+# returns the changes of a table compared to its previous snapshot, None if it is skipped as unchanged
+# with emit, the field and row changes of streamed tables are passed to emit(changes) per batch
+def find_table_changes(file_name, date, version_index, settings, manifest, row_hashes, diff, reader=None, emit=None):
+    current_subdir_path = os.path.join(settings.path, date)
+    old_subdir = version_index.previous_version(file_name, date)
+    old_subdir_path = None if old_subdir is None else os.path.join(settings.path, old_subdir)
+    file_id = file_name[: -len(file_extension())]
+    distinguish_null = settings.distinguish_null
+    # same content as previous snapshot, skip if diffing this content is known to yield no changes
+    fingerprint = same_content_fingerprint(manifest, current_subdir_path, old_subdir_path, file_name)
+    if fingerprint and manifest.has_empty_self_diff(fingerprint, distinguish_null):
+        if row_hashes:
+            row_hashes.copy(old_subdir_path, current_subdir_path, file_name)
+        return None
+    stream_above = settings.stream_above
+    level = settings.aggregation_level
+    emitted = list()
+    if stream_above is not None and is_larger(
+        stream_above, current_subdir_path, old_subdir_path, file_name, settings.source
+    ):
+
+        def emit_batch(batch_changes):
+            emitted.append(has_changes(batch_changes))
+            emit(batch_changes)
+
+        changes = find_streamed_field_changes(
+            file_id,
+            current_subdir_path,
+            old_subdir_path,
+            distinguish_null,
+            diff,
+            source=settings.source,
+            level=level,
+            emit=emit_batch if emit else None,
+        )
+    elif row_hashes:
+        changes = find_localized_field_changes(
+            file_id, current_subdir_path, old_subdir_path, distinguish_null, row_hashes, diff, reader, level
+        )
+    else:
+        changes = find_field_changes(
+            file_id, current_subdir_path, old_subdir_path, distinguish_null, diff, reader, level
+        )
+    if fingerprint:
+        record_self_diff(manifest, fingerprint, distinguish_null, changes, any(emitted))
+    return changes
+
+
+# like find_table_changes, but the previous snapshot is taken from previous = (date, parsed table) if it matches
+# returns the changes and (date, parsed table) to keep for the next snapshot of the table
+def find_version_changes(
+    file_name, date, previous, version_index, settings, manifest, row_hashes, diff, reader=None, emit=None
 ):
+    current_subdir_path = os.path.join(settings.path, date)
+    old_subdir = version_index.previous_version(file_name, date)
+    old_subdir_path = None if old_subdir is None else os.path.join(settings.path, old_subdir)
+    stream_above = settings.stream_above
+    if stream_above is not None and is_larger(
+        stream_above, current_subdir_path, old_subdir_path, file_name, settings.source
+    ):
+        changes = find_table_changes(file_name, date, version_index, settings, manifest, row_hashes, diff, reader, emit)
+        return changes, None
+    if not (previous and previous[0] == old_subdir):
+        previous = None
+
+    file_id = file_name[: -len(file_extension())]
+    distinguish_null = settings.distinguish_null
+    fingerprint = same_content_fingerprint(manifest, current_subdir_path, old_subdir_path, file_name)
+    if fingerprint and manifest.has_empty_self_diff(fingerprint, distinguish_null):
+        if row_hashes:
+            row_hashes.copy(old_subdir_path, current_subdir_path, file_name)
+        # same content
+        return None, (date, previous[1]) if previous else None
+
+    if row_hashes:
+        new_file = os.path.join(current_subdir_path, file_name)
+        scan = scan_table(new_file, reader.read(new_file) if reader else None)
+        row_hashes.save(current_subdir_path, file_name, scan)
+        n = scan.table
+    else:
+        n = load_table(os.path.join(current_subdir_path, file_name), reader)
+    if old_subdir is None:
+        changes = new_table_changes(
+            file_id, [attr["id"] for attr in n["attributes"]], n["rows"], settings.aggregation_level
+        )
+    else:
+        o = previous[1] if previous else load_table(os.path.join(old_subdir_path, file_name), reader)
+        changes = diff_tables(file_id, n, o, distinguish_null, diff)
+    if fingerprint:
+        record_self_diff(manifest, fingerprint, distinguish_null, changes)
+    return changes, (date, n)
+
+
+# snapshot files as (file name, listed size) in the order a worker reads them as a whole
+# tables are (file name, dates), with affinity only the first previous snapshot of a table is read
+def planned_reads(tables, version_index, settings, sizes):
+    files = list()
+    for file_name, dates in tables:
+        for date_index, date in enumerate(dates):
+            size = sizes.size(date, file_name)
+            old_date = version_index.previous_version(file_name, date)
+            old_size = 0 if old_date is None else sizes.size(old_date, file_name)
+            stream_above = settings.stream_above
+            if stream_above is not None and max(size, old_size) > stream_above * 1048576:
+                continue
+            files.append((os.path.join(settings.path, date, file_name), size))
+            # with row hashes, only changed rows are read from the previous snapshot
+            if date_index == 0 and not old_date is None and not settings.row_hash_dir:
+                files.append((os.path.join(settings.path, old_date, file_name), old_size))
+    return files
+
+
+def find_unit_changes(jobs, version_index, settings, new_table_queue, n):
     print(f"[Start Worker {n}]")
+    manifest = FingerprintManifest(settings.fingerprint_dir) if settings.fingerprint_dir else None
+    row_hashes = RowHashes(settings.row_hash_dir) if settings.row_hash_dir else None
+    diff = diff_engine(settings)
+    reader = SnapshotReader(settings.prefetch, settings.prefetch_mib, read=settings.source.read)
+    sizes = SnapshotSizes(version_index)
+    accumulator = OccurrenceAccumulator(settings.entities) if settings.entities else None
+    cpu_start = time.process_time()
     while True:
-        job = None
+        unit = None
         try:
-            job = jobs.get_nowait()
+            unit = jobs.get_nowait()
         except queue.Empty:
-            print(f"[Exit Worker {n}]")
-            return
-        if job is None:
-            print(f"[Exit Worker {n}]")
+            pass
+        if unit is None:
+            reader.close()
+            settings.source.close()
+            if accumulator:
+                accumulator.save(occurrence_file(settings.output, n))
+            cpu_time = time.process_time() - cpu_start
+            print(f"[Exit Worker {n}, {reader.io_wait:.1f} s I/O wait, {cpu_time:.1f} s CPU]")
             return
 
-        updates = list()
-        deletes = list()
-        inserts = list()
-        new_tables = set()
-        column_add_delete = list()
-        row_add_delete = list()
+        print(f"{unit.date} [Worker {n}, batch {unit.batch}, {len(unit.file_names)} tables]")
+        reader.plan(
+            planned_reads([(file_name, [unit.date]) for file_name in unit.file_names], version_index, settings, sizes)
+        )
+        part_files = dict()
+        if settings.write_field_changes:
+            part_files = {
+                change_type: open(part_file(settings.output, unit.date, unit.batch, change_type), "wb")
+                for change_type in CHANGE_TYPES
+            }
+        writer = ChangeWriter(part_files, accumulator)
+        writer.date = unit.date
+        num_new_tables = 0
+        unchanged_tables = 0
+        for file_name in unit.file_names:
+            changes = find_table_changes(
+                file_name, unit.date, version_index, settings, manifest, row_hashes, diff, reader, writer.write
+            )
+            if changes is None:
+                unchanged_tables += 1
+                continue
+            if not changes[3] is None:
+                num_new_tables += 1
+            writer.write(changes)
+        for change_file in part_files.values():
+            change_file.close()
 
-        current_subdir_path = os.path.join(path, job.subdir)
-        if not os.path.isdir(current_subdir_path):
-            continue
+        if manifest:
+            manifest.save()
+            print(f"{unit.date} [Worker {n}, batch {unit.batch}, {unchanged_tables} unchanged tables skipped]")
+        new_table_queue.put(NewTables(unit.date, num_new_tables))
 
-        table_files = [f for f in os.listdir(current_subdir_path) if f.endswith(file_extension())]
-        print(f"{job.subdir} [Worker {n}, {len(table_files)} tables]")
-        if not num_tables == -1:
-            table_files = table_files[0:num_tables]
 
-        for file_name in table_files:
-            old_subdir_path = find_older_subdir(file_name, path, subdirs[: job.subdir_index])
-            file_id = file_name[: -len(file_extension())]
-            if (len(included_tables) > 0 and not file_id in included_tables) or file_id in excluded_tables:
-                continue
-            t_updates, t_deletes, t_inserts, t_table, t_columns, t_rows = find_field_changes(
-                file_id, current_subdir_path, old_subdir_path, distinguish_null
-            )
-            updates += t_updates
-            deletes += t_deletes
-            inserts += t_inserts
-            column_add_delete += t_columns
-            row_add_delete += t_rows
-            if not t_table is None:
-                new_tables.add(t_table)
-
-        save_changes(updates, os.path.join(output, f"{job.subdir}_update.csv"))
-        save_changes(inserts, os.path.join(output, f"{job.subdir}_insert.csv"))
-        save_changes(deletes, os.path.join(output, f"{job.subdir}_delete.csv"))
-        save_changes(column_add_delete, os.path.join(output, f"{job.subdir}_column_insert_delete.csv"))
-        save_changes(row_add_delete, os.path.join(output, f"{job.subdir}_row_insert_delete.csv"))
-        save_changes(new_tables, os.path.join(output, f"{job.subdir}_table_insert.csv"))
-        new_table_queue.put(NewTables(job.subdir, len(new_tables)))
+def find_table_unit_changes(jobs, version_index, settings, new_table_queue, n):
+    print(f"[Start Worker {n}]")
+    manifest = FingerprintManifest(settings.fingerprint_dir) if settings.fingerprint_dir else None
+    row_hashes = RowHashes(settings.row_hash_dir) if settings.row_hash_dir else None
+    diff = diff_engine(settings)
+    reader = SnapshotReader(settings.prefetch, settings.prefetch_mib, read=settings.source.read)
+    sizes = SnapshotSizes(version_index)
+    accumulator = OccurrenceAccumulator(settings.entities) if settings.entities else None
+    cpu_start = time.process_time()
+    while True:
+        unit = None
+        try:
+            unit = jobs.get_nowait()
+        except queue.Empty:
+            pass
+        if unit is None:
+            reader.close()
+            settings.source.close()
+            if accumulator:
+                accumulator.save(occurrence_file(settings.output, n))
+            cpu_time = time.process_time() - cpu_start
+            print(f"[Exit Worker {n}, {reader.io_wait:.1f} s I/O wait, {cpu_time:.1f} s CPU]")
+            return
+
+        print(f"[Worker {n}, batch {unit.batch}, {len(unit.tables)} tables]")
+        reader.plan(planned_reads(unit.tables, version_index, settings, sizes))
+        part_files = dict()
+        if settings.write_field_changes:
+            part_files = {
+                change_type: open(table_part_file(settings.output, unit.batch, change_type), "wb")
+                for change_type in CHANGE_TYPES
+            }
+        writer = ChangeWriter(part_files, accumulator)
+        # date -> file name -> (offset, length) per change type
+        segments = dict()
+        num_new_tables = dict()
+        unchanged_tables = 0
+        for file_name, dates in unit.tables:
+            # the previous snapshot is kept in memory while walking the snapshots of the table
+            previous = None
+            for date in dates:
+                writer.date = date
+                offsets = [writer.part_sizes[change_type] for change_type in CHANGE_TYPES]
+                changes, previous = find_version_changes(
+                    file_name, date, previous, version_index, settings, manifest, row_hashes, diff, reader, writer.write
+                )
+                if changes is None:
+                    unchanged_tables += 1
+                    continue
+                if not changes[3] is None:
+                    num_new_tables[date] = num_new_tables.get(date, 0) + 1
+                writer.write(changes)
+                if not part_files:
+                    continue
+                # streamed tables are written in batches, their segments span all of them
+                segments.setdefault(date, dict())[file_name] = [
+                    (offset, writer.part_sizes[change_type] - offset)
+                    for change_type, offset in zip(CHANGE_TYPES, offsets)
+                ]
+        for change_file in part_files.values():
+            change_file.close()
+        if part_files:
+            with open(segment_file(settings.output, unit.batch), "w") as f:
+                json.dump(segments, f)
+
+        if manifest:
+            manifest.save()
+            print(f"[Worker {n}, batch {unit.batch}, {unchanged_tables} unchanged snapshots skipped]")
+        for date, num in num_new_tables.items():
+            new_table_queue.put(NewTables(date, num))
 
 
 def main():
@@ -313,6 +1285,21 @@ def main():
         len(not_considered_subdirs) - 1,
         included_tables,
         excluded_tables,
+        args["fingerprints"],
+        args["version_index"],
+        args["row_hashes"],
+        args["engine"],
+        args["stream_above"],
+        args["batch_mib"],
+        args["affinity"],
+        args["prefetch"],
+        args["prefetch_mib"],
+        args["incremental"],
+        [entity for name in args["aggregate"] for entity in Entity if entity.to_str() == name],
+        args["min_sup"],
+        args["max_sup"],
+        not (args["no_field_changes"] and args["aggregate"]),
+        args["csr"],
     )
 
 
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+
+
+# per date, index table file -> [size, mtime in ns, content hash] of its snapshot
+# hashes are only recomputed if size or mtime of a file changed
+# per content hash, it is stored whether diffing the content with itself yields no changes
+# (it does yield updates if row ids are not unique)
+class FingerprintManifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self._fingerprints = dict()
+        self._changed_dates = set()
+        self._contents = None
+        self._changed_contents = dict()
+
+    def _date_file(self, date):
+        return os.path.join(self.directory, f"{date}.json")
+
+    def _contents_file(self):
+        return os.path.join(self.directory, "contents.json")
+
+    def _load(self, date):
+        if not date in self._fingerprints:
+            self._fingerprints[date] = load_json_file(self._date_file(date))
+        return self._fingerprints[date]
+
+    def fingerprint(self, subdir_path, file_name):
+        date = os.path.basename(subdir_path)
+        fingerprints = self._load(date)
+        stat = os.stat(os.path.join(subdir_path, file_name))
+        entry = fingerprints.get(file_name)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        fingerprints[file_name] = [stat.st_size, stat.st_mtime_ns, hash_file(os.path.join(subdir_path, file_name))]
+        self._changed_dates.add(date)
+        return fingerprints[file_name][2]
+
+    # returns True, False, or None if unknown
+    def has_empty_self_diff(self, fingerprint, distinguish_null):
+        if self._contents is None:
+            self._contents = load_json_file(self._contents_file())
+        return self._contents.get(fingerprint, dict()).get(str(distinguish_null))
+
+    def record_self_diff(self, fingerprint, distinguish_null, is_empty):
+        if self._contents is None:
+            self._contents = load_json_file(self._contents_file())
+        self._contents.setdefault(fingerprint, dict())[str(distinguish_null)] = is_empty
+        self._changed_contents.setdefault(fingerprint, dict())[str(distinguish_null)] = is_empty
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # other workers may have stored fingerprints of the same date meanwhile
+        for date in self._changed_dates:
+            stored_fingerprints = load_json_file(self._date_file(date))
+            stored_fingerprints.update(self._fingerprints[date])
+            self._fingerprints[date] = stored_fingerprints
+            write_json_file(stored_fingerprints, self._date_file(date))
+        self._changed_dates.clear()
+        if self._changed_contents:
+            stored_contents = load_json_file(self._contents_file())
+            for fingerprint, self_diffs in self._changed_contents.items():
+                stored_contents.setdefault(fingerprint, dict()).update(self_diffs)
+            self._contents = stored_contents
+            write_json_file(stored_contents, self._contents_file())
+            self._changed_contents.clear()
+
+
+def load_json_file(file_name):
+    if not os.path.isfile(file_name):
+        return dict()
+    try:
+        with open(file_name) as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return dict()
+
+
+def write_json_file(data, file_name):
+    tmp_file = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, file_name)
+
+
+def hash_file(file_name, block_size=1048576):
+    sha = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
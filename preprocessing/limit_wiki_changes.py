@@ -8,6 +8,7 @@ import math
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_index import load_change_index
 from util.util import date_range
 
 
@@ -36,8 +37,7 @@ def main(change_file, out, min_sup, max_sup):
     if not os.path.isdir(out):
         os.makedirs(out)
 
-    with open(change_file, encoding="utf-8") as f:
-        all_changes = json.load(f)
+    all_changes = load_change_index(change_file)
 
     years = [str(year) for year in range(2015, 2020)]
     periods = [4]
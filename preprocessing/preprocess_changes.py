@@ -2,9 +2,14 @@
 import argparse
 import json
 import math
-import pandas as pd
+import os
+import sys
 from collections import defaultdict
-from datetime import datetime
+from datetime import date, datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_index import load_change_index
+from util.util import date_range
 
 
 def parse_args():
@@ -12,7 +17,7 @@ def parse_args():
     ap.add_argument(
         "change_file",
         type=str,
-        help="File with occurences per change (expect Python dict as .json)",
+        help="File with occurences per change (expect Python dict as .json or binary change index)",
     )
     ap.add_argument(
         "--filter_periodic",
@@ -75,12 +80,9 @@ def group_simultaneous_changes(all_changes):
 def find_periodic_changes(all_changes, threshold):
     all_days = list()
     date_weekdays = dict()
-    dates = pd.date_range("2019-11-02", "2020-11-01").to_series()
-    weekdays = dates.dt.weekday
-    for date, weekday in zip(dates, weekdays):
-        iso_date = date.date().isoformat()
+    for iso_date in date_range("2019-11-02", "2020-11-01"):
         all_days.append(iso_date)
-        date_weekdays[iso_date] = weekday
+        date_weekdays[iso_date] = date.fromisoformat(iso_date).weekday()
 
     periodic_changes = set()
 
@@ -137,8 +139,7 @@ def main(args):
     print("start:", start)
 
     # get index change -> dates
-    with open(args["change_file"]) as f:
-        all_changes = json.load(f)
+    all_changes = dict(load_change_index(args["change_file"]).items())
     print(f"input: {len(all_changes)} changes")
 
     # filter changes that always happen together
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import pickle
+import re
+from array import array
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+# hash of the raw row text, 0 means unknown
+def hash_row(raw_row):
+    return int.from_bytes(hashlib.blake2b(raw_row, digest_size=8).digest(), "big") or 1
+
+
+def hash_row_unless_nan(raw_row):
+    # NaN != NaN, such rows always need to be compared
+    if b"NaN" in raw_row:
+        return 0
+    return hash_row(raw_row)
+
+
+class TableScan:
+    def __init__(self, table):
+        self.table = table
+        self.rows = table.get("rows", list())
+        # per row: id, hash of the raw row text, byte offset and length in the file, number of fields
+        self.ids = list()
+        self.hashes = array("Q")
+        self.offsets = array("q")
+        self.lengths = array("q")
+        self.num_fields = array("q")
+
+    def sidecar(self, stat):
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "attributes": [attr["id"] for attr in self.table["attributes"]],
+            "ids": self.ids,
+            "hashes": self.hashes,
+            "offsets": self.offsets,
+            "lengths": self.lengths,
+            "num_fields": self.num_fields,
+        }
+
+
+# per snapshot, store row id -> hash of the raw row text and its position in the snapshot file
+# next time, only rows with a different hash need to be read from the previous snapshot
+class RowHashes:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _sidecar_file(self, subdir_path, file_name):
+        date = os.path.basename(subdir_path)
+        return os.path.join(self.directory, date, f"{file_name}.rows")
+
+    def save(self, subdir_path, file_name, scan):
+        stat = os.stat(os.path.join(subdir_path, file_name))
+        self._write(scan.sidecar(stat), self._sidecar_file(subdir_path, file_name))
+
+    # returns None if there is no sidecar or the snapshot changed since
+    def load(self, subdir_path, file_name):
+        sidecar_file = self._sidecar_file(subdir_path, file_name)
+        if not os.path.isfile(sidecar_file):
+            return None
+        with open(sidecar_file, "rb") as f:
+            sidecar = pickle.load(f)
+        stat = os.stat(os.path.join(subdir_path, file_name))
+        if not (sidecar["size"] == stat.st_size and sidecar["mtime_ns"] == stat.st_mtime_ns):
+            return None
+        return sidecar
+
+    # for a snapshot with the same content as its previous one
+    def copy(self, old_subdir_path, new_subdir_path, file_name):
+        sidecar = self.load(old_subdir_path, file_name)
+        if sidecar is None:
+            return
+        stat = os.stat(os.path.join(new_subdir_path, file_name))
+        sidecar["size"] = stat.st_size
+        sidecar["mtime_ns"] = stat.st_mtime_ns
+        self._write(sidecar, self._sidecar_file(new_subdir_path, file_name))
+
+    def _write(self, sidecar, sidecar_file):
+        os.makedirs(os.path.dirname(sidecar_file), exist_ok=True)
+        tmp_file = f"{sidecar_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(sidecar, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, sidecar_file)
+
+
+def skip_whitespace(text, index):
+    return WHITESPACE.match(text, index).end()
+
+
+# parses a table snapshot like json.loads and hashes the raw text of each row
+# data is the content of the file if it has already been read
+def scan_table(file_name, data=None):
+    if data is None:
+        with open(file_name, "rb") as f:
+            data = f.read()
+    text = data.decode("utf-8")
+    decoder = json.JSONDecoder()
+    table = dict()
+    scan = TableScan(table)
+
+    index = skip_whitespace(text, 0)
+    if not text.startswith("{", index):
+        raise ValueError(f"{file_name}: expected table object")
+    index = skip_whitespace(text, index + 1)
+    while not text.startswith("}", index):
+        key, index = decoder.raw_decode(text, index)
+        index = skip_whitespace(text, index)
+        if not text.startswith(":", index):
+            raise ValueError(f"{file_name}: expected ':' at {index}")
+        index = skip_whitespace(text, index + 1)
+        if key == "rows" and text.startswith("[", index):
+            scan = TableScan(table)
+            table[key] = scan.rows = list()
+            index = scan_rows(text, data, index + 1, decoder.scan_once, scan, file_name)
+        else:
+            table[key], index = decoder.raw_decode(text, index)
+        index = skip_whitespace(text, index)
+        if text.startswith(",", index):
+            index = skip_whitespace(text, index + 1)
+        elif not text.startswith("}", index):
+            raise ValueError(f"{file_name}: expected ',' or '}}' at {index}")
+    return scan
+
+
+# index is after the opening bracket, returns the index after the closing bracket
+def scan_rows(text, data, index, scan_once, scan, file_name):
+    rows_append = scan.rows.append
+    starts = array("q")
+    ends = array("q")
+    index = skip_whitespace(text, index)
+    if text.startswith("]", index):
+        return index + 1
+    while True:
+        try:
+            row, end = scan_once(text, index)
+        except StopIteration as e:
+            raise json.JSONDecodeError("Expecting value", text, e.value) from None
+        rows_append(row)
+        starts.append(index)
+        ends.append(end)
+
+        # fast path for the default separator of json.dump
+        if text.startswith(", ", end) and not text.startswith(" ", end + 2):
+            index = end + 2
+            continue
+        end = skip_whitespace(text, end)
+        if text.startswith("]", end):
+            closing_index = end
+            break
+        if not text.startswith(",", end):
+            raise ValueError(f"{file_name}: expected ',' or ']' at {end}")
+        index = skip_whitespace(text, end + 1)
+
+    # character to byte positions
+    if not len(text) == len(data):
+        byte_starts, byte_ends = array("q"), array("q")
+        char_pos, byte_pos = 0, 0
+        for start, end in zip(starts, ends):
+            byte_pos += len(text[char_pos:start].encode("utf-8"))
+            byte_starts.append(byte_pos)
+            byte_pos += len(text[start:end].encode("utf-8"))
+            byte_ends.append(byte_pos)
+            char_pos = end
+        starts, ends = byte_starts, byte_ends
+    scan.ids = [row["id"] for row in scan.rows]
+    row_hash = hash_row_unless_nan if b"NaN" in data else hash_row
+    scan.hashes = array("Q", map(row_hash, map(data.__getitem__, map(slice, starts, ends))))
+    scan.offsets = starts
+    scan.lengths = array("q", [end - start for start, end in zip(starts, ends)])
+    scan.num_fields = array("q", [len(row["fields"]) for row in scan.rows])
+    return closing_index + 1
+
+
+# row id -> row for the given row positions of a sidecar
+def read_rows(file_name, sidecar, positions):
+    rows = dict()
+    with open(file_name, "rb") as f:
+        for position in sorted(positions, key=lambda position: sidecar["offsets"][position]):
+            f.seek(sidecar["offsets"][position])
+            rows[sidecar["ids"][position]] = json.loads(f.read(sidecar["lengths"][position]))
+    return rows
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_file(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+# reads snapshot files in the order they are needed, the next files are fetched by a thread pool
+# at most depth files and max_mib MiB (by listed file size) are fetched ahead
+# files that are not read in order (e.g., skipped tables) are dropped
+class SnapshotReader:
+    def __init__(self, depth=0, max_mib=256, threads=4, read=read_file):
+        self.read_file = read
+        self.depth = depth
+        self.max_bytes = max_mib * 1048576
+        self.executor = ThreadPoolExecutor(threads) if depth > 0 else None
+        self.files = list()
+        self.positions = dict()
+        self.next_file = 0
+        # file name -> (size, future)
+        self.pending = OrderedDict()
+        self.pending_bytes = 0
+        self.io_wait = 0.0
+
+    # files as (file name, size) in the order they will be read
+    def plan(self, files):
+        self.drop(len(self.pending))
+        self.files = files
+        self.positions = dict()
+        for position, (file_name, _) in enumerate(files):
+            self.positions.setdefault(file_name, position)
+        self.next_file = 0
+        self._fetch()
+
+    def read(self, file_name):
+        start = time.perf_counter()
+        if file_name in self.pending:
+            # drop files that were planned before, but not read
+            while not next(iter(self.pending)) == file_name:
+                self.drop(1)
+            size, future = self.pending.pop(file_name)
+            self.pending_bytes -= size
+            data = future.result()
+            self._fetch()
+        else:
+            # planned files before this one are not needed anymore
+            if self.positions.get(file_name, -1) >= self.next_file:
+                self.drop(len(self.pending))
+                self.next_file = self.positions[file_name] + 1
+            data = self.read_file(file_name)
+            self._fetch()
+        self.io_wait += time.perf_counter() - start
+        return data
+
+    def drop(self, num_files):
+        for _ in range(num_files):
+            _, (size, future) = self.pending.popitem(last=False)
+            future.cancel()
+            self.pending_bytes -= size
+
+    def _fetch(self):
+        if self.executor is None:
+            return
+        while self.next_file < len(self.files) and len(self.pending) < self.depth:
+            file_name, size = self.files[self.next_file]
+            # a file larger than max_mib is only fetched if nothing else is pending
+            if self.pending and self.pending_bytes + size > self.max_bytes:
+                return
+            self.next_file += 1
+            if file_name in self.pending:
+                continue
+            self.pending[file_name] = (size, self.executor.submit(self.read_file, file_name))
+            self.pending_bytes += size
+
+    def close(self):
+        self.drop(len(self.pending))
+        if self.executor:
+            self.executor.shutdown()
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import io
+import json
+import re
+import sqlite3
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+# reads JSON text chunk-wise, consumed text is dropped when the next chunk is read
+class JSONBuffer:
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def next_char(self):
+        self.skip_whitespace()
+        char = self.text[self.pos : self.pos + 1]
+        self.pos += len(char)
+        return char
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.text[self.pos : self.pos + 1]
+
+    # returns the value and its raw text
+    def decode(self, decoder):
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    raw = self.text[self.pos : end]
+                    self.pos = end
+                    return value, raw
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+# yields (row, raw row text) of a table snapshot without reading the whole file
+# all other top-level values (attributes, ...) are stored in header as soon as they are read
+# with a snapshot source, the file is opened from it (e.g., from an archive)
+def iter_table(file_name, header, chunk_size=1048576, source=None):
+    decoder = json.JSONDecoder()
+    if source is None:
+        f = open(file_name, encoding="utf-8")
+    else:
+        f = io.TextIOWrapper(source.open(file_name), encoding="utf-8")
+    with f:
+        buffer = JSONBuffer(f, chunk_size)
+        if not buffer.next_char() == "{":
+            raise ValueError(f"{file_name}: expected table object")
+        if buffer.peek() == "}":
+            return
+        while True:
+            key, _ = buffer.decode(decoder)
+            if not buffer.next_char() == ":":
+                raise ValueError(f"{file_name}: expected ':'")
+            if key == "rows" and buffer.peek() == "[":
+                buffer.next_char()
+                if buffer.peek() == "]":
+                    buffer.next_char()
+                else:
+                    while True:
+                        yield buffer.decode(decoder)
+                        char = buffer.next_char()
+                        if char == "]":
+                            break
+                        if not char == ",":
+                            raise ValueError(f"{file_name}: expected ',' or ']'")
+            else:
+                header[key], _ = buffer.decode(decoder)
+            char = buffer.next_char()
+            if char == "}":
+                return
+            if not char == ",":
+                raise ValueError(f"{file_name}: expected ',' or '}}'")
+
+
+# all top-level values except rows
+def read_header(file_name, source=None):
+    header = dict()
+    for _ in iter_table(file_name, header, source=source):
+        pass
+    return header
+
+
+# row ids that are equal as dict keys get the same key
+def row_key(row_id):
+    if type(row_id) == bool or (type(row_id) == float and row_id.is_integer()):
+        row_id = int(row_id)
+    return json.dumps(row_id)
+
+
+# on-disk index of the rows of the old snapshot and the row ids of the new snapshot
+class RowIndex:
+    def __init__(self, db_file, cache_size_kib=65536):
+        self.db = sqlite3.connect(db_file)
+        self.db.execute(f"PRAGMA cache_size = -{cache_size_kib}")
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        # first row wins if ids are not unique
+        self.db.execute("CREATE TABLE old_index (key TEXT PRIMARY KEY, raw TEXT) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE old_rows (key TEXT, name TEXT, num_fields INTEGER)")
+        self.db.execute("CREATE TABLE new_keys (key TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def add_old_rows(self, rows):
+        rows = [(row_key(row["id"]), raw, str(row["id"]), len(row["fields"])) for row, raw in rows]
+        self.db.executemany("INSERT OR IGNORE INTO old_index VALUES (?, ?)", [(key, raw) for key, raw, _, _ in rows])
+        self.db.executemany("INSERT INTO old_rows VALUES (?, ?, ?)", [(key, name, num) for key, _, name, num in rows])
+
+    def add_new_rows(self, rows):
+        self.db.executemany("INSERT OR IGNORE INTO new_keys VALUES (?)", [(row_key(row["id"]),) for row, _ in rows])
+
+    # key -> raw text of the old row
+    def old_rows(self, keys, max_params=500):
+        keys = list(set(keys))
+        raw_rows = dict()
+        for start in range(0, len(keys), max_params):
+            batch = keys[start : start + max_params]
+            query = f"SELECT key, raw FROM old_index WHERE key IN ({', '.join('?' * len(batch))})"
+            raw_rows.update(self.db.execute(query, batch))
+        return raw_rows
+
+    # yields (id, number of fields, whether the id is in the new snapshot) of all old rows in order
+    def old_row_states(self):
+        query = """SELECT o.name, o.num_fields, EXISTS (SELECT 1 FROM new_keys n WHERE n.key = o.key)
+                   FROM old_rows o ORDER BY o.rowid"""
+        for name, num_fields, is_kept in self.db.execute(query):
+            yield name, num_fields, bool(is_kept)
+
+    def close(self):
+        self.db.close()
+
+
+def batches(iterable, batch_size):
+    batch = list()
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
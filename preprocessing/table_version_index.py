@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+# index table file -> sorted dates with a snapshot of the table
+# date directories (or archives) are listed once and only listed again if their mtime changed
+# the member offsets of tar archives are stored with their listing, s.t. workers do not scan the archives again
+class TableVersionIndex:
+    def __init__(self, source, subdirs):
+        self.source = source
+        self.path = source.path
+        self.subdirs = subdirs
+        self.extension = source.extension
+        self._listings = dict()
+        self._versions = None
+
+    def load(self, index_file):
+        if os.path.isfile(index_file):
+            with open(index_file) as f:
+                stored = json.load(f)
+            if stored["path"] == os.path.abspath(self.path) and stored["extension"] == self.extension:
+                self._listings = stored["dates"]
+
+    def save(self, index_file):
+        tmp_file = f"{index_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"path": os.path.abspath(self.path), "extension": self.extension, "dates": self._listings}, f)
+        os.replace(tmp_file, index_file)
+
+    # returns number of (re-)listed date directories
+    def update(self):
+        num_listed = 0
+        for subdir in self.subdirs:
+            mtime = self.source.mtime(subdir)
+            if mtime is None:
+                if subdir in self._listings:
+                    del self._listings[subdir]
+                continue
+            listing = self._listings.get(subdir)
+            if listing and listing["mtime"] == mtime and "sizes" in listing and "tar_members" in listing:
+                self.source.set_tar_members(subdir, listing["tar_members"])
+                continue
+            self.source.set_tar_members(subdir, None)
+            files, sizes = self.source.list(subdir)
+            tar_members = self.source.tar_members(subdir)
+            self._listings[subdir] = {"mtime": mtime, "files": files, "sizes": sizes, "tar_members": tar_members}
+            num_listed += 1
+
+        self._versions = defaultdict(list)
+        for subdir in self.subdirs:
+            if subdir in self._listings:
+                for file_name in self._listings[subdir]["files"]:
+                    self._versions[file_name].append(subdir)
+        return num_listed
+
+    # table files of a date in directory order, None if there is no directory for this date
+    def files(self, date):
+        if not date in self._listings:
+            return None
+        return self._listings[date]["files"]
+
+    # file sizes at listing time, in the order of files(date)
+    def sizes(self, date):
+        if not date in self._listings:
+            return None
+        return self._listings[date]["sizes"]
+
+    # latest date before the given date with a snapshot of the table
+    def previous_version(self, file_name, date):
+        dates = self._versions.get(file_name)
+        if not dates:
+            return None
+        position = bisect_left(dates, date)
+        return dates[position - 1] if position > 0 else None
+
+    # earliest date after the given date with a snapshot of the table
+    def next_version(self, file_name, date):
+        dates = self._versions.get(file_name)
+        if not dates:
+            return None
+        position = bisect_right(dates, date)
+        return dates[position] if position < len(dates) else None
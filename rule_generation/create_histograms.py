@@ -6,25 +6,65 @@ import math
 import multiprocessing as mp
 import os
 import queue
+import random
+import sys
+from bisect import bisect_left
 from collections import defaultdict
 from datetime import datetime
 from itertools import product
 from time import time
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from rule_generation.run_manifest import RunManifest
+from util.change_dictionary import ChangeDictionary
+from util.change_index import change_supports, load_change_index
+from util.util import load_json
+
 
 def parse_args():
+    thread_default = 10
+    sample_default = 1000
+
+    ap = argparse.ArgumentParser(description="Discovers change dependencies.")
+    add_mining_arguments(ap)
+    ap.add_argument(
+        "--threads",
+        "-t",
+        type=int,
+        help=f"Number of threads. Default {thread_default}",
+        default=thread_default,
+    )
+    ap.add_argument(
+        "--extensive_log",
+        action="store_true",
+        help=f"Detailed log messages",
+    )
+    ap.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Only estimate candidate pairs, work, memory and rule count instead of mining",
+    )
+    ap.add_argument(
+        "--sample_size",
+        type=int,
+        help=f"Number of sampled changes for --estimate. Default {sample_default}",
+        default=sample_default,
+    )
+    return vars(ap.parse_args())
+
+
+# resumable runs need the run directory, which clients of a mining daemon do not have
+def add_mining_arguments(ap, resumable=True):
     min_sup_default = 0.05
     max_sup_default = 0.1
     min_conf_default = 0.9
-    thread_default = 10
     bin_default = 11
     partition_default = 200
 
-    ap = argparse.ArgumentParser(description="Discovers change dependencies.")
     ap.add_argument(
         "change_file",
         type=str,
-        help="File with occurrences per change (expect Python dict as JSON)",
+        help="File with occurrences per change (expect Python dict as JSON or binary change index)",
     )
     ap.add_argument(
         "timepoint_file",
@@ -63,19 +103,19 @@ def parse_args():
         help=f"Partition Size. Default {partition_default}",
         default=partition_default,
     )
+    if not resumable:
+        return
     ap.add_argument(
-        "--threads",
-        "-t",
-        type=int,
-        help=f"Number of threads. Default {thread_default}",
-        default=thread_default,
+        "--run_dir",
+        type=str,
+        help="Directory for partitions, result shards and the run manifest. Default <output>.run",
+        default=None,
     )
     ap.add_argument(
-        "--extensive_log",
+        "--resume",
         action="store_true",
-        help=f"Detailed log messages",
+        help="Resume an interrupted run, skipping finished partition combinations",
     )
-    return vars(ap.parse_args())
 
 
 class Histogram:
@@ -118,9 +158,10 @@ class Histogram:
 
 
 class Job:
-    def __init__(self, antecedents, consequents):
+    def __init__(self, antecedents, consequents, job_id):
         self.antecedents = antecedents
         self.consequents = consequents
+        self.job_id = job_id
 
 
 def log(message, is_debug):
@@ -256,67 +297,21 @@ def create_histograms(args):
     start = datetime.now()
     print("start program:", start)
     min_sup = args["min_sup"]
-    max_sup = args["max_sup"]
-    temp_dir = "change_partitions"
-    partition_size = args["partition_size"]
+    run_dir = args["run_dir"] if "run_dir" in args and args["run_dir"] else f"{args['output']}.run"
+    resume = "resume" in args and args["resume"]
+    manifest = RunManifest(run_dir)
 
     # get time points of changes for support
-    with open(args["timepoint_file"]) as f:
-        actual_days = json.load(f)
+    actual_days = load_json(args["timepoint_file"])
     min_support_threshold = math.ceil(min_sup * len(actual_days))
-    max_support_threshold = math.floor(max_sup * len(actual_days))
-
-    # get index change -> dates
-    with open(args["change_file"]) as f:
-        all_changes = json.load(f)
-
-    whitelist = None
-    if "whitelist" in args and args["whitelist"]:
-        with open(args["whitelist"]) as f:
-            whitelist = set(json.load(f))
-
-    # build index date -> changes
-    # remove change if min support to low
-    daily_changes = defaultdict(set)
-    too_infrequent_changes = set()
-    blacklist_changes = set()
-    for change, occurrences in all_changes.items():
-        if whitelist and (not change.split("_")[0] in whitelist):
-            blacklist_changes.add(change)
-            continue
-        if len(occurrences) < min_support_threshold or len(occurrences) > max_support_threshold:
-            too_infrequent_changes.add(change)
-            continue
-        for date in occurrences:
-            daily_changes[date].add(change)
-    for change in too_infrequent_changes:
-        del all_changes[change]
-    for change in blacklist_changes:
-        del all_changes[change]
 
-    changes = list(all_changes.keys())
-    if whitelist:
-        print(f"ignoring changes not within {whitelist}")
-    print(f"input: {len(changes)} changes with {min_sup} <= sup(X) <= {max_sup}")
+    all_jobs = prepare_run(args, manifest, actual_days, resume)
+    completed_jobs = manifest.completed_jobs()
+    jobs = [job for job in all_jobs if not job.job_id in completed_jobs]
+    if completed_jobs:
+        print(f"[INFO] Resuming run, {len(completed_jobs)}/{len(all_jobs)} partition combinations already done.")
 
-    # partition change index
-    partition_buckets = [
-        min(partition_size * i, len(changes)) for i in range(math.ceil(len(changes) / partition_size) + 1)
-    ]
-    if not os.path.isdir(temp_dir):
-        os.makedirs(temp_dir)
-    time_stamp = time()
-    partition_files = []
-    for i in range(len(partition_buckets)):
-        partition_start = 0 if i == 0 else partition_buckets[i - 1]
-        partition_end = partition_buckets[i]
-        partition_keys = set(changes[partition_start:partition_end])
-        partition = {k: v for k, v in all_changes.items() if k in partition_keys}
-        file_name = os.path.join(temp_dir, f"{time_stamp}_partition_{i}.json")
-        partition_files.append(file_name)
-        with open(file_name, "w") as f:
-            json.dump(partition, f)
-    num_combinations = len(partition_files) ** 2
+    num_combinations = len(jobs)
     num_threads = args["threads"]
     if num_combinations < num_threads:
         print(
@@ -337,7 +332,7 @@ def create_histograms(args):
                     min_support_threshold,
                     args["min_conf"],
                     args["num_bins"],
-                    args["output"],
+                    manifest,
                     actual_days,
                     mutex,
                     args["extensive_log"],
@@ -346,8 +341,8 @@ def create_histograms(args):
             for n in range(num_threads)
         ]
 
-        for a, d in product(partition_files, repeat=2):
-            job_queue.put(Job(a, d))
+        for job in jobs:
+            job_queue.put(job)
 
         # start histogram creation
         for worker in workers:
@@ -355,16 +350,131 @@ def create_histograms(args):
         for worker in workers:
             worker.join()
 
-    # cleanup
-    for file_name in partition_files:
-        os.remove(file_name)
+    # only build final output if all partition combinations are done
+    completed_jobs = manifest.completed_jobs()
+    num_missing = len(all_jobs) - len(completed_jobs)
+    if num_missing > 0:
+        print(f"[WARNING] {num_missing} partition combination(s) failed. Restart with --resume to complete {run_dir}.")
+    else:
+        manifest.assemble(args["output"], [job.job_id for job in all_jobs])
+        manifest.remove()
     end = datetime.now()
     print("end program:", end)
     print("duration:", end - start)
 
 
-def task_main(my_id, jobs, min_support_threshold, min_conf, num_bins, result_file, all_days, mutex, do_log):
+def prepare_run(args, manifest, actual_days, resume):
+    min_sup = args["min_sup"]
+    max_sup = args["max_sup"]
+    run_config = {key: args[key] if key in args else None for key in run_parameters()}
+    manifest.check_run_dir()
+    if resume and manifest.exists():
+        stored_config = manifest.load_config()
+        differing = [key for key in run_parameters() if stored_config["parameters"][key] != run_config[key]]
+        if differing:
+            raise ValueError(f"Cannot resume {manifest.run_dir}, parameters differ: {', '.join(differing)}")
+        num_partitions = stored_config["num_partitions"]
+        print(f"input: {stored_config['num_changes']} changes with {min_sup} <= sup(X) <= {max_sup}")
+    else:
+        if resume:
+            print(f"[INFO] No run to resume at {manifest.run_dir}, starting from scratch.")
+        num_changes, partitions, dictionary = partition_changes(args, actual_days)
+        num_partitions = len(partitions)
+        manifest.create(
+            {
+                "parameters": run_config,
+                "num_changes": num_changes,
+                "num_partitions": num_partitions,
+                "created": time(),
+            }
+        )
+        dictionary.save(manifest.dictionary_path())
+        for i, partition in enumerate(partitions):
+            with open(manifest.partition_path(i), "w") as f:
+                json.dump(list(partition.items()), f)
+        del partitions
+        del dictionary
+
+    return [
+        Job(manifest.partition_path(a), manifest.partition_path(c), f"{a}-{c}")
+        for a, c in product(range(num_partitions), repeat=2)
+    ]
+
+
+def run_parameters():
+    return [
+        "change_file",
+        "timepoint_file",
+        "min_sup",
+        "max_sup",
+        "min_conf",
+        "num_bins",
+        "partition_size",
+        "whitelist",
+    ]
+
+
+def partition_changes(args, actual_days):
+    min_sup = args["min_sup"]
+    max_sup = args["max_sup"]
+    partition_size = args["partition_size"]
+    min_support_threshold = math.ceil(min_sup * len(actual_days))
+    max_support_threshold = math.floor(max_sup * len(actual_days))
+
+    all_changes, whitelist = load_changes(args)
+    all_ids = ChangeDictionary()
+    changes = select_changes(all_changes, all_ids, min_support_threshold, max_support_threshold, whitelist)
+    if whitelist:
+        print(f"ignoring changes not within {whitelist}")
+    print(f"input: {len(changes)} changes with {min_sup} <= sup(X) <= {max_sup}")
+
+    # selected changes are numbered 0..n-1, partitions map these ids to their occurrences
+    dictionary = ChangeDictionary.from_changes(all_ids[change] for change in changes)
+    partitions = [
+        {i: all_changes[dictionary[i]] for i in ids} for ids in split_partitions(range(len(dictionary)), partition_size)
+    ]
+    return len(changes), partitions, dictionary
+
+
+def load_changes(args):
+    # get index change -> dates
+    all_changes = load_change_index(args["change_file"])
+
+    whitelist = None
+    if "whitelist" in args and args["whitelist"]:
+        whitelist = set(load_json(args["whitelist"]))
+    return all_changes, whitelist
+
+
+# remove change if min support to low or not in whitelist
+# all changes are interned in the dictionary, selected changes are returned as ids
+def select_changes(all_changes, dictionary, min_support_threshold, max_support_threshold, whitelist):
+    changes = list()
+    for change, support in change_supports(all_changes):
+        change_id = dictionary.intern(change)
+        if whitelist and (not dictionary.table(change_id) in whitelist):
+            continue
+        if support < min_support_threshold or support > max_support_threshold:
+            continue
+        changes.append(change_id)
+    return changes
+
+
+def split_partitions(changes, partition_size):
+    partition_buckets = [
+        min(partition_size * i, len(changes)) for i in range(math.ceil(len(changes) / partition_size) + 1)
+    ]
+    partitions = []
+    for i in range(len(partition_buckets)):
+        partition_start = 0 if i == 0 else partition_buckets[i - 1]
+        partition_end = partition_buckets[i]
+        partitions.append(changes[partition_start:partition_end])
+    return partitions
+
+
+def task_main(my_id, jobs, min_support_threshold, min_conf, num_bins, manifest, all_days, mutex, do_log):
     log(f"[Start Worker {my_id}]", True)
+    dictionary = ChangeDictionary.load(manifest.dictionary_path())
     while True:
         try:
             job = jobs.get_nowait()
@@ -372,59 +482,171 @@ def task_main(my_id, jobs, min_support_threshold, min_conf, num_bins, result_fil
             log(f"[Exit Worker {my_id}]", True)
             return
 
+        job_start = time()
         antecedent_file = job.antecedents
         consequent_file = job.consequents
 
         log(f"Worker {my_id}: {antecedent_file} - {consequent_file}", do_log)
 
         # get indexes change -> dates
-        with open(antecedent_file) as f:
-            antecedents = json.load(f)
-        with open(consequent_file) as f:
-            consequents = json.load(f)
-
-        # build indexes date -> changes
-        daily_antecedents = defaultdict(set)
-        for change, occurrences in antecedents.items():
-            for date in occurrences:
-                daily_antecedents[date].add(change)
-
-        daily_consequents = defaultdict(set)
-        for change, occurrences in consequents.items():
-            for date in occurrences:
-                daily_consequents[date].add(change)
-
-        result = get_histograms_of_partitions(
-            antecedents,
-            daily_antecedents,
-            consequents,
-            daily_consequents,
-            min_support_threshold,
-            min_conf,
-            all_days,
-            num_bins,
-            do_log,
-        )
+        antecedents = read_partition(antecedent_file)
+        consequents = read_partition(consequent_file)
+
+        result = mine_partitions(antecedents, consequents, min_support_threshold, min_conf, all_days, num_bins, do_log)
 
         del antecedents
         del consequents
-        del daily_antecedents
-        del daily_consequents
 
+        manifest.write_shard(job.job_id, lambda f: write_rule_lines(result, f, dictionary))
+        num_rules = count_rules(result)
         with mutex:
-            write_rules(result, result_file)
+            manifest.record(job.job_id, num_rules, my_id, time() - job_start)
         del result
 
 
-def write_rules(rules, result_file):
+def read_partition(file_name):
+    with open(file_name) as f:
+        return {change: occurrences for change, occurrences in json.load(f)}
+
+
+def mine_partitions(antecedents, consequents, min_support_threshold, min_conf, all_days, num_bins, do_log):
+    # build indexes date -> changes
+    daily_antecedents = defaultdict(set)
+    for change, occurrences in antecedents.items():
+        for date in occurrences:
+            daily_antecedents[date].add(change)
+
+    daily_consequents = defaultdict(set)
+    for change, occurrences in consequents.items():
+        for date in occurrences:
+            daily_consequents[date].add(change)
+
+    return get_histograms_of_partitions(
+        antecedents,
+        daily_antecedents,
+        consequents,
+        daily_consequents,
+        min_support_threshold,
+        min_conf,
+        all_days,
+        num_bins,
+        do_log,
+    )
+
+
+def count_rules(rules):
+    return sum([len(consequents) for consequents in rules.values()])
+
+
+def write_rules(rules, result_file, dictionary):
     with open(result_file, "a") as f:
-        for antecedent, consequents in rules.items():
-            for consequent, hist in consequents.items():
-                hist_string = f"\"[{', '.join([str(x) for x in hist.bins()])}]\""
-                f.write(
-                    f"{antecedent};{consequent};{hist.abs_support()};{hist.confidence()};{hist.lift};{hist_string}\n"
-                )
+        write_rule_lines(rules, f, dictionary)
+
+
+def write_rule_lines(rules, f, dictionary):
+    for antecedent, consequents in rules.items():
+        antecedent_name = dictionary[antecedent]
+        for consequent, hist in consequents.items():
+            hist_string = f"\"[{', '.join([str(x) for x in hist.bins()])}]\""
+            f.write(
+                f"{antecedent_name};{dictionary[consequent]};{hist.abs_support()};{hist.confidence()};{hist.lift};{hist_string}\n"
+            )
+
+
+def estimate_run(args):
+    min_sup = args["min_sup"]
+    max_sup = args["max_sup"]
+    min_conf = args["min_conf"]
+    num_bins = args["num_bins"]
+    partition_size = args["partition_size"]
+    sample_size = args["sample_size"]
+
+    actual_days = load_json(args["timepoint_file"])
+    min_support_threshold = math.ceil(min_sup * len(actual_days))
+    max_support_threshold = math.floor(max_sup * len(actual_days))
+    all_changes, whitelist = load_changes(args)
+    dictionary = ChangeDictionary()
+    changes = select_changes(all_changes, dictionary, min_support_threshold, max_support_threshold, whitelist)
+    num_changes = len(changes)
+    num_partitions = len([partition for partition in split_partitions(changes, partition_size) if partition])
+    print(f"input: {num_changes} changes with {min_sup} <= sup(X) <= {max_sup}")
+    print(f"partitions: {num_partitions} of size {partition_size}, {num_partitions ** 2} partition combinations")
+    if num_changes < 2:
+        return
+
+    # a rule X -> Y can only reach min conf if |Y| / |X| >= min conf, self-combinations are prohibited
+    change_support = [support for _, support in change_supports(all_changes)]
+    supports = sorted([change_support[change] for change in changes])
+    candidate_pairs = 0
+    for support in supports:
+        candidate_pairs += len(supports) - bisect_left(supports, min_conf * support)
+        if support >= min_conf * support:
+            candidate_pairs -= 1
+    all_pairs = num_changes * (num_changes - 1)
+    print(f"candidate pairs: {candidate_pairs} of {all_pairs} ({round(candidate_pairs / all_pairs * 100, 2)} %)")
+
+    random.seed(42)
+    sample = random.sample(changes, min(sample_size, num_changes))
+    sample_changes = {change: all_changes[dictionary[change]] for change in sample}
+    scale = all_pairs / (len(sample) * (len(sample) - 1))
+
+    # pair loop work: for each consequent occurrence, all antecedents that occurred within the window
+    day_indexes = {day: i for i, day in enumerate(actual_days)}
+    consequents_per_day = [0 for _ in actual_days]
+    active_per_day = [0 for _ in actual_days]
+    for occurrences in sample_changes.values():
+        active_days = set()
+        for occurrence in occurrences:
+            if not occurrence in day_indexes:
+                continue
+            day_index = day_indexes[occurrence]
+            consequents_per_day[day_index] += 1
+            active_days.update(range(day_index, min(day_index + num_bins, len(actual_days))))
+        for day_index in active_days:
+            active_per_day[day_index] += 1
+    sample_work = sum([c * a for c, a in zip(consequents_per_day, active_per_day)])
+    work = sample_work * (num_changes / len(sample)) ** 2
+    print(f"pair loop iterations: {round(work)} overall, {round(work / num_partitions ** 2)} per partition combination")
+
+    # mine the sample as a single partition combination and extrapolate
+    sample_start = time()
+    sample_rules = count_rules(
+        mine_partitions(sample_changes, sample_changes, min_support_threshold, min_conf, actual_days, num_bins, False)
+    )
+    sample_duration = time() - sample_start
+    print(f"expected rules: {round(sample_rules * scale)} ({sample_rules} in sample of {len(sample)} changes)")
+    cpu_time = sample_duration * (num_changes / len(sample)) ** 2
+    print(
+        f"expected runtime: {round(cpu_time)} s CPU time, {round(cpu_time / args['threads'])} s with {args['threads']} threads"
+    )
+
+    # two partitions, their daily indexes and at most all candidate pairs of the combination as histograms
+    sample_change_size = sum(
+        [
+            sys.getsizeof(change) + sys.getsizeof(occurrences) + sum([sys.getsizeof(o) for o in occurrences])
+            for change, occurrences in sample_changes.items()
+        ]
+    )
+    sample_occurrences = sum([len(occurrences) for occurrences in sample_changes.values()])
+    hist = Histogram()
+    hist.setup(num_bins, 1)
+    hist_size = sys.getsizeof(hist) + sys.getsizeof(hist.__dict__) + sys.getsizeof(hist.bins()) + 2 * 64
+    partition_count = min(partition_size, num_changes)
+    partition_memory = (sample_change_size / len(sample) + 100) * partition_count
+    daily_index_memory = sample_occurrences / len(sample) * partition_count * 64
+    hist_memory = candidate_pairs / num_partitions**2 * hist_size
+    worker_memory = 2 * (partition_memory + daily_index_memory) + hist_memory
+    print(
+        f"peak memory per worker: ~{round(worker_memory / 1024 ** 2, 1)} MiB",
+        f"({round(2 * partition_memory / 1024 ** 2, 1)} MiB partitions,",
+        f"{round(2 * daily_index_memory / 1024 ** 2, 1)} MiB daily indexes,",
+        f"<= {round(hist_memory / 1024 ** 2, 1)} MiB histograms)",
+    )
 
 
 if __name__ == "__main__":
-    create_histograms(parse_args())
+    args = parse_args()
+    if args["estimate"]:
+        estimate_run(args)
+    else:
+        create_histograms(args)
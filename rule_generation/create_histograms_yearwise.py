@@ -16,7 +16,8 @@ from time import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
 from rule_generation.create_histograms import create_histograms
-from util.util import date_range
+from rule_generation.mining_daemon import request_mining
+from util.util import date_range, load_json
 
 
 def parse_args():
@@ -52,15 +53,25 @@ def parse_args():
         help=f"YAML file with infobox whitelist and categories. Default None",
         default=None,
     )
+    ap.add_argument(
+        "--daemon",
+        "-d",
+        type=str,
+        help=f"Address of a running mining_daemon.py to send the runs to. Default None, runs are started locally",
+        default=None,
+    )
 
-    return vars(ap.parse_args())
+    args = vars(ap.parse_args())
+    if args["daemon"] and not os.environ.get("MINING_AUTHKEY"):
+        ap.error("set MINING_AUTHKEY to the authkey of the mining daemon")
+    return args
 
 
 def to_str(n):
     return str(n).replace(".", "")
 
 
-def main(change_dir, out, min_conf, min_sup, max_sup, granularity, whitelists_file):
+def main(change_dir, out, min_conf, min_sup, max_sup, granularity, whitelists_file, daemon):
     if not os.path.isdir(out):
         os.makedirs(out)
 
@@ -92,8 +103,7 @@ def main(change_dir, out, min_conf, min_sup, max_sup, granularity, whitelists_fi
     for input_file in input_files:
         file_path = os.path.join(change_dir, input_file)
         print(f"Loading changes")
-        with open(file_path) as f:
-            all_changes = json.load(f)
+        all_changes = load_json(file_path)
         for whitelist in whitelists:
             if not whitelist:
                 continue
@@ -163,9 +173,12 @@ def main(change_dir, out, min_conf, min_sup, max_sup, granularity, whitelists_fi
                     params["timepoint_file"] = days_file
                     params["output"] = out_file
 
-                    p = mp.Process(target=create_histograms, args=[params])
-                    p.start()
-                    p.join()
+                    if daemon:
+                        request_mining(daemon, os.environ.get("MINING_AUTHKEY"), params)
+                    else:
+                        p = mp.Process(target=create_histograms, args=[params])
+                        p.start()
+                        p.join()
                     print("\n")
                 if whitelist:
                     os.remove(whitelist_file)
@@ -185,4 +198,5 @@ if __name__ == "__main__":
         args["max_sup"],
         args["granularity"],
         args["infoboxes"],
+        args["daemon"],
     )
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+import argparse
+import io
+import math
+import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from multiprocessing.managers import BaseManager
+from time import sleep, time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from rule_generation.create_histograms import (
+    add_mining_arguments,
+    count_rules,
+    log,
+    mine_partitions,
+    prepare_run,
+    read_partition,
+    write_rule_lines,
+)
+from rule_generation.run_manifest import RunManifest
+from util.change_dictionary import ChangeDictionary
+from util.util import load_json
+
+
+def parse_args():
+    port_default = 50123
+    lease_timeout_default = 60
+    thread_default = 10
+
+    ap = argparse.ArgumentParser(description="Discovers change dependencies on multiple machines.")
+    subparsers = ap.add_subparsers(dest="mode", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="Partition changes and hand out jobs to workers")
+    add_mining_arguments(coordinator)
+    coordinator.add_argument("--host", type=str, help="Interface to listen on. Default 0.0.0.0", default="0.0.0.0")
+    coordinator.add_argument("--port", "-p", type=int, help=f"Port. Default {port_default}", default=port_default)
+    coordinator.add_argument(
+        "--lease_timeout",
+        type=int,
+        help=f"Seconds without heartbeat until a worker's jobs are reassigned. Default {lease_timeout_default}",
+        default=lease_timeout_default,
+    )
+
+    worker = subparsers.add_parser("worker", help="Connect to a coordinator and mine partition combinations")
+    worker.add_argument("host", type=str, help="Host of the coordinator")
+    worker.add_argument("--port", "-p", type=int, help=f"Port. Default {port_default}", default=port_default)
+    worker.add_argument(
+        "--threads", "-t", type=int, help=f"Number of threads. Default {thread_default}", default=thread_default
+    )
+    worker.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory to cache fetched partitions. Default ./partition_cache",
+        default="partition_cache",
+    )
+    worker.add_argument("--extensive_log", action="store_true", help=f"Detailed log messages")
+
+    for subparser in [coordinator, worker]:
+        subparser.add_argument(
+            "--authkey",
+            type=str,
+            help="Shared secret of coordinator and workers. Default environment variable MINING_AUTHKEY",
+            default=os.environ.get("MINING_AUTHKEY"),
+        )
+    args = vars(ap.parse_args())
+    if not args["authkey"]:
+        ap.error("an authkey is required, use --authkey or set MINING_AUTHKEY")
+    return args
+
+
+class Coordinator:
+    def __init__(self, manifest, jobs, mining_config, lease_timeout):
+        self._lock = threading.Lock()
+        self._manifest = manifest
+        self._completed = set(manifest.completed_jobs().keys())
+        self._pending = deque([job.job_id for job in jobs if not job.job_id in self._completed])
+        self._num_jobs = len(jobs)
+        self._leases = dict()
+        self._heartbeats = dict()
+        self._mining_config = mining_config
+        self._lease_timeout = lease_timeout
+        self.done = threading.Event()
+        if len(self._completed) == self._num_jobs:
+            self.done.set()
+
+    def mining_config(self):
+        return self._mining_config
+
+    def get_partition(self, partition_index):
+        with open(self._manifest.partition_path(partition_index)) as f:
+            return f.read()
+
+    def get_dictionary(self):
+        with open(self._manifest.dictionary_path(), encoding="utf-8") as f:
+            return f.read()
+
+    # returns None if all jobs are done, an empty string if remaining jobs are leased to other workers
+    def get_job(self, worker):
+        with self._lock:
+            self._heartbeats[worker] = time()
+            if self._pending:
+                job_id = self._pending.popleft()
+                self._leases[job_id] = worker
+                return job_id
+            if self._leases:
+                return ""
+            return None
+
+    def heartbeat(self, worker):
+        with self._lock:
+            self._heartbeats[worker] = time()
+
+    def submit(self, worker, job_id, rules, num_rules, duration):
+        with self._lock:
+            self._heartbeats[worker] = time()
+            if job_id in self._completed:
+                return
+        self._manifest.write_shard(job_id, lambda f: f.write(rules))
+        with self._lock:
+            # a reassigned job may have been submitted by another worker while the shard was written
+            if job_id in self._completed:
+                return
+            self._manifest.record(job_id, num_rules, worker, duration)
+            self._completed.add(job_id)
+            if job_id in self._leases:
+                del self._leases[job_id]
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+            log(f"{job_id} done by {worker} ({len(self._completed)}/{self._num_jobs})", True)
+            if len(self._completed) == self._num_jobs:
+                self.done.set()
+
+    def reassign_lost_jobs(self):
+        with self._lock:
+            now = time()
+            lost_workers = {worker for worker, seen in self._heartbeats.items() if now - seen > self._lease_timeout}
+            for job_id, worker in list(self._leases.items()):
+                if worker in lost_workers:
+                    log(f"[WARNING] Lost worker {worker}, reassigning {job_id}", True)
+                    del self._leases[job_id]
+                    self._pending.appendleft(job_id)
+            for worker in lost_workers:
+                del self._heartbeats[worker]
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+def run_coordinator(args):
+    start = datetime.now()
+    print("start program:", start)
+    run_dir = args["run_dir"] if args["run_dir"] else f"{args['output']}.run"
+    manifest = RunManifest(run_dir)
+
+    actual_days = load_json(args["timepoint_file"])
+    jobs = prepare_run(args, manifest, actual_days, args["resume"])
+    mining_config = {
+        "run_id": f"{manifest.load_config()['created']}",
+        "min_support_threshold": math.ceil(args["min_sup"] * len(actual_days)),
+        "min_conf": args["min_conf"],
+        "num_bins": args["num_bins"],
+        "days": actual_days,
+    }
+
+    coordinator = Coordinator(manifest, jobs, mining_config, args["lease_timeout"])
+    CoordinatorManager.register("coordinator", callable=lambda: coordinator)
+    manager = CoordinatorManager(address=(args["host"], args["port"]), authkey=args["authkey"].encode())
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Coordinator listening on {args['host']}:{args['port']} with {len(jobs)} partition combinations")
+
+    while not coordinator.done.wait(min(5, args["lease_timeout"])):
+        coordinator.reassign_lost_jobs()
+
+    manifest.assemble(args["output"], [job.job_id for job in jobs])
+    manifest.remove()
+    end = datetime.now()
+    print("end program:", end)
+    print("duration:", end - start)
+
+
+class WorkerManager(BaseManager):
+    pass
+
+
+WorkerManager.register("coordinator")
+
+
+def run_workers(args):
+    workers = [
+        mp.Process(
+            target=worker_main,
+            args=(
+                f"{n}".rjust(2),
+                args["host"],
+                args["port"],
+                args["authkey"],
+                args["cache_dir"],
+                args["extensive_log"],
+            ),
+        )
+        for n in range(args["threads"])
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def worker_main(my_id, host, port, authkey, cache_dir, do_log):
+    worker_name = f"{socket.gethostname()}-{os.getpid()}"
+    manager = WorkerManager(address=(host, port), authkey=authkey.encode())
+    manager.connect()
+    coordinator = manager.coordinator()
+    config = coordinator.mining_config()
+    partition_dir = os.path.join(cache_dir, config["run_id"])
+    os.makedirs(partition_dir, exist_ok=True)
+    dictionary = ChangeDictionary.load(
+        fetch_file(os.path.join(partition_dir, "changes.txt"), lambda: coordinator.get_dictionary())
+    )
+    log(f"[Start Worker {my_id}] as {worker_name}", True)
+
+    stop_heartbeat = threading.Event()
+    heartbeat_interval = 5
+
+    def send_heartbeats():
+        try:
+            while not stop_heartbeat.wait(heartbeat_interval):
+                coordinator.heartbeat(worker_name)
+        except (EOFError, ConnectionError):
+            return
+
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+
+    try:
+        while True:
+            job_id = coordinator.get_job(worker_name)
+            if job_id is None:
+                break
+            if not job_id:
+                sleep(heartbeat_interval)
+                continue
+
+            job_start = time()
+            antecedent_index, consequent_index = job_id.split("-")
+            log(f"Worker {my_id}: {job_id}", do_log)
+            antecedents = load_partition(coordinator, partition_dir, antecedent_index)
+            consequents = load_partition(coordinator, partition_dir, consequent_index)
+            result = mine_partitions(
+                antecedents,
+                consequents,
+                config["min_support_threshold"],
+                config["min_conf"],
+                config["days"],
+                config["num_bins"],
+                do_log,
+            )
+            del antecedents
+            del consequents
+
+            rules = io.StringIO()
+            write_rule_lines(result, rules, dictionary)
+            coordinator.submit(worker_name, job_id, rules.getvalue(), count_rules(result), time() - job_start)
+            del result
+    except (EOFError, ConnectionError):
+        log(f"Worker {my_id}: lost connection to coordinator", True)
+    stop_heartbeat.set()
+    log(f"[Exit Worker {my_id}]", True)
+
+
+def load_partition(coordinator, partition_dir, partition_index):
+    file_name = os.path.join(partition_dir, f"partition_{partition_index}.json")
+    return read_partition(fetch_file(file_name, lambda: coordinator.get_partition(int(partition_index))))
+
+
+def fetch_file(file_name, fetch):
+    if not os.path.isfile(file_name):
+        content = fetch()
+        # other local workers may fetch the same file concurrently
+        tmp_file = f"{file_name}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_file, file_name)
+    return file_name
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args["mode"] == "coordinator":
+        run_coordinator(args)
+    else:
+        run_workers(args)
@@ -1,12 +1,13 @@
 #!/usr/bin/python3
 
 import argparse
-import json
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
-from util.util import read_rule
+from rule_generation.rule_store import RuleStore, rule_line
+from util.change_dictionary import ChangeDictionary
+from util.util import load_json
 
 
 def parse_args():
@@ -14,57 +15,100 @@ def parse_args():
         description="Filter change dependencies s.t. left and right side share the same domain"
     )
     ap.add_argument("rule_file", type=str, help="File with rules stored as csv")
-    ap.add_argument("table_domain_file", type=str, help="File with an index table -> domain, python dict as JSON file")
     ap.add_argument(
-        "change_groups_file", type=str, help="File with an index change group -> changes, python dict as JSON file"
+        "table_domain_file",
+        type=str,
+        nargs="?",
+        help="File with an index table -> domain, python dict as JSON file. Not needed with --rule_db",
     )
-    return vars(ap.parse_args())
+    ap.add_argument(
+        "change_groups_file",
+        type=str,
+        nargs="?",
+        help="File with an index change group -> changes, python dict as JSON file. Not needed with --rule_db",
+    )
+    ap.add_argument(
+        "--rule_db",
+        type=str,
+        help="Rule database of rule_store.py with rule_file and domain mappings. If present, domains are joined in SQL",
+        default=None,
+    )
+    args = vars(ap.parse_args())
+    if not args["rule_db"] and not (args["table_domain_file"] and args["change_groups_file"]):
+        ap.error("table_domain_file and change_groups_file are required without --rule_db")
+    return args
 
 
-def domains_from_id(change, table_domains, change_groups):
+def domains_from_id(change_id, dictionary, table_domains, change_groups):
     domains = set()
-    table_id = lambda x: x[:9]
-    if not change.startswith("group"):
-        domains.add(table_domains[table_id(change)])
+    if not dictionary.is_group(change_id):
+        domains.add(table_domains[dictionary.table(change_id)])
     else:
-        for item in change_groups[change]:
-            domains.add(table_domains[table_id(item)])
+        for item in change_groups[dictionary[change_id]]:
+            domains.add(table_domains[dictionary.table(dictionary.intern(item))])
     return domains
 
 
-def main(rule_file, table_domain_file, change_groups_file):
-    with open(table_domain_file) as f:
-        table_domains = json.load(f)
+def main(rule_file, table_domain_file, change_groups_file, rule_db):
+    if rule_db:
+        result, num_before = filter_rule_store(rule_file, rule_db)
+    else:
+        table_domains = load_json(table_domain_file)
+        change_groups = load_json(change_groups_file)
+        result, num_before = filter_rule_file(rule_file, table_domains, change_groups)
+    print("before:", num_before)
+    print("now", len(result))
+
+    with open(f"{rule_file}_domain_filtered.csv", "w") as f:
+        for l in result:
+            f.write(l)
+
+
+# the rules and domain mappings have to be ingested with rule_store.py, the store is only read
+def filter_rule_store(rule_file, rule_db):
+    with RuleStore(rule_db, read_only=True) as store:
+        if not os.path.abspath(rule_file) in store.sources():
+            raise ValueError(f"{rule_file} is not stored in {rule_db}, ingest it with rule_store.py first")
+        missing = store.missing_domain_mappings()
+        if missing:
+            options = " and ".join([f"--{mapping}" for mapping in missing])
+            raise ValueError(f"{rule_db} has no {' and '.join(missing)}, ingest them with rule_store.py {options}")
+        result = list()
+        for rule in store.same_domain_rules(rule_file):
+            domain, num_domains = rule[-2:]
+            if num_domains > 1:
+                print(f"{num_domains} shared domains, using {domain}")
+            result.append(rule_line(rule)[:-1] + ";" + domain + "\n")
+        return result, store.count_rules(rule_file)
 
-    with open(change_groups_file) as f:
-        change_groups = json.load(f)
 
+def filter_rule_file(rule_file, table_domains, change_groups):
     result = list()
     num_before = 0
+    # rules share their changes, so each change id is parsed only once
+    dictionary = ChangeDictionary()
+    change_domains = dict()
+
+    def domains(change):
+        change_id = dictionary.intern(change)
+        if not change_id in change_domains:
+            change_domains[change_id] = domains_from_id(change_id, dictionary, table_domains, change_groups)
+        return change_domains[change_id]
 
     with open(rule_file) as f:
         for line in f:
             num_before += 1
             parts = line.split(";")
-            left_id = parts[0]
-            right_id = parts[1]
-            left_domains = domains_from_id(left_id, table_domains, change_groups)
-            right_domains = domains_from_id(right_id, table_domains, change_groups)
-            domain = left_domains & right_domains
+            domain = domains(parts[0]) & domains(parts[1])
             if len(domain) == 0:
                 continue
             line_strip = line.strip()
             if len(domain) > 1:
                 print(domain)
             result.append(line_strip + ";" + list(domain)[0] + "\n")
-    print("before:", num_before)
-    print("now", len(result))
-
-    with open(f"{rule_file}_domain_filtered.csv", "w") as f:
-        for l in result:
-            f.write(l)
+    return result, num_before
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args["rule_file"], args["table_domain_file"], args["change_groups_file"])
+    main(args["rule_file"], args["table_domain_file"], args["change_groups_file"], args["rule_db"])
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+import argparse
+import io
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+from datetime import datetime
+from itertools import product
+from multiprocessing.connection import Client, Listener
+from time import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_dictionary import ChangeDictionary
+from util.change_index import load_change_index
+from util.util import load_json
+from rule_generation.create_histograms import (
+    add_mining_arguments,
+    count_rules,
+    mine_partitions,
+    select_changes,
+    split_partitions,
+    write_rule_lines,
+)
+
+
+def parse_args():
+    address_default = "mining_daemon.sock"
+    thread_default = 10
+
+    ap = argparse.ArgumentParser(description="Keeps change indexes and a worker pool warm for repeated rule mining.")
+    subparsers = ap.add_subparsers(dest="mode", required=True)
+
+    serve = subparsers.add_parser("serve", help="Load change indexes and wait for mining requests")
+    serve.add_argument("change_files", type=str, nargs="+", help="Files with occurrences per change to load upfront")
+    serve.add_argument(
+        "--threads", "-t", type=int, help=f"Number of threads. Default {thread_default}", default=thread_default
+    )
+
+    request = subparsers.add_parser("request", help="Send a mining request to a running daemon")
+    add_mining_arguments(request, resumable=False)
+    request.add_argument(
+        "--whitelist", "-w", type=str, help="JSON file with list of tables to consider. Default all", default=None
+    )
+
+    stop = subparsers.add_parser("stop", help="Shut down a running daemon")
+
+    for subparser in [serve, request, stop]:
+        subparser.add_argument(
+            "--address",
+            "-a",
+            type=str,
+            help=f"Unix socket path or host:port of the daemon. Default {address_default}",
+            default=address_default,
+        )
+        subparser.add_argument(
+            "--authkey",
+            type=str,
+            help="Shared secret of daemon and clients. Default environment variable MINING_AUTHKEY",
+            default=os.environ.get("MINING_AUTHKEY"),
+        )
+    args = vars(ap.parse_args())
+    # requests are unpickled by the daemon, so only authenticated clients may connect
+    if not args["authkey"]:
+        ap.error("an authkey is required, use --authkey or set MINING_AUTHKEY")
+    return args
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+
+def encode_authkey(authkey):
+    if not authkey:
+        raise ValueError("An authkey is required, use --authkey or set MINING_AUTHKEY.")
+    return authkey.encode()
+
+
+# state of the daemon process, inherited by the pool workers
+_indexes = dict()
+_dictionaries = dict()
+_timepoints = dict()
+_partitions = dict()
+
+
+def load_index(change_file):
+    if not change_file in _indexes:
+        _indexes[change_file] = load_change_index(change_file)
+        _dictionaries[change_file] = ChangeDictionary.from_changes(_indexes[change_file].keys())
+    return _indexes[change_file]
+
+
+def load_timepoints(timepoint_file):
+    if not timepoint_file in _timepoints:
+        _timepoints[timepoint_file] = load_json(timepoint_file)
+    return _timepoints[timepoint_file]
+
+
+def init_worker(change_files):
+    # indexes are only inherited with the fork start method
+    for change_file in change_files:
+        load_index(change_file)
+
+
+def get_partitions(request):
+    key = json.dumps(
+        [request[k] for k in ["change_file", "timepoint_file", "min_sup", "max_sup", "partition_size", "whitelist"]]
+    )
+    if not key in _partitions:
+        _partitions.clear()
+        days = load_timepoints(request["timepoint_file"])
+        min_support_threshold = math.ceil(request["min_sup"] * len(days))
+        max_support_threshold = math.floor(request["max_sup"] * len(days))
+        whitelist = set(request["whitelist"]) if request["whitelist"] else None
+        changes = select_changes(
+            load_index(request["change_file"]),
+            _dictionaries[request["change_file"]],
+            min_support_threshold,
+            max_support_threshold,
+            whitelist,
+        )
+        _partitions[key] = split_partitions(changes, request["partition_size"])
+    return _partitions[key]
+
+
+# partitions are selected once per request by the daemon, jobs carry the change ids of both partitions
+def mine_job(job):
+    request, antecedent_ids, consequent_ids = job
+    all_changes = load_index(request["change_file"])
+    dictionary = _dictionaries[request["change_file"]]
+    days = load_timepoints(request["timepoint_file"])
+    antecedents = {change: all_changes[dictionary[change]] for change in antecedent_ids}
+    consequents = {change: all_changes[dictionary[change]] for change in consequent_ids}
+    result = mine_partitions(
+        antecedents,
+        consequents,
+        math.ceil(request["min_sup"] * len(days)),
+        request["min_conf"],
+        days,
+        request["num_bins"],
+        False,
+    )
+    rules = io.StringIO()
+    write_rule_lines(result, rules, dictionary)
+    return rules.getvalue(), count_rules(result)
+
+
+def serve(address, authkey, change_files, threads):
+    for change_file in change_files:
+        print(f"{datetime.now()} | loading {change_file}")
+        load_index(change_file)
+    pool = mp.Pool(processes=threads, initializer=init_worker, initargs=(list(_indexes.keys()),))
+
+    with Listener(parse_address(address), authkey=encode_authkey(authkey)) as listener:
+        print(f"{datetime.now()} | listening on {listener.address}")
+        while True:
+            with listener.accept() as conn:
+                command, request = conn.recv()
+                if command == "stop":
+                    conn.send(("done", None))
+                    break
+                try:
+                    if not request["change_file"] in _indexes:
+                        # new index has to be known by all workers, so the pool is restarted once
+                        print(f"{datetime.now()} | loading {request['change_file']}")
+                        load_index(request["change_file"])
+                        pool.close()
+                        pool.join()
+                        pool = mp.Pool(processes=threads, initializer=init_worker, initargs=(list(_indexes.keys()),))
+                    handle_request(conn, request, pool)
+                except (EOFError, ConnectionError):
+                    print(f"{datetime.now()} | client disconnected")
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+    pool.close()
+    pool.join()
+    if type(parse_address(address)) == str and os.path.exists(address):
+        os.remove(address)
+
+
+def handle_request(conn, request, pool):
+    start = time()
+    partitions = get_partitions(request)
+    num_changes = sum([len(partition) for partition in partitions])
+    print(f"{datetime.now()} | request {request['output']}: {num_changes} changes")
+    if request["whitelist"]:
+        conn.send(("log", f"ignoring changes not within {set(request['whitelist'])}"))
+    conn.send(("log", f"input: {num_changes} changes with {request['min_sup']} <= sup(X) <= {request['max_sup']}"))
+
+    jobs = [(request, antecedents, consequents) for antecedents, consequents in product(partitions, repeat=2)]
+    num_rules = 0
+    for rules, job_rules in pool.imap_unordered(mine_job, jobs):
+        conn.send(("rules", rules))
+        num_rules += job_rules
+    conn.send(("done", {"changes": num_changes, "rules": num_rules, "duration": time() - start}))
+
+
+def request_mining(address, authkey, config):
+    keys = ["change_file", "timepoint_file", "output", "min_sup", "max_sup", "min_conf", "num_bins", "partition_size"]
+    request = {key: config[key] for key in keys}
+    # the whitelist is read by the client, the daemon may run in another directory or on another host
+    request["whitelist"] = load_json(config["whitelist"]) if config.get("whitelist") else None
+    with Client(parse_address(address), authkey=encode_authkey(authkey)) as conn:
+        conn.send(("mine", request))
+        with open(config["output"], "w") as f:
+            while True:
+                kind, payload = conn.recv()
+                if kind == "rules":
+                    f.write(payload)
+                elif kind == "log":
+                    print(payload)
+                elif kind == "error":
+                    raise RuntimeError(f"Mining daemon failed: {payload}")
+                else:
+                    return payload
+
+
+def stop_daemon(address, authkey):
+    with Client(parse_address(address), authkey=encode_authkey(authkey)) as conn:
+        conn.send(("stop", None))
+        conn.recv()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args["mode"] == "serve":
+        serve(args["address"], args["authkey"], args["change_files"], args["threads"])
+    elif args["mode"] == "request":
+        start = datetime.now()
+        print("start program:", start)
+        summary = request_mining(args["address"], args["authkey"], args)
+        end = datetime.now()
+        print(f"{summary['rules']} rules")
+        print("end program:", end)
+        print("duration:", end - start)
+    else:
+        stop_daemon(args["address"], args["authkey"])
@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sqlite3
+import sys
+from itertools import repeat
+from urllib.request import pathname2url
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from util.change_dictionary import ChangeDictionary
+from util.util import Entity, iter_rule_columns, load_json
+
+# changes are interned, their ids are the ids of the ChangeDictionary
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT);
+CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY, change TEXT UNIQUE, tab TEXT, col TEXT, row TEXT, type TEXT);
+CREATE TABLE IF NOT EXISTS rules (
+    source INTEGER, antecedent INTEGER, consequent INTEGER,
+    support INTEGER, confidence REAL, lift REAL, histogram TEXT, extra TEXT
+);
+CREATE TABLE IF NOT EXISTS table_domains (tab TEXT PRIMARY KEY, domain TEXT);
+CREATE TABLE IF NOT EXISTS change_groups (group_name TEXT, member INTEGER);
+CREATE TABLE IF NOT EXISTS key_pages (key TEXT PRIMARY KEY, page_id TEXT);
+CREATE TABLE IF NOT EXISTS page_names (page_id TEXT PRIMARY KEY, name TEXT);
+CREATE INDEX IF NOT EXISTS changes_tab ON changes (tab);
+CREATE INDEX IF NOT EXISTS changes_row ON changes (row);
+CREATE INDEX IF NOT EXISTS change_groups_group ON change_groups (group_name);
+CREATE VIEW IF NOT EXISTS change_domains AS
+    SELECT c.id AS change, d.domain AS domain FROM changes c JOIN table_domains d ON d.tab = c.tab WHERE c.type != ''
+    UNION
+    SELECT c.id, d.domain FROM changes c
+    JOIN change_groups g ON g.group_name = c.change
+    JOIN changes m ON m.id = g.member
+    JOIN table_domains d ON d.tab = m.tab;
+"""
+
+# rule indexes are dropped during bulk loading and rebuilt afterwards
+RULE_INDEXES = {
+    "rules_source": "rules (source)",
+    "rules_antecedent": "rules (antecedent)",
+    "rules_consequent": "rules (consequent)",
+    "rules_support": "rules (support)",
+    "rules_lift": "rules (lift)",
+}
+
+RULE_COLUMNS = "a.change, c.change, r.support, r.confidence, r.lift, r.histogram, r.extra"
+RULE_JOINS = "FROM rules r JOIN changes a ON a.id = r.antecedent JOIN changes c ON c.id = r.consequent"
+
+
+class RuleStore:
+    # a read-only store has to exist and is not migrated to the current schema
+    def __init__(self, path, level=None, read_only=False):
+        self.path = path
+        self.level = level
+        if read_only:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Rule database {path} does not exist, create it with rule_store.py ingest")
+            self.connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+            self.connection.executescript(SCHEMA)
+            self._create_rule_indexes()
+        self._dictionary = None
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def dictionary(self):
+        if self._dictionary is None:
+            self._dictionary = ChangeDictionary(self.level)
+            for (change,) in self.connection.execute("SELECT change FROM changes ORDER BY id"):
+                self._dictionary.intern(change)
+        return self._dictionary
+
+    def _insert_changes(self, first_id):
+        dictionary = self.dictionary()
+        self.connection.executemany(
+            "INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    i,
+                    dictionary[i],
+                    dictionary.table(i),
+                    dictionary.column(i),
+                    dictionary.row(i),
+                    dictionary.change_type(i),
+                )
+                for i in range(first_id, len(dictionary))
+            ),
+        )
+
+    def _create_rule_indexes(self):
+        for name, columns in RULE_INDEXES.items():
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+    def _drop_rule_indexes(self):
+        for name in RULE_INDEXES:
+            self.connection.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def ingest_rules(self, rule_file, chunk_size=1000000):
+        path = os.path.abspath(rule_file)
+        dictionary = self.dictionary()
+        num_rules = 0
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM rules WHERE source IN (SELECT id FROM sources WHERE path = ?)", (path,)
+            )
+            self.connection.execute("DELETE FROM sources WHERE path = ?", (path,))
+            source = self.connection.execute(
+                "INSERT INTO sources (path, name) VALUES (?, ?)", (path, os.path.basename(path))
+            ).lastrowid
+            self._drop_rule_indexes()
+            known_changes = len(dictionary)
+            for rules in iter_rule_columns(rule_file, chunk_size, dictionary):
+                self._insert_changes(known_changes)
+                known_changes = len(dictionary)
+                histograms = [f"[{', '.join([str(x) for x in hist])}]" for hist in rules.histograms.tolist()]
+                extra = [";".join(columns) if columns else None for columns in rules.extra.tolist()]
+                self.connection.executemany(
+                    "INSERT INTO rules VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    zip(
+                        repeat(source),
+                        rules.antecedents.tolist(),
+                        rules.consequents.tolist(),
+                        rules.support.tolist(),
+                        rules.confidence.tolist(),
+                        rules.lift.tolist(),
+                        histograms,
+                        extra,
+                    ),
+                )
+                num_rules += len(rules)
+            self._create_rule_indexes()
+        return num_rules
+
+    def ingest_table_domains(self, table_domains):
+        with self.connection:
+            self.connection.execute("DELETE FROM table_domains")
+            self.connection.executemany("INSERT INTO table_domains VALUES (?, ?)", table_domains.items())
+
+    def ingest_change_groups(self, change_groups):
+        dictionary = self.dictionary()
+        known_changes = len(dictionary)
+        members = [(group, dictionary.intern(change)) for group, changes in change_groups.items() for change in changes]
+        for group in change_groups:
+            dictionary.intern(group)
+        with self.connection:
+            self._insert_changes(known_changes)
+            self.connection.execute("DELETE FROM change_groups")
+            self.connection.executemany("INSERT INTO change_groups VALUES (?, ?)", members)
+
+    def ingest_key_pages(self, key_to_page):
+        with self.connection:
+            self.connection.execute("DELETE FROM key_pages")
+            self.connection.executemany(
+                "INSERT INTO key_pages VALUES (?, ?)", ((key, str(page)) for key, page in key_to_page.items())
+            )
+
+    def ingest_page_names(self, page_to_name):
+        with self.connection:
+            self.connection.execute("DELETE FROM page_names")
+            self.connection.executemany(
+                "INSERT INTO page_names VALUES (?, ?)", ((str(page), name) for page, name in page_to_name.items())
+            )
+
+    # mappings needed to find the domains of changes that were not ingested
+    def missing_domain_mappings(self):
+        missing = list()
+        if self.connection.execute("SELECT COUNT(*) FROM table_domains").fetchone()[0] == 0:
+            missing.append("table_domains")
+        has_groups = self.connection.execute("SELECT EXISTS (SELECT 1 FROM changes WHERE type = '')").fetchone()[0]
+        if has_groups and self.connection.execute("SELECT COUNT(*) FROM change_groups").fetchone()[0] == 0:
+            missing.append("change_groups")
+        return missing
+
+    def sources(self):
+        return [path for (path,) in self.connection.execute("SELECT path FROM sources ORDER BY id")]
+
+    def count_rules(self, source):
+        query = "SELECT COUNT(*) FROM rules WHERE source = (SELECT id FROM sources WHERE path = ?)"
+        return self.connection.execute(query, (os.path.abspath(source),)).fetchone()[0]
+
+    # yields (antecedent, consequent, support, confidence, lift, histogram, extra) in ingestion order
+    def rules(
+        self,
+        antecedent=None,
+        consequent=None,
+        table=None,
+        domain=None,
+        min_support=None,
+        min_confidence=None,
+        min_lift=None,
+        sources=None,
+        limit=None,
+    ):
+        conditions = list()
+        parameters = list()
+        if antecedent is not None:
+            conditions.append("a.change = ?")
+            parameters.append(antecedent)
+        if consequent is not None:
+            conditions.append("c.change = ?")
+            parameters.append(consequent)
+        if table is not None:
+            conditions.append("(a.tab = ? OR c.tab = ?)")
+            parameters += [table, table]
+        if domain is not None:
+            conditions.append(
+                "(r.antecedent IN (SELECT change FROM change_domains WHERE domain = ?)"
+                + " OR r.consequent IN (SELECT change FROM change_domains WHERE domain = ?))"
+            )
+            parameters += [domain, domain]
+        for column, threshold in [("support", min_support), ("confidence", min_confidence), ("lift", min_lift)]:
+            if threshold is not None:
+                conditions.append(f"r.{column} >= ?")
+                parameters.append(threshold)
+        if sources:
+            conditions.append(f"r.source IN (SELECT id FROM sources WHERE path IN ({', '.join('?' * len(sources))}))")
+            parameters += [os.path.abspath(source) for source in sources]
+        query = f"SELECT {RULE_COLUMNS} {RULE_JOINS}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY r.rowid"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self.connection.execute(query, parameters)
+
+    # rules whose antecedent and consequent share a domain, with the smallest shared domain and the number of domains
+    def same_domain_rules(self, source):
+        query = f"""
+            SELECT {RULE_COLUMNS}, MIN(ad.domain), COUNT(DISTINCT ad.domain) {RULE_JOINS}
+            JOIN change_domains ad ON ad.change = r.antecedent
+            JOIN change_domains cd ON cd.change = r.consequent AND cd.domain = ad.domain
+            WHERE r.source = (SELECT id FROM sources WHERE path = ?)
+            GROUP BY r.rowid ORDER BY r.rowid
+        """
+        return self.connection.execute(query, (os.path.abspath(source),))
+
+    # rules of changes without page are skipped
+    def rules_with_pages(self, sources):
+        query = f"""
+            SELECT a.change, ap.page_id, an.name, c.change, cp.page_id, cn.name, r.support, r.confidence, r.histogram
+            {RULE_JOINS}
+            JOIN key_pages ap ON ap.key = a.row JOIN page_names an ON an.page_id = ap.page_id
+            JOIN key_pages cp ON cp.key = c.row JOIN page_names cn ON cn.page_id = cp.page_id
+            WHERE r.source IN (SELECT id FROM sources WHERE path IN ({', '.join('?' * len(sources))}))
+            ORDER BY r.rowid
+        """
+        return self.connection.execute(query, [os.path.abspath(source) for source in sources])
+
+
+def rule_line(rule):
+    antecedent, consequent, support, confidence, lift, histogram, extra = rule[:7]
+    line = f'{antecedent};{consequent};{support};{confidence};{lift};"{histogram}"'
+    if extra:
+        line += f";{extra}"
+    return line + "\n"
+
+
+def parse_args():
+    chunk_default = 1000000
+
+    ap = argparse.ArgumentParser(description="Stores rules in an indexed SQLite database and queries them.")
+    subparsers = ap.add_subparsers(dest="mode", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Bulk-load rule files and mappings")
+    ingest.add_argument("database", type=str, help="SQLite database file")
+    ingest.add_argument("rule_files", type=str, nargs="*", help="Files with rules stored as csv")
+    ingest.add_argument(
+        "--level",
+        type=str,
+        choices=Entity.string_representations(),
+        help="Entity level of the changes, needed to tell columns and rows apart. Default column",
+        default=Entity.Column.to_str(),
+    )
+    ingest.add_argument("--table_domains", type=str, help="Index table -> domain (JSON)", default=None)
+    ingest.add_argument("--change_groups", type=str, help="Index change group -> changes (JSON)", default=None)
+    ingest.add_argument("--key_to_page", type=str, help="Index infobox key -> page id (JSON)", default=None)
+    ingest.add_argument("--page_to_name", type=str, help="Index page id -> page name (JSON)", default=None)
+    ingest.add_argument(
+        "--chunk_size", type=int, help=f"Rules read at once. Default {chunk_default}", default=chunk_default
+    )
+
+    query = subparsers.add_parser("query", help="Print matching rules as csv")
+    query.add_argument("database", type=str, help="SQLite database file")
+    query.add_argument("--antecedent", "-a", type=str, help="Antecedent change id", default=None)
+    query.add_argument("--consequent", "-c", type=str, help="Consequent change id", default=None)
+    query.add_argument("--table", type=str, help="Table / infobox of antecedent or consequent", default=None)
+    query.add_argument("--domain", type=str, help="Domain of antecedent or consequent", default=None)
+    query.add_argument("--min_support", type=int, help="Minimal absolute support", default=None)
+    query.add_argument("--min_confidence", type=float, help="Minimal confidence", default=None)
+    query.add_argument("--min_lift", type=float, help="Minimal lift", default=None)
+    query.add_argument("--source", type=str, nargs="*", help="Only rules of these rule files", default=None)
+    query.add_argument("--limit", type=int, help="Maximal number of rules", default=None)
+    args = vars(ap.parse_args())
+    # infobox keys are matched with the row of the changes
+    if args["mode"] == "ingest" and args["key_to_page"] and not args["level"] in ["row", "field"]:
+        ingest.error("--key_to_page needs changes with rows, use --level row or --level field")
+    return args
+
+
+def ingest(args):
+    level = Entity[args["level"].capitalize()]
+    with RuleStore(args["database"], level) as store:
+        for rule_file in args["rule_files"]:
+            print(f"{rule_file}: {store.ingest_rules(rule_file, args['chunk_size'])} rules")
+        if args["table_domains"]:
+            store.ingest_table_domains(load_json(args["table_domains"]))
+        if args["change_groups"]:
+            store.ingest_change_groups(load_json(args["change_groups"]))
+        if args["key_to_page"]:
+            store.ingest_key_pages(load_json(args["key_to_page"]))
+        if args["page_to_name"]:
+            store.ingest_page_names(load_json(args["page_to_name"]))
+
+
+def query(args):
+    with RuleStore(args["database"]) as store:
+        rules = store.rules(
+            antecedent=args["antecedent"],
+            consequent=args["consequent"],
+            table=args["table"],
+            domain=args["domain"],
+            min_support=args["min_support"],
+            min_confidence=args["min_confidence"],
+            min_lift=args["min_lift"],
+            sources=args["source"],
+            limit=args["limit"],
+        )
+        for rule in rules:
+            sys.stdout.write(rule_line(rule))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args["mode"] == "ingest":
+        ingest(args)
+    else:
+        query(args)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+
+# the run directory may be given by the user, so only the files of the run are ever deleted
+# and the directory itself only if the run created it
+class RunManifest:
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.config_file = os.path.join(run_dir, "run.json")
+        self.manifest_file = os.path.join(run_dir, "manifest.jsonl")
+        self.shard_dir = os.path.join(run_dir, "shards")
+
+    def exists(self):
+        return os.path.isfile(self.config_file)
+
+    # a directory that is not empty has to contain a previous run
+    def check_run_dir(self):
+        if os.path.isdir(self.run_dir) and os.listdir(self.run_dir) and not self.exists():
+            raise ValueError(f"{self.run_dir} is not empty and contains no run, choose another --run_dir")
+
+    def create(self, config):
+        self.check_run_dir()
+        created_run_dir = not os.path.isdir(self.run_dir) or (
+            self.exists() and self.load_config().get("created_run_dir", False)
+        )
+        self._remove_run_files()
+        os.makedirs(self.shard_dir)
+        write_json_atomic({**config, "created_run_dir": created_run_dir}, self.config_file)
+        open(self.manifest_file, "w").close()
+
+    def load_config(self):
+        with open(self.config_file) as f:
+            return json.load(f)
+
+    def shard_path(self, job_id):
+        return os.path.join(self.shard_dir, f"{job_id}.csv")
+
+    def partition_path(self, partition_index):
+        return os.path.join(self.run_dir, f"partition_{partition_index}.json")
+
+    def dictionary_path(self):
+        return os.path.join(self.run_dir, "changes.txt")
+
+    def write_shard(self, job_id, write_function):
+        # write to temporary file first s.t. a crash never leaves a partial shard behind
+        # one temporary file per writer, a reassigned job may be submitted by two workers at once
+        shard_file = self.shard_path(job_id)
+        tmp_file = f"{shard_file}.{os.getpid()}_{threading.get_ident()}.tmp"
+        with open(tmp_file, "w") as f:
+            write_function(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, shard_file)
+        return shard_file
+
+    def record(self, job_id, num_rules, worker, duration):
+        entry = {
+            "job": job_id,
+            "rules": num_rules,
+            "worker": worker.strip(),
+            "duration": round(duration, 3),
+            "finished": datetime.now().isoformat(),
+        }
+        with open(self.manifest_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed_jobs(self):
+        completed = dict()
+        if not os.path.isfile(self.manifest_file):
+            return completed
+        with open(self.manifest_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line may be incomplete if the process was killed while writing
+                    continue
+                if os.path.isfile(self.shard_path(entry["job"])):
+                    completed[entry["job"]] = entry
+        return completed
+
+    def assemble(self, output, job_ids):
+        tmp_output = f"{output}.tmp"
+        with open(tmp_output, "wb") as o:
+            for job_id in job_ids:
+                with open(self.shard_path(job_id), "rb") as f:
+                    shutil.copyfileobj(f, o)
+        os.replace(tmp_output, output)
+
+    def remove(self):
+        created_run_dir = self.load_config().get("created_run_dir", False)
+        self._remove_run_files()
+        if created_run_dir and not os.listdir(self.run_dir):
+            os.rmdir(self.run_dir)
+
+    def _remove_run_files(self):
+        if not os.path.isdir(self.run_dir):
+            return
+        if os.path.isdir(self.shard_dir):
+            shutil.rmtree(self.shard_dir)
+        run_files = [self.config_file, f"{self.config_file}.tmp", self.manifest_file, self.dictionary_path()]
+        for file_name in os.listdir(self.run_dir):
+            if re.fullmatch(r"partition_\d+\.json", file_name):
+                run_files.append(os.path.join(self.run_dir, file_name))
+        for file_name in run_files:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+
+def write_json_atomic(data, file_name):
+    tmp_file = f"{file_name}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, file_name)
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + f"{os.sep}..")
+from rule_generation.run_manifest import RunManifest
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Shows the progress of a (running or interrupted) rule mining run.")
+    ap.add_argument("run_dir", type=str, help="Run directory of create_histograms.py, usually <output>.run")
+    return vars(ap.parse_args())
+
+
+def main(run_dir):
+    manifest = RunManifest(run_dir)
+    if not manifest.exists():
+        print(f"No run manifest found at {run_dir}")
+        return
+
+    config = manifest.load_config()
+    completed_jobs = manifest.completed_jobs()
+    num_jobs = config["num_partitions"] ** 2
+    print("parameters:")
+    for key, value in config["parameters"].items():
+        print(f"    {key}: {value}")
+    print(f"input: {config['num_changes']} changes in {config['num_partitions']} partitions")
+    print(f"done: {len(completed_jobs)}/{num_jobs} partition combinations")
+    if not completed_jobs:
+        return
+
+    durations = [entry["duration"] for entry in completed_jobs.values()]
+    num_rules = sum([entry["rules"] for entry in completed_jobs.values()])
+    mean_duration = sum(durations) / len(durations)
+    print(f"rules so far: {num_rules}")
+    print(f"mean duration: {round(mean_duration, 3)} s per combination")
+    print(f"remaining work: {round(mean_duration * (num_jobs - len(completed_jobs)), 1)} s (single worker)")
+    print(f"last finished: {max([entry['finished'] for entry in completed_jobs.values()])}")
+
+    worker_jobs = defaultdict(int)
+    for entry in completed_jobs.values():
+        worker_jobs[entry["worker"]] += 1
+    for worker, count in sorted(worker_jobs.items()):
+        print(f"    worker {worker}: {count} combination(s)")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args["run_dir"])
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+from array import array
+
+from util.util import Entity
+
+
+class StringPool:
+    def __init__(self):
+        self._strings = list()
+        self._ids = dict()
+
+    def intern(self, string):
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._ids[string] = string_id
+            self._strings.append(string)
+        return string_id
+
+    def id(self, string):
+        return self._ids[string]
+
+    def get(self, string, default=None):
+        return self._ids.get(string, default)
+
+    def __getitem__(self, string_id):
+        return self._strings[string_id]
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __iter__(self):
+        return iter(self._strings)
+
+
+# change ids are <table>[_<column>][_<row>]_<type>, or group<n> for grouped changes (see preprocess_changes.py)
+# with three parts, the level decides whether the middle part is a column or a row
+def split_change_id(change, level=None):
+    parts = change.split("_")
+    if len(parts) == 1:
+        return change, "", "", ""
+    table, middle, change_type = parts[0], parts[1:-1], parts[-1]
+    if len(middle) == 0:
+        return table, "", "", change_type
+    if len(middle) == 1:
+        if level == Entity.Row:
+            return table, "", middle[0], change_type
+        return table, middle[0], "", change_type
+    return table, middle[0], "_".join(middle[1:]), change_type
+
+
+class ChangeDictionary:
+    def __init__(self, level=None):
+        self.level = level
+        self._changes = StringPool()
+        self.tables = StringPool()
+        self.columns = StringPool()
+        self.rows = StringPool()
+        self.types = StringPool()
+        self._table_ids = array("i")
+        self._column_ids = array("i")
+        self._row_ids = array("i")
+        self._type_ids = array("i")
+
+    def intern(self, change):
+        change_id = self._changes.get(change)
+        if change_id is not None:
+            return change_id
+        change_id = self._changes.intern(change)
+        table, column, row, change_type = split_change_id(change, self.level)
+        self._table_ids.append(self.tables.intern(table))
+        self._column_ids.append(self.columns.intern(column))
+        self._row_ids.append(self.rows.intern(row))
+        self._type_ids.append(self.types.intern(change_type))
+        return change_id
+
+    def id(self, change):
+        return self._changes.id(change)
+
+    def __getitem__(self, change_id):
+        return self._changes[change_id]
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __iter__(self):
+        return iter(self._changes)
+
+    def table_id(self, change_id):
+        return self._table_ids[change_id]
+
+    def column_id(self, change_id):
+        return self._column_ids[change_id]
+
+    def row_id(self, change_id):
+        return self._row_ids[change_id]
+
+    def table(self, change_id):
+        return self.tables[self._table_ids[change_id]]
+
+    def column(self, change_id):
+        return self.columns[self._column_ids[change_id]]
+
+    def row(self, change_id):
+        return self.rows[self._row_ids[change_id]]
+
+    def change_type(self, change_id):
+        return self.types[self._type_ids[change_id]]
+
+    def is_group(self, change_id):
+        return self._type_ids[change_id] == self.types.get("")
+
+    def save(self, file_name):
+        with open(file_name, "w", encoding="utf-8") as f:
+            for change in self._changes:
+                f.write(f"{change}\n")
+
+    @classmethod
+    def load(cls, file_name, level=None):
+        dictionary = cls(level)
+        with open(file_name, encoding="utf-8") as f:
+            for line in f:
+                dictionary.intern(line[:-1])
+        return dictionary
+
+    @classmethod
+    def from_changes(cls, changes, level=None):
+        dictionary = cls(level)
+        for change in changes:
+            dictionary.intern(change)
+        return dictionary
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import numpy as np
+from collections.abc import Mapping
+
+# binary layout of the index change -> occurrences (compressed sparse rows):
+#   changes.txt      change ids, one per line, position i is the change's number
+#   timepoints.json  sorted list of all distinct occurrences (dates)
+#   offsets.npy      int64, occurrences of change i are occurrences[offsets[i]:offsets[i + 1]]
+#   occurrences.npy  int32, positions in timepoints
+CSR_FORMAT_VERSION = 1
+
+
+class ChangeIndex(Mapping):
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != CSR_FORMAT_VERSION:
+            raise ValueError(f"Unsupported change index version {self.meta['version']} at {path}")
+        with open(os.path.join(path, "timepoints.json"), encoding="utf-8") as f:
+            self._timepoints = json.load(f)
+        self._offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._occurrences = np.load(os.path.join(path, "occurrences.npy"), mmap_mode="r")
+        self._changes = None
+        self._positions = None
+
+    def changes(self):
+        if self._changes is None:
+            with open(os.path.join(self.path, "changes.txt"), encoding="utf-8") as f:
+                self._changes = f.read().split("\n")[: len(self)]
+        return self._changes
+
+    def position(self, change):
+        if self._positions is None:
+            self._positions = {change: i for i, change in enumerate(self.changes())}
+        return self._positions[change]
+
+    def timepoints(self):
+        return self._timepoints
+
+    def occurrence_indexes_at(self, i):
+        return self._occurrences[self._offsets[i] : self._offsets[i + 1]]
+
+    def occurrence_indexes(self, change):
+        return self.occurrence_indexes_at(self.position(change))
+
+    def occurrences_at(self, i):
+        timepoints = self._timepoints
+        return [timepoints[t] for t in self.occurrence_indexes_at(i).tolist()]
+
+    def mapped_size(self):
+        return self._offsets.nbytes + self._occurrences.nbytes
+
+    def supports(self):
+        return np.diff(self._offsets)
+
+    def support(self, change):
+        i = self.position(change)
+        return int(self._offsets[i + 1] - self._offsets[i])
+
+    def __getitem__(self, change):
+        return self.occurrences_at(self.position(change))
+
+    def __contains__(self, change):
+        try:
+            self.position(change)
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        return iter(self.changes())
+
+    def items(self):
+        for i, change in enumerate(self.changes()):
+            yield change, self.occurrences_at(i)
+
+
+def is_change_index(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def load_change_index(path):
+    if is_change_index(path):
+        return ChangeIndex(path)
+    # not imported at module level, util.util is shadowed when scripts in util are run directly
+    from util.util import load_json
+
+    return load_json(path)
+
+
+def change_supports(all_changes):
+    if isinstance(all_changes, ChangeIndex):
+        return zip(all_changes.changes(), all_changes.supports().tolist())
+    return ((change, len(occurrences)) for change, occurrences in all_changes.items())
+
+
+def write_change_index(all_changes, path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    timepoints = sorted({occurrence for occurrences in all_changes.values() for occurrence in occurrences})
+    timepoint_positions = {timepoint: i for i, timepoint in enumerate(timepoints)}
+    offsets = np.zeros(len(all_changes) + 1, dtype=np.int64)
+    for i, occurrences in enumerate(all_changes.values()):
+        offsets[i + 1] = offsets[i] + len(occurrences)
+    occurrence_array = np.empty(offsets[-1], dtype=np.int32)
+    for i, occurrences in enumerate(all_changes.values()):
+        occurrence_array[offsets[i] : offsets[i + 1]] = [timepoint_positions[o] for o in occurrences]
+
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    np.save(os.path.join(path, "occurrences.npy"), occurrence_array)
+    with open(os.path.join(path, "changes.txt"), "w", encoding="utf-8") as f:
+        for change in all_changes.keys():
+            f.write(f"{change}\n")
+    with open(os.path.join(path, "timepoints.json"), "w", encoding="utf-8") as f:
+        json.dump(timepoints, f)
+    # meta is written last and marks the index as complete
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"version": CSR_FORMAT_VERSION, "changes": len(all_changes), "occurrences": int(offsets[-1])}, f)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Converts a JSON index change -> occurrences to the binary CSR format.")
+    ap.add_argument("change_file", type=str, help="JSON dictionary of changes with their occurrences")
+    ap.add_argument("--output", "-o", type=str, help="Output directory. Default <change_file>.csr", default=None)
+    return vars(ap.parse_args())
+
+
+def main(change_file, output):
+    if not output:
+        output = f"{os.path.splitext(change_file)[0]}.csr"
+    with open(change_file, encoding="utf-8") as f:
+        all_changes = json.load(f)
+    write_change_index(all_changes, output)
+    print(f"{len(all_changes)} changes written to {output}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args["change_file"], args["output"])
@@ -1,24 +1,59 @@
 import argparse
 import json
+from change_index import ChangeIndex, is_change_index
 from pympler import asizeof
+from util import Entity, Field
 
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Loads a JSON serialized Python object and prints its memory consumption.")
-    ap.add_argument("file", type=str, help="File path")
+    ap.add_argument("file", type=str, help="File path (JSON file, binary change index or change CSV)")
+    ap.add_argument(
+        "--fields",
+        type=str,
+        help="Load a change CSV (table;column;row per line) as set of fields of this entity level.",
+        choices=Entity.string_representations(),
+        default=None,
+    )
+    ap.add_argument("--interned", action="store_true", help="Intern the ids of the loaded fields.")
     return vars(ap.parse_args())
 
 
 def main():
     args = parse_args()
-    with open(args["file"]) as f:
-        data_structure = json.load(f)
+    if is_change_index(args["file"]):
+        index = ChangeIndex(args["file"])
+        print(f"Data type: {ChangeIndex} ({len(index)} entries)")
+        print("Memory-mapped arrays:")
+        print_size(index.mapped_size())
+        structure_size = asizeof.asizeof(index.changes()) + asizeof.asizeof(index.timepoints())
+        print("Change ids and timepoints:")
+        print_size(structure_size)
+        return
+
+    if args["fields"]:
+        entity = [entity for entity in Entity if entity.to_str() == args["fields"]][0]
+        data_structure = load_fields(args["file"], entity, args["interned"])
+    else:
+        with open(args["file"]) as f:
+            data_structure = json.load(f)
 
     data_type = type(data_structure)
     print(f"Data type: {data_type}", end="")
     print(f" ({len(data_structure)} entries)" if data_type in [dict, list] else "")
+    print_size(asizeof.asizeof(data_structure))
+
+
+def load_fields(file_name, entity, interned):
+    fields = set()
+    with open(file_name, encoding="utf-8") as f:
+        for line in f:
+            field_id = line.strip().split(";")
+            fields.add(Field.get_with_level(entity, field_id[0], field_id[1], field_id[2], interned=interned))
+    return fields
+
 
-    structure_size = asizeof.asizeof(data_structure)
+def print_size(structure_size):
     print(f"Size: {structure_size} B")
     for div, units in {1000: ["kB", "MB", "GB"], 1024: ["kiB", "MiB", "GiB"]}.items():
         print(
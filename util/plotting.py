@@ -0,0 +1,16 @@
+import seaborn as sns
+from matplotlib.ticker import FuncFormatter
+
+from util.util import format_number
+
+
+def number_formatter(decimals=0, sep="\u2009"):
+    return FuncFormatter(lambda x, p: format_number(x, decimals, sep))
+
+
+def markers():
+    return ["^", "X", "s", "D", ".", "o"]
+
+
+def colors():
+    return sns.color_palette("tab10")
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+from util.util import file_extension
+
+ARCHIVE_EXTENSIONS = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz"]
+
+
+def open_compressed(archive_file):
+    if archive_file.endswith((".gz", ".tgz")):
+        return gzip.open(archive_file, "rb")
+    if archive_file.endswith((".xz", ".txz")):
+        return lzma.open(archive_file, "rb")
+    return open(archive_file, "rb")
+
+
+# reads at most size bytes of f, closes f (and calls on_close) when closed
+class MemberFile(io.RawIOBase):
+    def __init__(self, f, size, on_close=None):
+        self.f = f
+        self.remaining = size
+        self.on_close = on_close
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.f.read(min(len(buffer), self.remaining))
+        buffer[: len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.f.close()
+            if self.on_close:
+                self.on_close()
+        super().close()
+
+
+# table files of one date in a zip or tar archive, members are found by their base name
+# compressed tar archives cannot be searched: opening a member, or reading one before the last read member,
+# decompresses the archive from the start, random access to single tables is only cheap for zip and plain tar
+class DayArchive:
+    # members of a tar archive as base name -> (offset, size) from a previous scan, s.t. it is not scanned again
+    def __init__(self, archive_file, extension, members=None):
+        self.archive_file = archive_file
+        self.is_zip = archive_file.endswith(".zip")
+        self.lock = threading.Lock()
+        # number of leases by SnapshotSource, an evicted archive is closed when the last lease is released
+        self.leases = 0
+        self.evicted = False
+        # base name -> (member, uncompressed size), in archive order
+        self.members = dict()
+        if self.is_zip:
+            self.zip = zipfile.ZipFile(archive_file)
+            for info in self.zip.infolist():
+                name = os.path.basename(info.filename)
+                if name.endswith(extension) and not info.is_dir():
+                    self.members.setdefault(name, (info, info.file_size))
+        elif members is None:
+            # one streaming pass for the member offsets, compressed tar files cannot be searched
+            with tarfile.open(archive_file, "r|*") as tar:
+                for info in tar:
+                    name = os.path.basename(info.name)
+                    if name.endswith(extension) and info.isfile():
+                        self.members.setdefault(name, (info.offset_data, info.size))
+        else:
+            self.members = members
+        self.tar = None
+
+    def open(self, name):
+        member, size = self.members[name]
+        if self.is_zip:
+            return self.zip.open(member)
+        # a separate decompressor, s.t. a member can be streamed while others are read
+        # it decompresses the archive up to the member
+        f = open_compressed(self.archive_file)
+        f.seek(member)
+        return io.BufferedReader(MemberFile(f, size))
+
+    def read(self, name):
+        member, size = self.members[name]
+        if self.is_zip:
+            with self.zip.open(member) as f:
+                return f.read()
+        # keep one decompressor per archive, reading members in archive order only decompresses forward
+        # a member before the last read one rewinds it to the start
+        with self.lock:
+            if self.tar is None:
+                self.tar = open_compressed(self.archive_file)
+            self.tar.seek(member)
+            return self.tar.read(size)
+
+    # yields (name, binary file object) in archive order, the file object is only valid until the next one
+    def iter_members(self):
+        if self.is_zip:
+            for name, (member, _) in self.members.items():
+                with self.zip.open(member) as f:
+                    yield name, f
+            return
+        names = set(self.members)
+        with tarfile.open(self.archive_file, "r|*") as tar:
+            for info in tar:
+                name = os.path.basename(info.name)
+                if name in names and info.isfile():
+                    names.remove(name)
+                    yield name, tar.extractfile(info)
+
+    def close(self):
+        with self.lock:
+            if self.is_zip:
+                self.zip.close()
+            elif self.tar:
+                self.tar.close()
+                self.tar = None
+
+
+# table snapshots of a data lake, per date either in a directory <date> or in an archive <date>.zip, <date>.tar.gz, ...
+# snapshot files are addressed by their path as if the archives were extracted
+# archives are leased while they are read, s.t. evicting an archive never closes it under another thread
+# tar member offsets are kept (and passed to other processes), s.t. each tar archive is scanned once
+class SnapshotSource:
+    def __init__(self, path, extension=None, max_open=16):
+        self.path = path
+        self.extension = file_extension() if extension is None else extension
+        self.max_open = max_open
+        self._archives = OrderedDict()
+        # date -> base name -> (offset, size) of the members of tar archives
+        self._tar_members = dict()
+        self._lock = threading.Lock()
+
+    # open archives are not passed to other processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_archives"] = OrderedDict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # dates with a directory or archive
+    def dates(self):
+        dates = set()
+        for entry in os.scandir(self.path):
+            if entry.is_dir():
+                dates.add(entry.name)
+            else:
+                for archive_extension in ARCHIVE_EXTENSIONS:
+                    if entry.name.endswith(archive_extension):
+                        dates.add(entry.name[: -len(archive_extension)])
+        return sorted(dates)
+
+    # archive of a date, None if there is a directory or nothing
+    def archive_file(self, date):
+        if os.path.isdir(os.path.join(self.path, date)):
+            return None
+        for archive_extension in ARCHIVE_EXTENSIONS:
+            archive_file = os.path.join(self.path, f"{date}{archive_extension}")
+            if os.path.isfile(archive_file):
+                return archive_file
+        return None
+
+    def is_archived(self, date):
+        return not self.archive_file(date) is None
+
+    # member offsets of the tar archive of a date, None if it is not a tar archive or was not scanned
+    def tar_members(self, date):
+        with self._lock:
+            return self._tar_members.get(date)
+
+    # known member offsets of the tar archive of a date (e.g., stored with the table listings), None to scan again
+    def set_tar_members(self, date, members):
+        with self._lock:
+            if members is None:
+                self._tar_members.pop(date, None)
+            else:
+                self._tar_members[date] = members
+
+    # modification time of the directory or archive of a date, None if there is none
+    def mtime(self, date):
+        date_path = os.path.join(self.path, date)
+        if os.path.isdir(date_path):
+            return os.stat(date_path).st_mtime_ns
+        archive_file = self.archive_file(date)
+        return None if archive_file is None else os.stat(archive_file).st_mtime_ns
+
+    # table files and their (uncompressed) sizes of a date, None if there is no date
+    def list(self, date):
+        date_path = os.path.join(self.path, date)
+        if os.path.isdir(date_path):
+            entries = [entry for entry in os.scandir(date_path) if entry.name.endswith(self.extension)]
+            return [entry.name for entry in entries], [entry.stat().st_size for entry in entries]
+        archive = self._acquire(date)
+        if archive is None:
+            return None
+        try:
+            return list(archive.members), [size for _, size in archive.members.values()]
+        finally:
+            self._release(archive)
+
+    # the archive stays leased until the returned file is closed
+    def open(self, file_name):
+        date, name = self._split(file_name)
+        archive = self._acquire(date)
+        if archive is None:
+            return open(file_name, "rb")
+        try:
+            f = archive.open(name)
+        except BaseException:
+            self._release(archive)
+            raise
+        return io.BufferedReader(MemberFile(f, archive.members[name][1], lambda: self._release(archive)))
+
+    def read(self, file_name):
+        date, name = self._split(file_name)
+        archive = self._acquire(date)
+        if archive is None:
+            with open(file_name, "rb") as f:
+                return f.read()
+        try:
+            return archive.read(name)
+        finally:
+            self._release(archive)
+
+    def size(self, file_name):
+        date, name = self._split(file_name)
+        archive = self._acquire(date)
+        if archive is None:
+            return os.path.getsize(file_name)
+        try:
+            return archive.members[name][1]
+        finally:
+            self._release(archive)
+
+    # yields (table file, binary file object) of a date, the file object is only valid until the next one
+    def iter_tables(self, date):
+        date_path = os.path.join(self.path, date)
+        if os.path.isdir(date_path):
+            for name in os.listdir(date_path):
+                if name.endswith(self.extension):
+                    with open(os.path.join(date_path, name), "rb") as f:
+                        yield name, f
+            return
+        archive = self._acquire(date)
+        if archive is None:
+            return
+        try:
+            yield from archive.iter_members()
+        finally:
+            self._release(archive)
+
+    def _split(self, file_name):
+        date_path, name = os.path.split(file_name)
+        return os.path.basename(date_path), name
+
+    # the archive of a date with one more lease, None if the date is not archived
+    def _acquire(self, date):
+        with self._lock:
+            if date in self._archives:
+                self._archives.move_to_end(date)
+                archive = self._archives[date]
+                archive.leases += 1
+                return archive
+            archive_file = self.archive_file(date)
+            if archive_file is None:
+                return None
+            if len(self._archives) >= self.max_open:
+                _, evicted = self._archives.popitem(last=False)
+                self._evict(evicted)
+            archive = DayArchive(archive_file, self.extension, self._tar_members.get(date))
+            if not archive.is_zip:
+                self._tar_members[date] = archive.members
+            archive.leases += 1
+            self._archives[date] = archive
+            return archive
+
+    def _release(self, archive):
+        with self._lock:
+            archive.leases -= 1
+            if archive.evicted and archive.leases == 0:
+                archive.close()
+
+    # archives in use are closed by their last release
+    def _evict(self, archive):
+        archive.evicted = True
+        if archive.leases == 0:
+            archive.close()
+
+    def close(self):
+        with self._lock:
+            for archive in self._archives.values():
+                self._evict(archive)
+            self._archives.clear()
@@ -1,20 +1,126 @@
-import pandas as pd
-import seaborn as sns
+import hashlib
+import json
+import os
+import pickle
 import sys
-from collections import defaultdict
+from datetime import date, timedelta
 from enum import Enum, auto, unique
-from matplotlib.ticker import FuncFormatter
 
+# numpy and pandas are only imported by the rule column loader, plotting helpers live in util.plotting
+# s.t. pipeline scripts and their (spawned) workers do not import the plotting stack
 
+
+def __getattr__(name):
+    if name in ["number_formatter", "markers", "colors"]:
+        from util import plotting
+
+        return getattr(plotting, name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
+# all dates from start to end (both inclusive) as ISO strings, times of day are ignored
 def date_range(start, end):
-    timestamps = pd.date_range(start, end).tolist()
-    return [timestamp.date().isoformat() for timestamp in timestamps]
+    start_date = date.fromisoformat(start[:10])
+    end_date = date.fromisoformat(end[:10])
+    return [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
 
 
 def file_extension():
     return ".json?"
 
 
+# parsed JSON files are cached as pickle in MINING_CACHE_DIR (set it empty to disable caching)
+# entries are keyed by path, size and modification time, evicted least recently used above MINING_CACHE_SIZE MiB
+def json_cache_dir():
+    return os.environ.get("MINING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "mining-change-rules"))
+
+
+def json_cache_size():
+    return int(os.environ.get("MINING_CACHE_SIZE", 10240)) * 1024**2
+
+
+# smaller files are parsed faster than unpickled from disk
+def json_cache_min_size():
+    return 1024**2
+
+
+# hash of the first and last block, detects rewrites that keep size and modification time
+def sample_hash(file_name, file_size, block_size=65536):
+    sha = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        sha.update(f.read(block_size))
+        if file_size > block_size:
+            f.seek(max(block_size, file_size - block_size))
+            sha.update(f.read(block_size))
+    return sha.hexdigest()
+
+
+def load_json(file_name, use_cache=True):
+    stat = os.stat(file_name)
+    cache_dir = json_cache_dir()
+    if not (use_cache and cache_dir and stat.st_size >= json_cache_min_size()):
+        with open(file_name, encoding="utf-8") as f:
+            return json.load(f)
+
+    key = hashlib.sha1(f"{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, f"{key}.pickle")
+    content_hash = sample_hash(file_name, stat.st_size)
+    try:
+        with open(cache_file, "rb") as f:
+            if pickle.load(f) == content_hash:
+                data = pickle.load(f)
+                os.utime(cache_file)
+                return data
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    with open(file_name, encoding="utf-8") as f:
+        data = share_strings(json.load(f), dict())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(content_hash, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        evict_json_cache(cache_dir, json_cache_size())
+    except OSError as e:
+        print(f"[WARNING] Could not cache {file_name}: {e}")
+    return data
+
+
+# equal strings (e.g., dates of occurrences) become one object, pickle then stores them only once
+def share_strings(data, strings):
+    if isinstance(data, str):
+        return strings.setdefault(data, data)
+    if isinstance(data, list):
+        return [share_strings(value, strings) for value in data]
+    if isinstance(data, dict):
+        return {key: share_strings(value, strings) for key, value in data.items()}
+    return data
+
+
+def evict_json_cache(cache_dir, max_size):
+    entries = list()
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith(".pickle"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, file_name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file_name))
+    cache_size = sum([size for _, size, _ in entries])
+    for _, size, file_name in sorted(entries):
+        if cache_size <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, file_name))
+        except FileNotFoundError:
+            pass
+        cache_size -= size
+
+
 def read_rule(line):
     parts = line.strip().split(";")
     antecedent = parts[0]
@@ -31,29 +137,98 @@ def read_rule(line):
     return antecedent, consequent, result
 
 
-def read_rules(file_name):
-    result = defaultdict(dict)
-    with open(file_name) as f:
-        for line in f:
-            antecedent, consequent, hist = read_rule(line)
-            result[antecedent][consequent] = hist
-    return result
+class RuleColumns:
+    def __init__(self, antecedents, consequents, support, confidence, lift, histograms, extra):
+        self.antecedents = antecedents
+        self.consequents = consequents
+        self.support = support
+        self.confidence = confidence
+        self.lift = lift
+        self.histograms = histograms
+        # additional columns, e.g., domain of filter_domains.py
+        self.extra = extra
 
+    def __len__(self):
+        return len(self.support)
+
+    def columns(self):
+        return [
+            self.antecedents,
+            self.consequents,
+            self.support,
+            self.confidence,
+            self.lift,
+            self.histograms,
+            self.extra,
+        ]
 
-def format_number(value, decimals=0, sep="\u2009"):
-    return f"{value:,.{decimals}f}".replace(",", sep)
 
+def rule_column_names():
+    return ["antecedent", "consequent", "support", "confidence", "lift", "histogram"]
 
-def number_formatter(decimals=0, sep="\u2009"):
-    return FuncFormatter(lambda x, p: format_number(x, decimals, sep))
 
+# histograms are stored as "[1, 2, 3]", all rules of a file have the same number of bins
+def parse_histograms(histograms):
+    import numpy as np
+
+    num_values = histograms.str.count(",").to_numpy() + 1
+    if len(histograms) > 0 and (num_values != num_values[0]).any():
+        raise ValueError("Rules have histograms with different numbers of bins.")
+    values = np.fromstring(histograms.str.slice(1, -1).str.cat(sep=","), dtype=np.int64, sep=",")
+    return values.reshape(len(histograms), num_values[0] if len(histograms) > 0 else 0)
+
+
+# reads rules in chunks of chunk_size rows, antecedents and consequents are interned if a dictionary is given
+def iter_rule_columns(file_name, chunk_size=1000000, dictionary=None):
+    import numpy as np
+    import pandas as pd
+
+    with open(file_name) as f:
+        first_line = f.readline()
+    if not first_line.strip():
+        return
+    names = rule_column_names()
+    extra_names = [f"extra_{i}" for i in range(len(first_line.split(";")) - len(names))]
+    types = {"antecedent": str, "consequent": str, "support": np.int64, "confidence": np.float64, "lift": np.float64}
+    chunks = pd.read_csv(
+        file_name,
+        sep=";",
+        header=None,
+        names=names + extra_names,
+        dtype={**types, "histogram": str, **{name: str for name in extra_names}},
+        keep_default_na=False,
+        float_precision="round_trip",
+        chunksize=chunk_size,
+    )
+    for chunk in chunks:
+        antecedents = chunk["antecedent"].to_numpy(dtype=object)
+        consequents = chunk["consequent"].to_numpy(dtype=object)
+        if dictionary is not None:
+            antecedents = np.fromiter(map(dictionary.intern, antecedents), dtype=np.int64, count=len(chunk))
+            consequents = np.fromiter(map(dictionary.intern, consequents), dtype=np.int64, count=len(chunk))
+        yield RuleColumns(
+            antecedents,
+            consequents,
+            chunk["support"].to_numpy(),
+            chunk["confidence"].to_numpy(),
+            chunk["lift"].to_numpy(),
+            parse_histograms(chunk["histogram"]),
+            chunk[extra_names].to_numpy(dtype=object),
+        )
 
-def markers():
-    return ["^", "X", "s", "D", ".", "o"]
 
+def read_rule_columns(file_name, chunk_size=1000000, dictionary=None):
+    import numpy as np
 
-def colors():
-    return sns.color_palette("tab10")
+    chunks = [chunk.columns() for chunk in iter_rule_columns(file_name, chunk_size, dictionary)]
+    if not chunks:
+        empty = [np.empty(0, dtype=object)] * 2 + [np.empty(0, dtype=t) for t in [np.int64, np.float64, np.float64]]
+        return RuleColumns(*empty, np.empty((0, 0), dtype=np.int64), np.empty((0, 0), dtype=object))
+    return RuleColumns(*[np.concatenate(columns) for columns in zip(*chunks)])
+
+
+def format_number(value, decimals=0, sep="\u2009"):
+    return f"{value:,.{decimals}f}".replace(",", sep)
 
 
 @unique
@@ -71,7 +246,9 @@ class Entity(Enum):
         return super().name.lower()
 
 
+# fields are not changed after creation, s.t. the hash can be cached
 class Field:
+    __slots__ = ("table", "column", "row", "_hash")
     table: str
     column: str
     row: str  # allows row number or primary key
@@ -80,22 +257,45 @@ class Field:
         self.table = table
         self.column = column
         self.row = row
+        self._hash = hash((table, column, row))
 
     def __eq__(self, other):
-        return self.table == other.table and self.column == other.column and self.row == other.row
+        if not isinstance(other, Field):
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and self.table == other.table
+            and self.column == other.column
+            and self.row == other.row
+        )
 
     def __hash__(self):
-        return hash((self.table, self.column, self.row))
+        return self._hash
+
+    def __repr__(self):
+        return f"Field({self.table!r}, {self.column!r}, {self.row!r})"
+
+    def __getstate__(self):
+        return self.table, self.column, self.row
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    # ids are interned, s.t. fields of the same table, column or row share their id strings
+    @classmethod
+    def interned(cls, table, column, row):
+        return cls(*[part if part is None else sys.intern(part) for part in [table, column, row]])
 
     @classmethod
-    def get_with_level(cls, level, table, column, row):
+    def get_with_level(cls, level, table, column, row, interned=False):
+        create = cls.interned if interned else cls
         if level == Entity.Table:
-            return cls(table, "", "")
+            return create(table, "", "")
         if level == Entity.Column:
-            return cls(table, column, "")
+            return create(table, column, "")
         if level == Entity.Row:
-            return cls(table, "", row)
-        return cls(table, column, row)
+            return create(table, "", row)
+        return create(table, column, row)
 
     @classmethod
     def get_csv_header(cls, level: Entity) -> str: